@@ -0,0 +1,307 @@
+"""HTTP JSON API lokal untuk integrasi bulk (payroll, timesheet).
+
+Jalan sebagai proses terpisah di samping aplikasi Streamlit dan memakai
+service.py secara langsung:
+
+    HRMS_API_TOKEN=rahasia python api.py --port 8578
+
+Semua endpoint (kecuali /health) butuh header ``Authorization: Bearer <token>``.
+
+    GET  /health
+    GET  /requests?status=&from=YYYY-MM-DD&to=YYYY-MM-DD&after_id=0&limit=500
+    POST /balances    {"year": 2026, "user_ids": [..], "emails": [..]}
+    POST /leave       {"items": [{"user_id"|"email", "start_date", "end_date", "reason"}]}
+    POST /changeoff   {"items": [{"user_id"|"email", "departure_date", "return_date", "location", "pic",
+                                  "job_execution", "activities": [..],
+                                  "timesheet": {"filename", "content_base64"} | "timesheet_path" (di UPLOAD_DIR)}]}
+    POST /decisions   {"items": [{"request_id", "stage": "MANAGER"|"HR", "actor_id"|"actor_email", "approve"}]}
+
+Endpoint batch memproses semua item dalam satu transaksi; item yang gagal
+dilaporkan per index tanpa membatalkan item lain.
+"""
+import os
+import sys
+import json
+import base64
+import hmac
+import sqlite3
+import argparse
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import service
+
+# -------------------- Konfigurasi --------------------
+API_HOST = os.environ.get("HRMS_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("HRMS_API_PORT", 8578))
+API_TOKEN = os.environ.get("HRMS_API_TOKEN", "")
+API_MAX_BODY_BYTES = int(os.environ.get("HRMS_API_MAX_BODY_BYTES", 64 * 1024 * 1024))  # 64 MB
+API_MAX_PAGE = 5000
+API_MAX_BATCH = int(os.environ.get("HRMS_API_MAX_BATCH", 10000))
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _parse_date(value, field: str) -> date:
+    try:
+        return date.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{field} harus berformat YYYY-MM-DD")
+
+def _batch_items(body: dict) -> list:
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        raise ApiError(400, "items wajib berupa list yang tidak kosong")
+    if len(items) > API_MAX_BATCH:
+        raise ApiError(413, f"Maksimal {API_MAX_BATCH} item per batch")
+    return items
+
+def _resolve_ids(items: list, id_field: str, email_field: str) -> dict:
+    """Lengkapi id dari email untuk semua item dengan satu query."""
+    return service.resolve_user_ids([it.get(email_field) for it in items
+                                     if isinstance(it, dict) and it.get(id_field) is None])
+
+def _item_user_id(item: dict, by_email: dict, id_field: str = "user_id", email_field: str = "email"):
+    if item.get(id_field) is not None:
+        return int(item[id_field])
+    uid = by_email.get(item.get(email_field))
+    if uid is None:
+        raise service.NotFound(f"User tidak ditemukan: {item.get(email_field)}")
+    return uid
+
+def _batch_response(results: list, errors: dict) -> dict:
+    """Gabungkan hasil service dengan error pra-validasi (per index item asli)."""
+    merged = dict(errors)
+    for res, index in results:
+        merged[index] = {"index": index, "ok": res.ok, "request_id": res.request_id, "error": res.error}
+    out = [merged[i] for i in sorted(merged)]
+    return {"results": out, "ok": sum(1 for r in out if r["ok"]), "failed": sum(1 for r in out if not r["ok"])}
+
+def _upload_path(path: str) -> str:
+    """timesheet_path hanya boleh menunjuk file yang sudah ada di UPLOAD_DIR."""
+    upload_dir = os.path.realpath(service.UPLOAD_DIR)
+    real = os.path.realpath(path)
+    if os.path.commonpath([upload_dir, real]) != upload_dir or not os.path.isfile(real):
+        raise ApiError(400, "timesheet_path harus file yang sudah diupload ke server")
+    return real
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _run_prepared(items: list, prepare, batch_fn) -> dict:
+    prepared, errors = [], {}
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ApiError(400, "item harus berupa object")
+            prepared.append((i, prepare(item)))
+        except (ApiError, service.ServiceError, KeyError, TypeError, ValueError) as e:
+            errors[i] = {"index": i, "ok": False, "request_id": None, "error": str(e)}
+    results = batch_fn([p for _, p in prepared]) if prepared else []
+    return _batch_response([(r, prepared[r.index][0]) for r in results], errors)
+
+# -------------------- Handlers --------------------
+def handle_list_requests(query: dict) -> dict:
+    def first(name):
+        values = query.get(name)
+        return values[0] if values else None
+    limit = max(1, min(int(first("limit") or 500), API_MAX_PAGE))
+    after_id = int(first("after_id") or 0)
+    date_from = _parse_date(first("from"), "from") if first("from") else None
+    date_to = _parse_date(first("to"), "to") if first("to") else None
+    items = service.list_requests_page(first("status"), date_from, date_to, after_id=after_id, limit=limit)
+    next_after_id = items[-1]["id"] if len(items) == limit else None
+    return {"items": items, "next_after_id": next_after_id}
+
+def handle_balances(body: dict) -> dict:
+    year = int(body.get("year") or service.current_year())
+    user_ids = [int(u) for u in body.get("user_ids") or []]
+    emails = body.get("emails") or []
+    if emails:
+        user_ids.extend(service.resolve_user_ids(emails).values())
+    if len(user_ids) > API_MAX_BATCH:
+        raise ApiError(413, f"Maksimal {API_MAX_BATCH} user per request")
+    return {"year": year, "items": service.balances(user_ids, year)}
+
+def handle_leave(body: dict) -> dict:
+    items = _batch_items(body)
+    by_email = _resolve_ids(items, "user_id", "email")
+
+    def prepare(item):
+        return {
+            "user_id": _item_user_id(item, by_email),
+            "start": _parse_date(item.get("start_date"), "start_date"),
+            "end": _parse_date(item.get("end_date"), "end_date"),
+            "reason": item.get("reason") or "PERSONAL",
+        }
+    return _run_prepared(items, prepare, service.submit_leave_batch)
+
+def handle_changeoff(body: dict) -> dict:
+    items = _batch_items(body)
+    by_email = _resolve_ids(items, "user_id", "email")
+    saved = {}  # id(item) → file timesheet base64 yang sudah ditulis
+
+    def prepare(item):
+        user_id = _item_user_id(item, by_email)
+        departure_date = _parse_date(item.get("departure_date"), "departure_date")
+        return_date = _parse_date(item.get("return_date"), "return_date")
+        timesheet_path = item.get("timesheet_path")
+        if timesheet_path:
+            timesheet_path = _upload_path(str(timesheet_path))
+        ts = item.get("timesheet")
+        if ts:
+            try:
+                data = base64.b64decode(ts["content_base64"], validate=True)
+            except (KeyError, TypeError, ValueError):
+                raise ApiError(400, "timesheet.content_base64 tidak valid")
+            timesheet_path = service.save_file(os.path.basename(ts.get("filename") or "timesheet.bin"), data)
+            saved[id(item)] = timesheet_path
+        return {
+            "user_id": user_id,
+            "departure_date": departure_date,
+            "return_date": return_date,
+            "activities": item.get("activities") or [],
+            "location": item.get("location"),
+            "pic": item.get("pic"),
+            "job_exec": item.get("job_execution"),
+            "timesheet_path": timesheet_path,
+        }
+    try:
+        response = _run_prepared(items, prepare, service.submit_changeoff_batch)
+    except BaseException:
+        _remove_files(saved.values())
+        raise
+    # File milik item yang gagal (validasi/rollback savepoint) tidak dirujuk request mana pun
+    failed = {id(items[r["index"]]) for r in response["results"] if not r["ok"]}
+    _remove_files(path for key, path in saved.items() if key in failed)
+    return response
+
+def handle_decisions(body: dict) -> dict:
+    items = _batch_items(body)
+    by_email = _resolve_ids(items, "actor_id", "actor_email")
+
+    def prepare(item):
+        return {
+            "request_id": int(item["request_id"]),
+            "stage": item.get("stage"),
+            "actor_id": _item_user_id(item, by_email, "actor_id", "actor_email"),
+            "approve": bool(item.get("approve")),
+        }
+    return _run_prepared(items, prepare, service.decide_batch)
+
+POST_ROUTES = {
+    "/balances": handle_balances,
+    "/leave": handle_leave,
+    "/changeoff": handle_changeoff,
+    "/decisions": handle_decisions,
+}
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "HRMS-API/1.0"
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _check_auth(self):
+        header = self.headers.get("Authorization", "")
+        token = header[7:] if header.startswith("Bearer ") else ""
+        if not hmac.compare_digest(token.encode(), API_TOKEN.encode()):
+            raise ApiError(401, "Unauthorized")
+
+    def _read_json(self) -> dict:
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise ApiError(400, "Content-Length tidak valid")
+        if length < 0:
+            raise ApiError(400, "Content-Length tidak valid")
+        if length > API_MAX_BODY_BYTES:
+            raise ApiError(413, "Body terlalu besar")
+        raw = self.rfile.read(length) if length else b"{}"
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            raise ApiError(400, "Body harus JSON yang valid")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Body harus berupa JSON object")
+        return body
+
+    def _dispatch(self, fn):
+        try:
+            self._send_json(200, fn())
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)})
+        except service.NotFound as e:
+            self._send_json(404, {"error": str(e)})
+        except service.NotAuthorized as e:
+            self._send_json(403, {"error": str(e)})
+        except service.DatabaseUnavailable as e:
+            self._send_json(503, {"error": str(e)})
+        except service.ServiceError as e:
+            self._send_json(400, {"error": str(e)})
+        except sqlite3.OperationalError as e:
+            # Mis. "database is locked": sementara, klien boleh mengulang
+            self._send_json(503, {"error": f"Database sedang tidak tersedia: {e}"})
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_json(400, {"error": f"Input tidak valid: {e!r}"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._send_json(200, {"status": "ok"})
+            return
+        if url.path != "/requests":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        def run():
+            self._check_auth()
+            return handle_list_requests(parse_qs(url.query))
+        self._dispatch(run)
+
+    def do_POST(self):
+        handler = POST_ROUTES.get(urlparse(self.path).path)
+        if not handler:
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        def run():
+            self._check_auth()
+            return handler(self._read_json())
+        self._dispatch(run)
+
+    def log_message(self, format, *args):
+        sys.stderr.write("[api] %s - %s\n" % (self.address_string(), format % args))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRMS local JSON API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args(argv)
+    if not API_TOKEN:
+        parser.error("HRMS_API_TOKEN wajib di-set sebelum menjalankan API.")
+    service.init_db()
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    server.daemon_threads = True
+    print(f"HRMS API listening on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,37 @@
 import os
-import uuid
-import hashlib
-import sqlite3
 import base64
+import hashlib
 import html
+import io
 import mimetypes
 import json
-from datetime import datetime, date, time, timedelta
-from typing import Optional, Tuple
+from datetime import date, time, timedelta
+from time import perf_counter
+from typing import Optional
 
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 
+import dbtrace
+import archive
+import backup
+import jobs
+import letters
+import maintenance
+import metrics
+import notifications
+import passwords
+import preview
+import reports
+import rollover
+import service
+import team_calendar
+import thumbnails
+import timesheet
+import user_import
+from service import ServiceError, current_year
+
 # Opsional: kalender hari libur nasional
 try:
     import holidays as pyholidays
@@ -30,664 +49,73 @@ if "initialized" not in st.session_state:
     })
 
 # -------------------- Konfigurasi --------------------
-DB_PATH = os.environ.get("HRMS_DB_PATH", "data/hrms.db")
-UPLOAD_DIR = os.environ.get("HRMS_UPLOAD_DIR", "uploads")
+# DB_PATH / UPLOAD_DIR dikelola di service.py (HRMS_DB_PATH, HRMS_UPLOAD_DIR)
 BASE64_SIZE_WARN_BYTES = int(os.environ.get("HRMS_BASE64_WARN_BYTES", 5 * 1024 * 1024))  # 5 MB
-TEXT_PREVIEW_MAX_BYTES = int(os.environ.get("HRMS_TEXT_PREVIEW_MAX_BYTES", 200 * 1024))  # 200 KB
-
-# -------------------- DB Helpers --------------------
-def get_conn():
-    try:
-        # Pastikan directory untuk database exists
-        db_dir = os.path.dirname(DB_PATH)
-        if db_dir and not os.path.exists(db_dir):
-            os.makedirs(db_dir, exist_ok=True)
-            
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        try:
-            conn.execute("PRAGMA foreign_keys = ON;")
-        except Exception:
-            pass
-        
-        # Set flag bahwa kita menggunakan database file
-        st.session_state.in_memory_db = False
-        return conn
-        
-    except sqlite3.OperationalError as e:
-        st.error(f"Database error: {e}")
-        # Fallback ke in-memory database untuk emergency
-        st.warning("Using temporary in-memory database. Changes will not persist!")
-        
-        # Buat koneksi in-memory
-        conn = sqlite3.connect(":memory:", check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        
-        # Set flag bahwa kita menggunakan in-memory database
-        st.session_state.in_memory_db = True
-        st.session_state.db_initialized = False  # Reset flag inisialisasi
-        
-        # Inisialisasi schema untuk in-memory database
-        init_in_memory_db(conn)
-        
-        return conn
-
-def init_in_memory_db(conn):
-    """Inisialisasi schema untuk in-memory database"""
-    try:
-        cur = conn.cursor()
-        
-        # users table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            name TEXT NOT NULL,
-            role TEXT NOT NULL CHECK(role IN ('EMPLOYEE','MANAGER','HR_ADMIN')),
-            manager_id INTEGER,
-            password_hash TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            division TEXT,
-            FOREIGN KEY(manager_id) REFERENCES users(id)
-        );
-        """)
-        
-        # quotas table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS quotas(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            year INTEGER NOT NULL,
-            leave_total INTEGER NOT NULL DEFAULT 12,
-            leave_used INTEGER NOT NULL DEFAULT 0,
-            changeoff_earned INTEGER NOT NULL DEFAULT 0,
-            changeoff_used INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            UNIQUE(user_id, year),
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        );
-        """)
-        
-        # requests table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS requests(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            type TEXT NOT NULL CHECK(type IN ('LEAVE','CHANGEOFF')),
-            start_date TEXT,
-            end_date TEXT,
-            single_date TEXT,
-            hours INTEGER,
-            reason TEXT,
-            status TEXT NOT NULL CHECK(status IN ('PENDING_MANAGER','PENDING_HR','APPROVED','REJECTED')),
-            manager_by INTEGER,
-            manager_at TEXT,
-            hr_by INTEGER,
-            hr_at TEXT,
-            timesheet_path TEXT,
-            location TEXT,
-            activity TEXT,
-            pic TEXT,
-            job_execution TEXT,
-            payload_json TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            file_uploaded BOOLEAN DEFAULT 0,
-            activity_start_time TEXT,
-            activity_end_time TEXT,
-            departure_date TEXT,
-            return_date TEXT,
-            activities_json TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(manager_by) REFERENCES users(id),
-            FOREIGN KEY(hr_by) REFERENCES users(id)
-        );
-        """)
-        
-        # Seed default users untuk in-memory database
-        cur.execute("SELECT COUNT(1) AS c FROM users;")
-        result = cur.fetchone()
-        count = result[0] if isinstance(result, (list, tuple)) else result['c']
-        
-        if count == 0:
-            now = datetime.utcnow().isoformat()
-            def hpw(p): return hashlib.sha256(p.encode()).hexdigest()
-            
-            # Insert manager
-            cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
-                           VALUES(?,?,?,?,?,?,?,?)""",
-                        ("manager@example.com", "Manager One", "MANAGER", None, hpw("password"), now, now, "Engineering"))
-            manager_id = cur.lastrowid
-            
-            # Insert employee
-            cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
-                           VALUES(?,?,?,?,?,?,?,?)""",
-                        ("employee@example.com", "Employee One", "EMPLOYEE", manager_id, hpw("password"), now, now, "Engineering"))
-            
-            # Insert HR
-            cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
-                           VALUES(?,?,?,?,?,?,?,?)""",
-                        ("hr@example.com", "HR Admin", "HR_ADMIN", None, hpw("password"), now, now, "Human Resources"))
-            
-            # Get employee ID untuk quota
-            cur.execute("SELECT id FROM users WHERE email=?", ("employee@example.com",))
-            emp_result = cur.fetchone()
-            if emp_result:
-                emp_id = emp_result[0] if isinstance(emp_result, (list, tuple)) else emp_result['id']
-                year = datetime.utcnow().year
-                cur.execute("""INSERT OR IGNORE INTO quotas(user_id,year,leave_total,leave_used,changeoff_earned,changeoff_used,created_at,updated_at)
-                               VALUES(?,?,?,?,?,?,?,?)""",
-                            (emp_id, year, 12, 0, 0, 0, now, now))
-        
-        conn.commit()
-        st.session_state.db_initialized = True
-        st.info("In-memory database initialized with sample data")
-        
-    except Exception as e:
-        st.error(f"Failed to initialize in-memory database: {e}")
-
-def add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, col_def: str):
-    try:
-        cur = conn.cursor()
-        cur.execute(f"PRAGMA table_info({table})")
-        cols = [r["name"] for r in cur.fetchall()]
-        if column not in cols:
-            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_def};")
-            conn.commit()
-    except Exception as e:
-        st.error(f"Error adding column {column} to {table}: {e}")
 
+# -------------------- Service (wrapper UI) --------------------
 def init_db():
-    try:
-        # Cek jika database sudah diinisialisasi
-        if st.session_state.get("db_initialized", False):
-            return True
-            
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        
-        # Pastikan database directory exists
-        db_dir = os.path.dirname(DB_PATH)
-        if db_dir and not os.path.exists(db_dir):
-            os.makedirs(db_dir, exist_ok=True)
-            
-        conn = get_conn()
-        
-        # Jika menggunakan in-memory database, schema sudah diinisialisasi di get_conn()
-        if st.session_state.in_memory_db:
-            return True
-            
-        cur = conn.cursor()
-        
-        # Buat tabel untuk database file
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            name TEXT NOT NULL,
-            role TEXT NOT NULL CHECK(role IN ('EMPLOYEE','MANAGER','HR_ADMIN')),
-            manager_id INTEGER,
-            password_hash TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            division TEXT,
-            FOREIGN KEY(manager_id) REFERENCES users(id)
-        );
-        """)
-        
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS quotas(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            year INTEGER NOT NULL,
-            leave_total INTEGER NOT NULL DEFAULT 12,
-            leave_used INTEGER NOT NULL DEFAULT 0,
-            changeoff_earned INTEGER NOT NULL DEFAULT 0,
-            changeoff_used INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            UNIQUE(user_id, year),
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        );
-        """)
-        
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS requests(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            type TEXT NOT NULL CHECK(type IN ('LEAVE','CHANGEOFF')),
-            start_date TEXT,
-            end_date TEXT,
-            single_date TEXT,
-            hours INTEGER,
-            reason TEXT,
-            status TEXT NOT NULL CHECK(status IN ('PENDING_MANAGER','PENDING_HR','APPROVED','REJECTED')),
-            manager_by INTEGER,
-            manager_at TEXT,
-            hr_by INTEGER,
-            hr_at TEXT,
-            timesheet_path TEXT,
-            location TEXT,
-            activity TEXT,
-            pic TEXT,
-            job_execution TEXT,
-            payload_json TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            file_uploaded BOOLEAN DEFAULT 0,
-            activity_start_time TEXT,
-            activity_end_time TEXT,
-            departure_date TEXT,
-            return_date TEXT,
-            activities_json TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(manager_by) REFERENCES users(id),
-            FOREIGN KEY(hr_by) REFERENCES users(id)
-        );
-        """)
-        
-        conn.commit()
-        
-        # Tambahkan kolom jika missing
-        add_column_if_missing(conn, "users", "division", "TEXT")
-        add_column_if_missing(conn, "requests", "activities_json", "TEXT")
-        add_column_if_missing(conn, "requests", "file_uploaded", "BOOLEAN DEFAULT 0")
-        add_column_if_missing(conn, "requests", "activity_start_time", "TEXT")
-        add_column_if_missing(conn, "requests", "activity_end_time", "TEXT")
-        add_column_if_missing(conn, "requests", "departure_date", "TEXT")
-        add_column_if_missing(conn, "requests", "return_date", "TEXT")
-        
-        # Seed default users jika kosong
-        cur.execute("SELECT COUNT(1) AS c FROM users;")
-        result = cur.fetchone()
-        count = result[0] if isinstance(result, (list, tuple)) else result['c']
-            
-        if count == 0:
-            now = datetime.utcnow().isoformat()
-            def hpw(p): return hashlib.sha256(p.encode()).hexdigest()
-            
-            # Insert manager
-            cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
-                           VALUES(?,?,?,?,?,?,?,?)""",
-                        ("manager@example.com", "Manager One", "MANAGER", None, hpw("password"), now, now, "Engineering"))
-            manager_id = cur.lastrowid
-            
-            # Insert employee
-            cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
-                           VALUES(?,?,?,?,?,?,?,?)""",
-                        ("employee@example.com", "Employee One", "EMPLOYEE", manager_id, hpw("password"), now, now, "Engineering"))
-            
-            # Insert HR
-            cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
-                           VALUES(?,?,?,?,?,?,?,?)""",
-                        ("hr@example.com", "HR Admin", "HR_ADMIN", None, hpw("password"), now, now, "Human Resources"))
-            
-            conn.commit()
-            
-            # Get employee ID untuk quota
-            cur.execute("SELECT id FROM users WHERE email=?", ("employee@example.com",))
-            emp_result = cur.fetchone()
-            if emp_result:
-                emp_id = emp_result[0] if isinstance(emp_result, (list, tuple)) else emp_result['id']
-                year = datetime.utcnow().year
-                cur.execute("""INSERT OR IGNORE INTO quotas(user_id,year,leave_total,leave_used,changeoff_earned,changeoff_used,created_at,updated_at)
-                               VALUES(?,?,?,?,?,?,?,?)""",
-                            (emp_id, year, 12, 0, 0, 0, now, now))
-                conn.commit()
-        
-        conn.close()
-        st.session_state.db_initialized = True
+    # Cek jika database sudah diinisialisasi
+    if st.session_state.get("db_initialized", False):
         return True
-        
-    except Exception as e:
-        st.error(f"Failed to initialize database: {e}")
-        return False
-
-# -------------------- Auth --------------------
-def hash_pw(pw: str) -> str:
-    return hashlib.sha256(pw.encode()).hexdigest()
-
-def login(email: str, password: str) -> Optional[sqlite3.Row]:
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE email=?", (email,))
-        row = cur.fetchone()
-        conn.close()
-        
-        if not row: 
-            return None
-        if row["password_hash"] != hash_pw(password): 
-            return None
-        return row
-        
-    except sqlite3.OperationalError as e:
-        st.error(f"Login error: {e}")
-        return None
-def current_year() -> int:
-    return date.today().year
-
-# -------------------- Helpers User/Manager --------------------
-def get_manager_for_user(user_id: int) -> Optional[sqlite3.Row]:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT m.*
-        FROM users u
-        LEFT JOIN users m ON m.id = u.manager_id
-        WHERE u.id = ?
-    """, (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+        service.init_db()
+    except ServiceError as e:
+        st.error(str(e))
+        return False
+    reason = service.memory_fallback_reason()
+    st.session_state.in_memory_db = reason is not None
+    if reason:
+        st.error(f"Database error: {reason}")
+        st.warning("Using temporary in-memory database. Changes will not persist after the process stops!")
+        return True
+    st.session_state.db_initialized = True
+    return True
 
 def require_manager_assigned(user: dict) -> bool:
-    mgr = get_manager_for_user(int(user["id"]))
-    if not mgr:
-        st.error("Akun Anda belum memiliki Manager yang ditetapkan. Hubungi HR untuk mengatur Manager terlebih dahlu.")
-        return False
-    if mgr["role"] != "MANAGER":
-        st.error(f"Manager yang ditetapkan adalah {mgr['name']} ({mgr['email']}) tetapi rolenya {mgr['role']}. HR perlu memperbaiki.")
+    try:
+        service.check_manager_assigned(int(user["id"]))
+    except ServiceError as e:
+        st.error(str(e))
         return False
     return True
 
-# -------------------- Business Logic --------------------
-def get_or_create_quota(user_id: int, year: int) -> sqlite3.Row:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM quotas WHERE user_id=? AND year=?", (user_id, year))
-    q = cur.fetchone()
-    if not q:
-        now = datetime.utcnow().isoformat()
-        cur.execute("""INSERT INTO quotas(user_id,year,leave_total,leave_used,changeoff_earned,changeoff_used,created_at,updated_at)
-                       VALUES(?,?,?,?,?,?,?,?)""",
-                    (user_id, year, 12, 0, 0, 0, now, now))
-        conn.commit()
-        cur.execute("SELECT * FROM quotas WHERE user_id=? AND year=?", (user_id, year))
-        q = cur.fetchone()
-    conn.close()
-    return q
-
-def save_file(uploaded_file) -> str:
-    ext = os.path.splitext(uploaded_file.name)[1]
-    fname = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex}{ext}"
-    path = os.path.join(UPLOAD_DIR, fname)
-    with open(path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    return path
-
-def inclusive_days(d1: date, d2: date) -> int:
-    return (d2 - d1).days + 1
-
-def submit_changeoff(user_id: int, departure_date: date, return_date: date, 
-                    activity_start_time: str, activity_end_time: str, 
-                    location: str, activity: str, pic: str, job_exec: Optional[str], timesheet_path: str):
-    now = datetime.utcnow().isoformat()
-    conn = get_conn()
-    cur = conn.cursor()
-    start_time_obj = datetime.strptime(activity_start_time, '%H:%M').time()
-    end_time_obj = datetime.strptime(activity_end_time, '%H:%M').time()
-    start_dt = datetime.combine(date.today(), start_time_obj)
-    end_dt = datetime.combine(date.today(), end_time_obj)
-    if end_dt < start_dt:
-        end_dt = datetime.combine(date.today() + timedelta(days=1), end_time_obj)
-    hours_diff = (end_dt - start_dt).total_seconds() / 3600
-    hours = int(hours_diff)
-    cur.execute("""
-        INSERT INTO requests(user_id,type,departure_date,return_date,activity_start_time,activity_end_time,
-                            hours,reason,status,timesheet_path,location,activity,pic,job_execution,
-                            created_at,updated_at,file_uploaded)
-        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-    """, (user_id, 'CHANGEOFF', departure_date.isoformat(), return_date.isoformat(), 
-          activity_start_time, activity_end_time, hours, 'CHANGEOFF', 'PENDING_MANAGER', 
-          timesheet_path, location, activity, pic, job_exec, now, now, 1))
-    conn.commit()
-    conn.close()
-
-def submit_leave(user_id: int, start: date, end: date, reason: str) -> Tuple[bool, str]:
-    days = inclusive_days(start, end)
-    year = start.year
-    q = get_or_create_quota(user_id, year)
-    leave_balance = q["leave_total"] - q["leave_used"]
-    co_balance = q["changeoff_earned"] - q["changeoff_used"]
-    if reason == 'CHANGEOFF':
-        if co_balance < days:
-            return False, f"Saldo Change Off tidak cukup. Tersedia {co_balance} hari, diminta {days}."
-    elif reason == 'PERSONAL':
-        if leave_balance < days:
-            return False, f"Saldo cuti tidak cukup. Tersedia {leave_balance} hari, diminta {days}."
-    now = datetime.utcnow().isoformat()
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO requests(user_id,type,start_date,end_date,reason,status,created_at,updated_at,file_uploaded)
-        VALUES(?,?,?,?,?,?,?,?,?)
-    """, (user_id, 'LEAVE', start.isoformat(), end.isoformat(), reason, 'PENDING_MANAGER', now, now, 0))
-    conn.commit()
-    conn.close()
-    return True, "Leave request terkirim dan menunggu persetujuan Manager."
-
-def manager_pending(manager_id: int) -> pd.DataFrame:
-    conn = get_conn()
-    df = pd.read_sql_query("""
-        SELECT r.*, u.name as employee_name, u.email as employee_email, u.division as employee_division
-        FROM requests r
-        JOIN users u ON u.id = r.user_id
-        WHERE r.status='PENDING_MANAGER' AND u.manager_id = ?
-        ORDER BY r.created_at DESC
-    """, conn, params=(manager_id,))
-    conn.close()
-    return df
-
-def hr_pending() -> pd.DataFrame:
-    conn = get_conn()
-    df = pd.read_sql_query("""
-        SELECT r.*, u.name as employee_name, u.email as employee_email, u.division as employee_division
-        FROM requests r
-        JOIN users u ON u.id = r.user_id
-        WHERE r.status='PENDING_HR'
-        ORDER BY r.created_at DESC
-    """, conn)
-    conn.close()
-    return df
-
-def set_manager_decision(manager_id: int, request_id: int, approve: bool):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""SELECT r.*, u.manager_id
-                   FROM requests r JOIN users u ON u.id=r.user_id
-                   WHERE r.id=?""", (request_id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        raise ValueError("Request tidak ditemukan")
-    if row["manager_id"] != manager_id:
-        conn.close()
-        raise PermissionError("Anda bukan manager dari karyawan ini.")
-    new_status = 'PENDING_HR' if approve else 'REJECTED'
-    now = datetime.utcnow().isoformat()
-    cur.execute("UPDATE requests SET status=?, manager_by=?, manager_at=?, updated_at=? WHERE id=?",
-                (new_status, manager_id, now, now, request_id))
-    conn.commit()
-    conn.close()
-
-def adjust_quota_leave(user_id: int, year: int, days: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    now = datetime.utcnow().isoformat()
-    cur.execute("INSERT OR IGNORE INTO quotas(user_id,year,created_at,updated_at) VALUES(?,?,?,?)",
-                (user_id, year, now, now))
-    cur.execute("UPDATE quotas SET leave_used = leave_used + ?, updated_at=? WHERE user_id=? AND year=?",
-                (days, now, user_id, year))
-    conn.commit()
-    conn.close()
-
-def adjust_quota_changeoff_earned(user_id: int, year: int, days: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    now = datetime.utcnow().isoformat()
-    cur.execute("INSERT OR IGNORE INTO quotas(user_id,year,created_at,updated_at) VALUES(?,?,?,?)",
-                (user_id, year, now, now))
-    cur.execute("UPDATE quotas SET changeoff_earned = changeoff_earned + ?, updated_at=? WHERE user_id=? AND year=?",
-                (days, now, user_id, year))
-    conn.commit()
-    conn.close()
-
-def adjust_quota_changeoff_used(user_id: int, year: int, days: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    now = datetime.utcnow().isoformat()
-    cur.execute("INSERT OR IGNORE INTO quotas(user_id,year,created_at,updated_at) VALUES(?,?,?,?)",
-                (user_id, year, now, now))
-    cur.execute("UPDATE quotas SET changeoff_used = changeoff_used + ?, updated_at=? WHERE user_id=? AND year=?",
-                (days, now, user_id, year))
-    conn.commit()
-    conn.close()
-
-def set_hr_decision(hr_id: int, request_id: int, approve: bool):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM requests WHERE id=?", (request_id,))
-    req = cur.fetchone()
-    if not req:
-        conn.close()
-        raise ValueError("Request tidak ditemukan")
-    if req["status"] != 'PENDING_HR':
-        conn.close()
-        raise ValueError("Request tidak menunggu HR")
-    new_status = 'APPROVED' if approve else 'REJECTED'
-    now = datetime.utcnow().isoformat()
-    cur.execute("UPDATE requests SET status=?, hr_by=?, hr_at=?, updated_at=? WHERE id=?", (new_status, hr_id, now, now, request_id))
-    conn.commit()
-    conn.close()
-    if approve:
-        if req["type"] == 'LEAVE':
-            s = date.fromisoformat(req["start_date"])
-            e = date.fromisoformat(req["end_date"])
-            days = inclusive_days(s, e)
-            if req["reason"] == 'CHANGEOFF':
-                adjust_quota_changeoff_used(req["user_id"], s.year, days)
-            elif req["reason"] == 'PERSONAL':
-                adjust_quota_leave(req["user_id"], s.year, days)
-        elif req["type"] == 'CHANGEOFF':
-            d = date.fromisoformat(req["departure_date"])
-            hours = req["hours"] or 0
-            credit = max(0, hours // 8)
-            if credit > 0:
-                adjust_quota_changeoff_earned(req["user_id"], d.year, credit)
-
-# -------------------- Admin CRUD --------------------
-def list_users() -> pd.DataFrame:
-    conn = get_conn()
-    df = pd.read_sql_query("""
-        SELECT u.id, u.email, u.name, u.role, u.manager_id, u.division, m.name as manager_name, u.created_at
-        FROM users u LEFT JOIN users m ON m.id = u.manager_id
-        ORDER BY u.created_at DESC
-    """, conn)
-    conn.close()
-    return df
-
-def list_managers() -> pd.DataFrame:
-    conn = get_conn()
-    df = pd.read_sql_query("SELECT id, name, email FROM users WHERE role='MANAGER' ORDER by name", conn)
-    conn.close()
-    return df
-
-def create_user(email: str, name: str, role: str, password: str, manager_id: Optional[int], division: Optional[str]):
-    now = datetime.utcnow().isoformat()
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
-                   VALUES(?,?,?,?,?,?,?,?)""",
-                (email, name, role, manager_id, hash_pw(password), now, now, division))
-    conn.commit()
-    conn.close()
-
-def update_user(user_id: int, email: str, name: str, role: str, manager_id: Optional[int], new_password: Optional[str], division: Optional[str]):
-    now = datetime.utcnow().isoformat()
-    conn = get_conn()
-    cur = conn.cursor()
-    if new_password:
-        cur.execute("""UPDATE users SET email=?, name=?, role=?, manager_id=?, password_hash=?, division=?, updated_at=?
-                       WHERE id=?""",
-                    (email, name, role, manager_id, hash_pw(new_password), division, now, user_id))
-    else:
-        cur.execute("""UPDATE users SET email=?, name=?, role=?, manager_id=?, division=?, updated_at=?
-                       WHERE id=?""",
-                    (email, name, role, manager_id, division, now, user_id))
-    conn.commit()
-    conn.close()
-
-def delete_user(user_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM requests WHERE user_id=? LIMIT 1", (user_id,))
-    if cur.fetchone():
-        conn.close()
-        raise ValueError("Tidak bisa hapus user: masih ada request sebagai pemilik. Hapus/arsipkan dulu request-nya.")
-    cur.execute("SELECT 1 FROM quotas WHERE user_id=? LIMIT 1", (user_id,))
-    if cur.fetchone():
-        conn.close()
-        raise ValueError("Tidak bisa hapus user: masih ada kuota terkait. Hapus kuotanya dulu.")
-    cur.execute("UPDATE users SET manager_id=NULL WHERE manager_id=?", (user_id,))
-    cur.execute("UPDATE requests SET manager_by=NULL WHERE manager_by=?", (user_id,))
-    cur.execute("UPDATE requests SET hr_by=NULL WHERE hr_by=?", (user_id,))
-    cur.execute("DELETE FROM users WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
+@st.cache_resource(show_spinner=False)
+def job_workers() -> jobs.WorkerPool:
+    # Satu pool worker per proses Streamlit (bukan per sesi/rerun)
+    return jobs.start_workers()
 
-def upsert_quota(user_id: int, year: int, leave_total: int, changeoff_earned: int, changeoff_used: int, leave_used: int):
-    now = datetime.utcnow().isoformat()
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM quotas WHERE user_id=? AND year=?", (user_id, year))
-    row = cur.fetchone()
-    if row:
-        cur.execute("""UPDATE quotas SET leave_total=?, leave_used=?, changeoff_earned=?, changeoff_used=?, updated_at=?
-                       WHERE user_id=? AND year=?""",
-                    (leave_total, leave_used, changeoff_earned, changeoff_used, now, user_id, year))
+def _job_status(job_id: int, on_done, polling: bool):
+    job = jobs.get_job(job_id)
+    active = job is not None and job["status"] in ("QUEUED", "RUNNING")
+    if polling and not active:
+        st.rerun()  # job selesai: rerun penuh supaya polling berhenti
+    if job is None:
+        st.info("Job tidak ditemukan (mungkin sudah dibersihkan).")
+    elif active:
+        label = f"Job #{job['id']} {job['status']} • percobaan {max(job['attempts'], 1)}/{job['max_attempts']}"
+        if job["progress_total"]:
+            st.progress(job["progress_done"] / job["progress_total"],
+                        text=f"{label} • {job['progress_done']}/{job['progress_total']}")
+        else:
+            st.caption(label + " • status diperbarui otomatis")
+        if job["error"]:
+            st.caption(f"Percobaan sebelumnya gagal: {job['error']}")
+    elif job["status"] == "DONE":
+        on_done(job["result"] or {})
+    elif job["status"] == "FAILED":
+        st.error(f"Job #{job['id']} gagal: {job['error']}")
     else:
-        cur.execute("""INSERT INTO quotas(user_id,year,leave_total,leave_used,changeoff_earned,changeoff_used,created_at,updated_at)
-                       VALUES(?,?,?,?,?,?,?,?)""",
-                    (user_id, year, leave_total, leave_used, changeoff_earned, changeoff_used, now, now))
-    conn.commit()
-    conn.close()
-
-def delete_quota(user_id: int, year: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM quotas WHERE user_id=? AND year=?", (user_id, year))
-    conn.commit()
-    conn.close()
-
-def get_user(user_id: int) -> Optional[sqlite3.Row]:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+        st.warning(f"Job #{job['id']} dibatalkan.")
 
-def my_requests(user_id: int) -> pd.DataFrame:
-    conn = get_conn()
-    df = pd.read_sql_query("SELECT * FROM requests WHERE user_id=? ORDER BY created_at DESC", conn, params=(user_id,))
-    conn.close()
-    return df
-
-def user_quota(user_id: int, year: int) -> dict:
-    q = get_or_create_quota(user_id, year)
-    return {
-        "year": year,
-        "leave_total": int(q["leave_total"]),
-        "leave_used": int(q["leave_used"]),
-        "leave_balance": int(q["leave_total"] - q["leave_used"]),
-        "co_earned": int(q["changeoff_earned"]),
-        "co_used": int(q["changeoff_used"]),
-        "co_balance": int(q["changeoff_earned"] - q["changeoff_used"]),
-    }
+def job_status_panel(job_id: Optional[int], on_done):
+    """Status satu job; selama job berjalan hanya bagian ini yang di-rerun berkala."""
+    if not job_id:
+        return
+    job = jobs.get_job(job_id)
+    active = job is not None and job["status"] in ("QUEUED", "RUNNING")
+    st.fragment(_job_status, run_every=2 if active else None)(job_id, on_done, active)
 
-# -------------------- File Preview (iframe + base64, PDF only) --------------------
+# -------------------- File Preview (PDF: thumbnail + iframe on demand; teks/CSV/XLSX/DOCX: preview.py) --------------------
 def human_size(num_bytes: int) -> str:
     for unit in ["B", "KB", "MB", "GB", "TB"]:
         if num_bytes < 1024.0:
@@ -724,9 +152,41 @@ def preview_file(path: str, label_prefix: str = "Attachment", key_prefix: Option
         st.info("Hanya Manager dan HR yang dapat melihat preview file.")
         return
     if ext == ".pdf" or (mime == "application/pdf"):
-        preview_pdf_iframe(path, width="100%", height=900)
+        thumb = thumbnails.cached(path)
+        if thumb:
+            st.image(thumb, width=thumbnails.THUMB_WIDTH)
+        else:
+            st.caption("Thumbnail sedang dibuat…")
+        # iframe base64 penuh hanya dimuat jika diminta
+        if st.toggle("Tampilkan preview penuh", key=f"full_{key_prefix}"):
+            preview_pdf_iframe(path, width="100%", height=900)
+    elif preview.is_previewable(path):
+        render_preview(preview.build_preview(path))
     else:
-        st.warning("Preview hanya tersedia untuk file PDF. Tipe lain hanya dapat diunduh.")
+        st.warning("Preview hanya tersedia untuk PDF, teks/CSV, XLSX, dan DOCX. Tipe lain hanya dapat diunduh.")
+
+def render_preview(result: preview.Preview):
+    if result.kind == "unsupported":
+        st.warning(result.message)
+        return
+    for block in result.blocks:
+        if block["type"] == "text":
+            st.text(block["text"])
+            continue
+        if block.get("title"):
+            st.caption(f"Sheet: {block['title']}")
+        rows = block["rows"]
+        if not rows:
+            st.caption("(kosong)")
+            continue
+        width = max(len(r) for r in rows)
+        header = [str(h or f"kolom {i + 1}") for i, h in enumerate(rows[0] + [""] * (width - len(rows[0])))]
+        header = [h if header.index(h) == i else f"{h} ({i + 1})" for i, h in enumerate(header)]
+        st.dataframe(pd.DataFrame([r + [""] * (width - len(r)) for r in rows[1:]], columns=header),
+                     use_container_width=True, hide_index=True)
+    if result.truncated:
+        st.caption(f"Preview dipotong (maks. {preview.PREVIEW_MAX_ROWS} baris / "
+                   f"{human_size(preview.TEXT_PREVIEW_MAX_BYTES)}). Unduh file untuk isi lengkap.")
 
 # -------------------- UI --------------------
 def page_login():
@@ -734,11 +194,15 @@ def page_login():
     email = st.text_input("Email")
     password = st.text_input("Password", type="password")
     if st.button("Login"):
-        user = login(email, password)
+        try:
+            user = service.login(email, password)
+        except ServiceError as e:
+            st.error(str(e))
+            return
         if user:
-            st.session_state.user = dict(user)
+            st.session_state.user = user.as_dict()
             st.session_state.authenticated = True
-            st.success(f"Login sukses. Halo, {user['name']}!")
+            st.success(f"Login sukses. Halo, {user.name}!")
             st.rerun()
         else:
             st.error("Email atau password salah.")
@@ -751,12 +215,14 @@ def sidebar_menu():
         st.write(f"Logged in as: {user['name']} ({user['role']})")
         if user.get("division"):
             st.caption(f"Division: {user['division']}")
+        if service.is_memory_db():
+            st.caption("Database: in-memory (ephemeral)")
         if user["role"] == "EMPLOYEE":
-            mgr = get_manager_for_user(int(user["id"]))
+            mgr = service.get_manager_for_user(int(user["id"]))
             if mgr:
-                st.caption(f"Manager: {mgr['name']} ({mgr['email']})")
-                if mgr["role"] != "MANAGER":
-                    st.warning(f"Perhatian: role manager Anda adalah {mgr['role']}, seharusnya 'MANAGER'. Minta HR memperbaiki.")
+                st.caption(f"Manager: {mgr.name} ({mgr.email})")
+                if mgr.role != "MANAGER":
+                    st.warning(f"Perhatian: role manager Anda adalah {mgr.role}, seharusnya 'MANAGER'. Minta HR memperbaiki.")
             else:
                 st.warning("Manager belum ditetapkan. Pengajuan tidak akan masuk ke akun Manager mana pun.")
         choice = None
@@ -765,7 +231,7 @@ def sidebar_menu():
         elif user["role"] == "MANAGER":
             choice = st.radio("Menu", ["Dashboard", "Submit Leave", "Submit Change Off", "Pending (Manager)", "Team Requests"])
         elif user["role"] == "HR_ADMIN":
-            choice = st.radio("Menu", ["Pending (HR)", "Quotas", "Users"])
+            choice = st.radio("Menu", ["Pending (HR)", "Search", "Quotas", "Users", "Analytics", "Approval Latency", "Export", "Letters", "Reports", "Diagnostics"])
         if st.button("Logout"):
             st.session_state.clear()
             st.rerun()
@@ -785,12 +251,15 @@ def quota_kanban(q: dict, title_prefix: str = ""):
         with st.expander(f"Tahun {q['year']}", expanded=True):
             st.write("- Leave dipotong saat HR approve")
             st.write("- ChangeOff bertambah (jam/8) saat HR approve")
+            if q.get("leave_carried") or q.get("co_carried"):
+                st.write(f"- Carry-over: cuti {q['leave_carried']}, CO {q['co_carried']} "
+                         f"(hangus setelah {q.get('carry_expires_on') or '-'})")
 
 def page_employee_dashboard(user):
     st.header("Dashboard")
     st.caption(f"Division: {user.get('division') or '-'}")
     year = st.number_input("Tahun", min_value=2000, max_value=2100, value=current_year(), step=1)
-    q = user_quota(user["id"], year)
+    q = service.user_quota(user["id"], year).as_dict()
     quota_kanban(q)
     st.subheader("Kalender Libur Nasional (Indonesia)")
     if pyholidays:
@@ -807,22 +276,62 @@ def page_submit_leave(user):
         start = st.date_input("Tanggal Mulai", date.today())
     with col2:
         end = st.date_input("Tanggal Akhir", date.today())
-    reason = st.selectbox("Alasan", ["PERSONAL", "SAKIT", "CHANGEOFF"])
+    reason = st.selectbox("Alasan", list(service.LEAVE_REASONS))
     if st.button("Kirim Leave"):
         if not require_manager_assigned(user): return
-        if end < start:
-            st.error("Tanggal akhir harus >= tanggal mulai")
-        else:
-            ok, msg = submit_leave(user["id"], start, end, reason)
-            st.success(msg) if ok else st.error(msg)
+        try:
+            result = service.submit_leave(user["id"], start, end, reason)
+            st.success(result.message)
+            for warning in result.warnings:
+                st.warning(warning)
+        except ServiceError as e:
+            st.error(str(e))
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_parse_timesheet(digest: str, _data: bytes) -> timesheet.TimesheetParse:
+    # Key cache = sha256 isi upload (_data tidak di-hash ulang oleh Streamlit)
+    return timesheet.parse_xlsx(io.BytesIO(_data))
+
+def _prefill_changeoff(parsed: timesheet.TimesheetParse):
+    """Isi tanggal dan jadwal per hari di form dari timesheet (sekali per upload)."""
+    first, last = parsed.first_date, parsed.last_date
+    st.session_state.co_departure, st.session_state.co_return = first, last
+    for day in range((last - first).days + 1):
+        entry = parsed.day(first + timedelta(days=day))
+        if entry is None:
+            continue
+        if entry.waktu_mulai:
+            st.session_state[f"start_{day}"] = entry.waktu_mulai
+        if entry.waktu_selesai:
+            st.session_state[f"end_{day}"] = entry.waktu_selesai
+        st.session_state[f"activity_{day}"] = entry.aktivitas
 
 def page_submit_changeoff(user):
     st.header("Submit Change Off (ke Manager dulu)")
+    file = st.file_uploader("Upload Timesheet (wajib)", type=None,
+                            help="Timesheet XLSX dengan kolom tanggal, jam mulai/selesai, dan aktivitas akan mengisi form otomatis.")
+    parsed = None
+    if file:
+        st.success("✅ File telah diupload")
+        if os.path.splitext(file.name)[1].lower() in (".xlsx", ".xlsm"):
+            data = bytes(file.getbuffer())
+            digest = hashlib.sha256(data).hexdigest()
+            parsed = cached_parse_timesheet(digest, data)
+            if parsed.ok and st.session_state.get("co_prefill_digest") != digest:
+                _prefill_changeoff(parsed)
+                st.session_state.co_prefill_digest = digest
+            if parsed.ok:
+                st.info(f"Form diisi dari timesheet ({len(parsed.days)} hari, sheet {parsed.sheet}, "
+                        f"layout {parsed.layout}). Periksa dan sesuaikan bila perlu.")
+            for warning in parsed.warnings[:10]:
+                st.warning(warning)
+    st.session_state.setdefault("co_departure", date.today())
+    st.session_state.setdefault("co_return", date.today())
     col1, col2 = st.columns(2)
     with col1:
-        departure_date = st.date_input("Tanggal Keberangkatan", date.today())
+        departure_date = st.date_input("Tanggal Keberangkatan", key="co_departure")
     with col2:
-        return_date = st.date_input("Tanggal Kepulangan", date.today())
+        return_date = st.date_input("Tanggal Kepulangan", key="co_return")
     total_days = (return_date - departure_date).days + 1
     if total_days <= 0:
         st.error("Tanggal kepulangan harus setelah tanggal keberangkatan.")
@@ -837,12 +346,13 @@ def page_submit_changeoff(user):
         current_date = departure_date + timedelta(days=day)
         st.markdown(f"### Hari {day + 1} - {current_date.strftime('%A, %d %B %Y')}")
         col3, col4 = st.columns(2)
+        # Default lewat session_state supaya nilai dari timesheet tidak bentrok dengan value= widget
+        st.session_state.setdefault(f"start_{day}", "08:00")
+        st.session_state.setdefault(f"end_{day}", "17:00")
         with col3:
-            start_time = st.text_input(f"Waktu Mulai (HH:MM) - Hari {day+1}", 
-                                     value="08:00", key=f"start_{day}")
+            start_time = st.text_input(f"Waktu Mulai (HH:MM) - Hari {day+1}", key=f"start_{day}")
         with col4:
-            end_time = st.text_input(f"Waktu Selesai (HH:MM) - Hari {day+1}", 
-                                   value="17:00", key=f"end_{day}")
+            end_time = st.text_input(f"Waktu Selesai (HH:MM) - Hari {day+1}", key=f"end_{day}")
         activity_desc = st.text_area(f"Detail Aktivitas - Hari {day+1}", 
                                    placeholder="Deskripsikan aktivitas yang dilakukan", 
                                    key=f"activity_{day}")
@@ -859,9 +369,10 @@ def page_submit_changeoff(user):
         preview_df['tanggal'] = pd.to_datetime(preview_df['tanggal']).dt.strftime('%A, %Y-%m-%d')
         preview_df['hari'] = preview_df.index + 1
         st.dataframe(preview_df[['hari', 'tanggal', 'waktu_mulai', 'waktu_selesai', 'aktivitas']], use_container_width=True)
-    file = st.file_uploader("Upload Timesheet (wajib)", type=None)
-    if file:
-        st.success("✅ File telah diupload")
+    if parsed is not None and parsed.ok:
+        mismatches = timesheet.compare(activities_data, parsed)
+        if mismatches:
+            st.warning("Jam di form berbeda dengan timesheet:\n\n" + "\n".join(f"- {m}" for m in mismatches))
     if st.button("Kirim Change Off"):
         if not require_manager_assigned(user): 
             return
@@ -869,49 +380,29 @@ def page_submit_changeoff(user):
             st.error("Timesheet wajib diupload.")
         elif not location or not pic:
             st.error("Harap isi Lokasi dan PIC.")
-        elif departure_date > return_date:
-            st.error("Tanggal kepulangan harus setelah tanggal keberangkatan.")
         else:
-            valid = True
             for activity in activities_data:
                 try:
-                    datetime.strptime(activity['waktu_mulai'], '%H:%M')
-                    datetime.strptime(activity['waktu_selesai'], '%H:%M')
-                except ValueError:
+                    service.activity_hours(activity['waktu_mulai'], activity['waktu_selesai'])
+                except ServiceError:
                     st.error(f"Format waktu tidak valid untuk Hari {activity['hari']}. Harus HH:MM")
-                    valid = False
-                    break
-            if not valid:
+                    return
+            path = service.save_file(file.name, file.getbuffer())
+            thumbnails.schedule(path)
+            try:
+                result = service.submit_changeoff(user["id"], departure_date, return_date, activities_data,
+                                                  location, pic, job_exec, path)
+            except ServiceError as e:
+                st.error(str(e))
                 return
-            path = save_file(file)
-            activities_json = json.dumps(activities_data, ensure_ascii=False)
-            total_hours = 0
-            for activity in activities_data:
-                start_dt = datetime.strptime(activity['waktu_mulai'], '%H:%M')
-                end_dt = datetime.strptime(activity['waktu_selesai'], '%H:%M')
-                if end_dt < start_dt:
-                    end_dt = end_dt.replace(day=end_dt.day + 1)
-                hours_diff = (end_dt - start_dt).total_seconds() / 3600
-                total_hours += hours_diff
-            now = datetime.utcnow().isoformat()
-            conn = get_conn()
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO requests(user_id,type,departure_date,return_date,
-                            hours,reason,status,timesheet_path,location,pic,job_execution,
-                            activities_json,created_at,updated_at,file_uploaded)
-                VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """, (user["id"], 'CHANGEOFF', departure_date.isoformat(), return_date.isoformat(), 
-                  total_hours, 'CHANGEOFF', 'PENDING_MANAGER', path, location, pic, 
-                  job_exec if job_exec else None, activities_json, now, now, 1))
-            conn.commit()
-            conn.close()
-            st.success("Change Off request terkirim. Menunggu persetujuan Manager.")
+            st.success(result.message)
+            for warning in result.warnings:
+                st.warning(warning)
             st.balloons()
 
 def page_my_requests(user):
     st.header("My Requests")
-    df = my_requests(user["id"])
+    df = service.my_requests(user["id"])
     if df.empty:
         st.info("Belum ada request.")
         return
@@ -919,17 +410,51 @@ def page_my_requests(user):
         status_text = f"ID: {r['id']} | {r['type']} | {r['status']}"
         if r.get('file_uploaded', 0):
             status_text += " ✅"
+        if pd.notna(r.get('archived_at')):
+            status_text += " (arsip)"
         with st.expander(status_text):
             st.dataframe(pd.DataFrame([r]).drop(columns=['user_id']), use_container_width=True)
 
+def team_coverage(manager_id: int, r):
+    """Ringkasan anggota tim lain yang off pada rentang request r (dan bentrok milik karyawan yang sama)."""
+    start = r.get("start_date") or r.get("departure_date")
+    end = r.get("end_date") or r.get("return_date")
+    if not start or not end or pd.isna(start) or pd.isna(end):
+        return
+    start, end = date.fromisoformat(start), date.fromisoformat(end)
+    overlaps = service.overlapping_requests(int(r["user_id"]), start, end, exclude_id=int(r["id"]))
+    if overlaps:
+        st.warning("Bentrok dengan request lain karyawan ini: " +
+                   "; ".join(f"#{o['id']} {o['type']} {o['span_start']} s/d {o['span_end']} ({o['status']})" for o in overlaps))
+    coverage = service.team_absence(manager_id, start, end, exclude_user_id=int(r["user_id"]))
+    peak = coverage["peak"]
+    if not peak or peak["total"] == 0:
+        st.caption(f"Tidak ada anggota tim lain yang off pada {start} s/d {end}.")
+        return
+    st.caption(f"Anggota tim lain yang off: puncak {peak['total']} dari {coverage['team_size']} "
+               f"({peak['approved']} approved, {peak['pending']} pending) pada {peak['date']}")
+    if len(coverage["days"]) > 1:
+        chart = pd.DataFrame(coverage["days"]).set_index("date")[["approved", "pending"]]
+        st.bar_chart(chart, height=160)
+
+def subtree_toggle(manager_id: int, key: str) -> bool:
+    """Toggle 'termasuk sub-tim', hanya tampil untuk manager yang punya bawahan tidak langsung."""
+    if not service.has_indirect_reports(manager_id):
+        return False
+    return st.toggle("Termasuk tim di bawahnya (semua level)", key=key)
+
 def page_manager_pending(user):
     st.header("Pending Approval (Manager)")
-    df = manager_pending(user["id"])
+    include_subtree = subtree_toggle(int(user["id"]), "mgr_pending_subtree")
+    df = service.manager_pending(user["id"], include_subtree=include_subtree)
     if df.empty:
         st.info("Tidak ada request menunggu Manager.")
         return
     for _, r in df.iterrows():
+        is_direct = int(r["direct_manager_id"]) == int(user["id"])
         status_text = f"[{r['type']}] {r['employee_name']} • Div {r.get('employee_division','-')} • Status: {r['status']} • ID: {r['id']}"
+        if not is_direct:
+            status_text += f" • via {r['direct_manager_name']}"
         if r.get('file_uploaded', 0):
             status_text += " ✅"
         with st.expander(status_text):
@@ -981,11 +506,15 @@ def page_manager_pending(user):
                 st.warning("Tidak ada data aktivitas yang dapat ditampilkan")
             if r["timesheet_path"]:
                 preview_file(r["timesheet_path"], key_prefix=f"mgr_req_{int(r['id'])}", user_role=user["role"])
+            team_coverage(int(r["direct_manager_id"]), r)
+            if not is_direct:
+                st.info(f"Menunggu keputusan manager langsung: {r['direct_manager_name']}.")
+                continue
             c1, c2 = st.columns(2)
             with c1:
                 if st.button(f"Approve (ID {int(r['id'])})", key=f"mgr_appr_{int(r['id'])}"):
                     try:
-                        set_manager_decision(int(user["id"]), int(r["id"]), True)
+                        service.set_manager_decision(int(user["id"]), int(r["id"]), True)
                         st.success("Approved → dikirim ke HR.")
                         st.rerun()
                     except Exception as e:
@@ -993,22 +522,42 @@ def page_manager_pending(user):
             with c2:
                 if st.button(f"Reject (ID {int(r['id'])})", key=f"mgr_rej_{int(r['id'])}"):
                     try:
-                        set_manager_decision(int(user["id"]), int(r["id"]), False)
+                        service.set_manager_decision(int(user["id"]), int(r["id"]), False)
                         st.warning("Rejected.")
                         st.rerun()
                     except Exception as e:
                         st.error(str(e))
 
+@st.cache_data(max_entries=128, show_spinner=False)
+def cached_team_calendar(manager_id: int, year: int, month: int, version: tuple,
+                         include_subtree: bool = False) -> pd.DataFrame:
+    # version (service.team_version) ikut menjadi cache key: begitu tim/request berubah, entri lama tidak terpakai lagi
+    first, last = team_calendar.month_range(year, month)
+    holidays = dict(pyholidays.country_holidays("ID", years=[year])) if pyholidays else None
+    return team_calendar.build_calendar(service.team_members(manager_id, include_subtree),
+                                        service.team_spans(manager_id, first, last, include_subtree),
+                                        year, month, holidays)
+
 def page_manager_team(user):
+    st.header("Kalender Tim")
+    manager_id = int(user["id"])
+    include_subtree = subtree_toggle(manager_id, "mgr_team_subtree")
+    today = date.today()
+    col1, col2 = st.columns(2)
+    with col1:
+        cal_year = st.number_input("Tahun", min_value=2000, max_value=2100, value=today.year, step=1, key="cal_year")
+    with col2:
+        cal_month = st.selectbox("Bulan", list(range(1, 13)), index=today.month - 1,
+                                 format_func=lambda m: reports.MONTH_NAMES_ID[m - 1], key="cal_month")
+    cal = cached_team_calendar(manager_id, int(cal_year), int(cal_month),
+                               service.team_version(manager_id, include_subtree), include_subtree)
+    if len(cal) <= 1:
+        st.info("Belum ada anggota tim.")
+    else:
+        st.dataframe(team_calendar.style_calendar(cal), use_container_width=True)
+        st.caption(team_calendar.LEGEND)
     st.header("Team Requests (All)")
-    conn = get_conn()
-    df = pd.read_sql_query("""
-        SELECT r.*, u.name as employee_name, u.division as employee_division
-        FROM requests r JOIN users u ON u.id=r.user_id
-        WHERE u.manager_id = ?
-        ORDER BY r.created_at DESC
-    """, conn, params=(user["id"],))
-    conn.close()
+    df = service.team_requests(user["id"], include_subtree=include_subtree)
     if df.empty:
         st.info("Belum ada request dari tim.")
         return
@@ -1016,12 +565,14 @@ def page_manager_team(user):
         status_text = f"ID: {r['id']} | {r['employee_name']} | {r['type']} | {r['status']}"
         if r.get('file_uploaded', 0):
             status_text += " ✅"
+        if pd.notna(r.get('archived_at')):
+            status_text += " (arsip)"
         with st.expander(status_text):
             st.dataframe(pd.DataFrame([r]).drop(columns=['user_id']), use_container_width=True)
 
 def page_hr_pending(user):
     st.header("Pending Approval (HR)")
-    df = hr_pending()
+    df = service.hr_pending()
     if df.empty:
         st.info("Tidak ada request menunggu HR.")
         return
@@ -1093,7 +644,7 @@ def page_hr_pending(user):
             with c1:
                 if st.button(f"Approve HR (ID {int(r['id'])})", key=f"hr_appr_{int(r['id'])}"):
                     try:
-                        set_hr_decision(int(user["id"]), int(r["id"]), True)
+                        service.set_hr_decision(int(user["id"]), int(r["id"]), True)
                         st.success("Approved final.")
                         st.rerun()
                     except Exception as e:
@@ -1101,14 +652,14 @@ def page_hr_pending(user):
             with c2:
                 if st.button(f"Reject HR (ID {int(r['id'])})", key=f"hr_rej_{int(r['id'])}"):
                     try:
-                        set_hr_decision(int(user["id"]), int(r["id"]), False)
+                        service.set_hr_decision(int(user["id"]), int(r["id"]), False)
                         st.warning("Rejected.")
                         st.rerun()
                     except Exception as e:
                         st.error(str(e))
 def page_hr_quotas(user):
     st.header("Quotas Management (Kanban)")
-    users_df = list_users()
+    users_df = service.list_users()
     if users_df.empty:
         st.info("Belum ada user.")
         return
@@ -1116,7 +667,7 @@ def page_hr_quotas(user):
     idx = st.selectbox("Pilih User", options=list(range(len(display))), format_func=lambda i: display[i])
     user_id = int(users_df.iloc[int(idx)]["id"])
     year = st.number_input("Tahun", min_value=2000, max_value=2100, value=current_year(), step=1)
-    q = user_quota(user_id, year)
+    q = service.user_quota(user_id, year).as_dict()
     quota_kanban(q)
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -1129,25 +680,72 @@ def page_hr_quotas(user):
     a, b = st.columns(2)
     with a:
         if st.button("Simpan Kuota"):
-            upsert_quota(user_id, year, int(leave_total), int(co_earned), int(co_used), int(leave_used))
+            service.upsert_quota(user_id, year, int(leave_total), int(co_earned), int(co_used), int(leave_used))
             st.success("Kuota tersimpan.")
             st.rerun()
     with b:
         if st.button("Hapus Kuota Tahun Ini"):
-            delete_quota(user_id, year)
+            service.delete_quota(user_id, year)
             st.warning("Kuota tahun ini dihapus.")
             st.rerun()
+    st.markdown("---")
+    st.subheader("Rollover Tahunan")
+    st.caption(f"Carry-over maks: cuti {rollover.CARRY_LEAVE_MAX} hari, Change Off {rollover.CARRY_CO_MAX} hari • "
+               f"Hangus: {rollover.carry_expiry_date(current_year()) or 'tidak'} (untuk tahun berjalan)")
+    to_year = st.number_input("Rollover ke Tahun", min_value=2001, max_value=2100, value=current_year(), step=1,
+                              key="rollover_year")
+    c_prev, c_apply, c_expire = st.columns(3)
+    result = None
+    if c_prev.button("Preview Rollover"):
+        result = rollover.rollover(int(to_year), dry_run=True)
+    if c_apply.button("Jalankan Rollover"):
+        st.session_state.rollover_job = jobs.enqueue("quota.rollover", {"to_year": int(to_year)},
+                                                     dedupe_key=f"quota.rollover:{int(to_year)}",
+                                                     created_by=int(user["id"]))
+    if c_expire.button("Hanguskan Carry Kedaluwarsa"):
+        st.session_state.rollover_job = jobs.enqueue("quota.expire_carry", dedupe_key="quota.expire_carry",
+                                                     created_by=int(user["id"]))
+    job_status_panel(st.session_state.get("rollover_job"), _rollover_done)
+    if result is not None:
+        st.write(" • ".join(f"{k}: {v}" for k, v in result.counts().items()) or "Tidak ada perubahan.")
+        if result.rows:
+            st.dataframe(pd.DataFrame(result.rows)[result.columns], use_container_width=True, hide_index=True)
+            path = result.write_csv()
+            with open(path, "rb") as f:
+                st.download_button("Download Laporan", f, file_name=os.path.basename(path), mime="text/csv",
+                                   key="dl_rollover")
+
+def _rollover_done(result: dict):
+    st.success(f"{result.get('applied', 0)} kuota dibuat/diperbarui/diproses.")
+    st.write(" • ".join(f"{k}: {v}" for k, v in (result.get("counts") or {}).items()) or "Tidak ada perubahan.")
+    path = result.get("csv")
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            st.download_button("Download Laporan", f, file_name=os.path.basename(path), mime="text/csv",
+                               key="dl_rollover_job")
+
+def _import_report(report):
+    st.write(f"Baris: {report.total_rows} • Valid: {report.valid_rows} • Error: {len(report.errors)}")
+    if report.errors:
+        st.error("Perbaiki baris berikut lalu upload ulang. Tidak ada user yang disimpan.")
+        st.dataframe(pd.DataFrame([e.__dict__ for e in report.errors]), use_container_width=True, hide_index=True)
+        st.download_button("Download Laporan Error", report.error_csv(), file_name="import-errors.csv",
+                           mime="text/csv", key="dl_import_errors")
+    elif report.dry_run:
+        st.success("Semua baris valid. Klik Import untuk menyimpan.")
+    else:
+        st.success(f"{report.inserted} user dan kuota awal berhasil diimport.")
 
 def page_hr_users(user):
     st.header("Users Management")
     st.subheader("Daftar User")
-    st.dataframe(list_users(), use_container_width=True)
+    st.dataframe(service.list_users(), use_container_width=True)
     st.subheader("Tambah User")
     email_new = st.text_input("Email Baru")
     name_new = st.text_input("Nama Baru")
     role_new = st.selectbox("Role Baru", ["EMPLOYEE", "MANAGER", "HR_ADMIN"], key="role_new")
     division_new = st.text_input("Division", value="")
-    managers_df = list_managers()
+    managers_df = service.list_managers()
     mgr_options = ["(None)"] + [f"{r['name']} ({r['email']})" for _, r in managers_df.iterrows()]
     mgr_sel = st.selectbox("Manager", options=list(range(len(mgr_options))), format_func=lambda i: mgr_options[i], key="mgr_new")
     manager_id_new = None if mgr_sel == 0 else int(managers_df.iloc[int(mgr_sel)-1]["id"])
@@ -1157,14 +755,36 @@ def page_hr_users(user):
             st.error("Email/Nama/Password wajib diisi.")
         else:
             try:
-                create_user(email_new, name_new, role_new, password_new, manager_id_new, division_new.strip() or None)
+                service.create_user(email_new, name_new, role_new, password_new, manager_id_new, division_new.strip() or None)
                 st.success("User dibuat.")
                 st.rerun()
-            except sqlite3.IntegrityError:
-                st.error("Email sudah digunakan.")
+            except ServiceError as e:
+                st.error(str(e))
+    st.markdown("---")
+    st.subheader("Import Massal (CSV/XLSX)")
+    st.caption("Kolom: " + ", ".join(user_import.COLUMNS) + ". Wajib: " + ", ".join(user_import.REQUIRED_COLUMNS) +
+               ". Import dibatalkan seluruhnya jika ada baris yang error.")
+    import_file = st.file_uploader("File user", type=["csv", "xlsx"], key="import_users_file")
+    import_year = st.number_input("Tahun Kuota Awal", min_value=2000, max_value=2100, value=current_year(), step=1,
+                                  key="import_year")
+    col_check, col_run = st.columns(2)
+    run_dry = col_check.button("Validasi (Dry Run)", disabled=import_file is None)
+    run_import = col_run.button("Import", disabled=import_file is None)
+    if import_file is not None and run_dry:
+        try:
+            _import_report(user_import.import_users(import_file, import_file.name, int(import_year)))
+        except ServiceError as e:
+            st.error(str(e))
+    if import_file is not None and run_import:
+        # Hash password untuk ribuan user butuh waktu: dikerjakan worker, halaman mem-polling status job
+        path = user_import.stage_upload(import_file.getvalue(), import_file.name)
+        st.session_state.import_job = jobs.enqueue("users.import", {
+            "path": path, "filename": import_file.name, "year": int(import_year)}, created_by=int(user["id"]))
+    job_status_panel(st.session_state.get("import_job"),
+                     lambda result: _import_report(user_import.ImportReport.from_result(result)))
     st.markdown("---")
     st.subheader("Edit / Delete User")
-    users_df2 = list_users()
+    users_df2 = service.list_users()
     if users_df2.empty:
         st.info("Belum ada user.")
         return
@@ -1176,7 +796,7 @@ def page_hr_users(user):
     edit_role = st.selectbox("Role", ["EMPLOYEE", "MANAGER", "HR_ADMIN"],
                              index=int(["EMPLOYEE", "MANAGER", "HR_ADMIN"].index(user_to_edit["role"])), key="edit_role")
     edit_division = st.text_input("Division", value=user_to_edit.get("division") or "", key="edit_division")
-    managers_df3 = list_managers()
+    managers_df3 = service.list_managers()
     mgr_opts3 = ["(None)"] + [f"{r['name']} ({r['email']})" for _, r in managers_df3.iterrows()]
     current_mgr_id = user_to_edit["manager_id"]
     if pd.isna(current_mgr_id):
@@ -1196,13 +816,11 @@ def page_hr_users(user):
     with col_save:
         if st.button("Simpan Perubahan"):
             try:
-                update_user(int(user_to_edit["id"]), edit_email, edit_name, edit_role, edit_manager_id,
-                            new_pw if new_pw else None, edit_division.strip() or None)
+                service.update_user(int(user_to_edit["id"]), edit_email, edit_name, edit_role, edit_manager_id,
+                                    new_pw if new_pw else None, edit_division.strip() or None)
                 st.success("Perubahan user disimpan.")
                 st.rerun()
-            except sqlite3.IntegrityError:
-                st.error("Email sudah digunakan user lain.")
-            except Exception as e:
+            except ServiceError as e:
                 st.error(str(e))
     with col_del:
         if st.button("Hapus User"):
@@ -1210,12 +828,429 @@ def page_hr_users(user):
                 st.error("Tidak dapat menghapus akun yang sedang login.")
             else:
                 try:
-                    delete_user(int(user_to_edit["id"]))
+                    service.delete_user(int(user_to_edit["id"]))
                     st.warning("User dihapus.")
                     st.rerun()
                 except Exception as e:
                     st.error(str(e))
 
+def page_hr_analytics(user):
+    st.header("Analytics Pemakaian per Divisi")
+    today = date.today()
+    col1, col2 = st.columns(2)
+    with col1:
+        year = st.number_input("Tahun", min_value=2000, max_value=2100, value=today.year, step=1, key="ana_year")
+    with col2:
+        month = st.selectbox("Bulan", [0] + list(range(1, 13)), index=today.month,
+                             format_func=lambda m: "(Semua)" if m == 0 else reports.MONTH_NAMES_ID[m - 1], key="ana_month")
+    df = service.usage_summary(int(year), month or None)
+    if df.empty:
+        st.info("Belum ada data pada periode ini.")
+    else:
+        approved = df[df["status"] == "APPROVED"]
+        pending = df[df["status"].isin(["PENDING_MANAGER", "PENDING_HR"])]
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Hari Cuti (APPROVED)", int(approved.loc[approved["type"] == "LEAVE", "days"].sum()))
+        c2.metric("Jam Change Off (APPROVED)", f"{approved.loc[approved['type'] == 'CHANGEOFF', 'hours'].sum():.1f}")
+        c3.metric("Request Pending", int(pending["requests"].sum()))
+        if not approved.empty:
+            st.subheader("Hari APPROVED per Divisi")
+            st.bar_chart(approved.pivot_table(index="division", columns="type", values="days", aggfunc="sum", fill_value=0))
+        st.subheader("Detail")
+        st.dataframe(df, use_container_width=True, hide_index=True)
+    with st.expander("Rebuild ringkasan"):
+        st.caption("Hitung ulang tabel ringkasan dari seluruh request (mis. setelah edit manual database).")
+        if st.button("Rebuild"):
+            st.session_state.summary_job = jobs.enqueue("usage_summary.rebuild", dedupe_key="usage_summary.rebuild",
+                                                        created_by=int(user["id"]))
+        job_status_panel(st.session_state.get("summary_job"),
+                         lambda r: st.success(f"Ringkasan dibangun ulang: {r.get('rows', 0)} baris."))
+
+QUEUE_LABELS = {"PENDING_MANAGER": "Antrian Manager", "PENDING_HR": "Antrian HR"}
+DIMENSION_LABELS = {"approver": "Approver", "division": "Divisi", "month": "Bulan masuk antrian"}
+
+@st.cache_data(max_entries=64, ttl=600, show_spinner=False)
+def cached_queue_times(queue: str, dimension: str, date_from: date, date_to: date, version: tuple) -> pd.DataFrame:
+    # version (service.request_events_version) ikut menjadi cache key; ttl menyegarkan umur request yang masih menunggu
+    return service.queue_times(queue, dimension, date_from, date_to)
+
+def page_hr_latency(user):
+    st.header("Approval Latency")
+    today = date.today()
+    c1, c2, c3, c4 = st.columns(4)
+    queue = c1.selectbox("Antrian", service.QUEUE_STATUSES, format_func=QUEUE_LABELS.get, key="lat_queue")
+    dimension = c2.selectbox("Per", service.LATENCY_DIMENSIONS, format_func=DIMENSION_LABELS.get, key="lat_dim")
+    date_from = c3.date_input("Masuk antrian dari", value=today - timedelta(days=90), key="lat_from")
+    date_to = c4.date_input("Sampai", value=today, key="lat_to")
+    if date_from > date_to:
+        st.error("Tanggal awal harus <= tanggal akhir.")
+        return
+    df = cached_queue_times(queue, dimension, date_from, date_to, service.request_events_version())
+    if df.empty:
+        st.info("Belum ada request yang masuk antrian ini pada periode tersebut.")
+    else:
+        late = df[df["oldest_waiting_h"].astype(float) > service.APPROVAL_SLA_HOURS]
+        hour_cols = ["p50_h", "p90_h", "p95_h", "avg_h", "max_h", "oldest_waiting_h"]
+        df[hour_cols] = df[hour_cols].astype(float).round(1)
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Diputuskan", int(df["decided"].sum()))
+        c2.metric("Masih menunggu", int(df["waiting"].sum()))
+        c3.metric("Tunggu terlama (jam)", f"{df['oldest_waiting_h'].max():.1f}" if df["waiting"].any() else "-")
+        if not late.empty:
+            st.warning(f"Ada request menunggu lebih dari {service.APPROVAL_SLA_HOURS:g} jam: "
+                       + ", ".join(f"{g} ({int(n)} request)" for g, n in zip(late[dimension], late["waiting"])))
+        chart = df.dropna(subset=["p50_h"]).set_index(dimension)[["p50_h", "p90_h"]]
+        if not chart.empty:
+            st.bar_chart(chart)
+        st.dataframe(df.rename(columns={dimension: DIMENSION_LABELS[dimension]}), use_container_width=True,
+                     hide_index=True)
+        st.caption("Waktu dalam jam. Persentil dihitung dari request yang sudah diputuskan; "
+                   "request lama direkonstruksi dari manager_at/hr_at (backfilled).")
+    with st.expander("Riwayat status satu request"):
+        rid = st.number_input("Request ID", min_value=1, step=1, key="lat_request_id")
+        events = service.request_events(int(rid))
+        if events.empty:
+            st.caption("Belum ada event untuk request ini.")
+        else:
+            st.dataframe(events, use_container_width=True, hide_index=True)
+
+def page_hr_search(user):
+    st.header("Cari Request")
+    if not service.search_available():
+        st.error("Full-text search tidak tersedia di build SQLite ini (FTS5 tidak aktif).")
+        return
+    text = st.text_input("Kata kunci", placeholder="lokasi, PIC, job execution, alasan, atau deskripsi aktivitas",
+                         key="search_text")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        status = st.selectbox("Status", ["(Semua)"] + list(service.STATUSES), key="search_status")
+    with col2:
+        division = st.selectbox("Divisi", ["(Semua)"] + service.list_divisions(), key="search_division")
+    with col3:
+        date_from = st.date_input("Periode Dari", None, key="search_from")
+    with col4:
+        date_to = st.date_input("Periode Sampai", None, key="search_to")
+    filters = (text, status, division, date_from, date_to)
+    if st.session_state.get("search_filters") != filters:
+        st.session_state.search_filters = filters
+        st.session_state.search_page = 1
+    if not text.strip():
+        st.info("Masukkan kata kunci untuk mencari.")
+        return
+    page = st.session_state.search_page
+    try:
+        started = perf_counter()
+        rows, total = service.search_requests(text, None if status == "(Semua)" else status,
+                                              None if division == "(Semua)" else division,
+                                              date_from, date_to, page=page)
+        elapsed_ms = (perf_counter() - started) * 1000
+    except ServiceError as e:
+        st.error(str(e))
+        return
+    if not total:
+        st.info("Tidak ada request yang cocok.")
+        return
+    pages = (total + service.SEARCH_PAGE_SIZE - 1) // service.SEARCH_PAGE_SIZE
+    st.caption(f"{total} hasil • halaman {page}/{pages} • {elapsed_ms:.1f} ms")
+    for r in rows:
+        with st.expander(f"ID: {r['id']} | {r['employee_name']} | Div {r['employee_division']} | {r['type']} | "
+                         f"{r['status']} | {r['span_start']} s/d {r['span_end']}"):
+            st.write(r["snippet"])
+            st.dataframe(pd.DataFrame([r]).drop(columns=["snippet", "rank"]), use_container_width=True, hide_index=True)
+    col_prev, col_next = st.columns(2)
+    with col_prev:
+        if st.button("← Sebelumnya", disabled=page <= 1, key="search_prev"):
+            st.session_state.search_page = page - 1
+            st.rerun()
+    with col_next:
+        if st.button("Berikutnya →", disabled=page >= pages, key="search_next"):
+            st.session_state.search_page = page + 1
+            st.rerun()
+
+def page_hr_export(user):
+    st.header("Export Payroll (Requests & Saldo Kuota)")
+    today = date.today()
+    col1, col2 = st.columns(2)
+    with col1:
+        date_from = st.date_input("Periode Dari", today.replace(day=1), key="exp_from")
+    with col2:
+        date_to = st.date_input("Periode Sampai", today, key="exp_to")
+    status = st.selectbox("Status", ["(Semua)", "APPROVED", "PENDING_MANAGER", "PENDING_HR", "REJECTED"], key="exp_status")
+    year = st.number_input("Tahun Kuota", min_value=2000, max_value=2100, value=current_year(), step=1, key="exp_year")
+    fmt = st.radio("Format", ["xlsx", "csv"], horizontal=True, key="exp_fmt")
+    datasets = ["all", "requests", "balances"] if fmt == "xlsx" else ["requests", "balances"]
+    dataset = st.selectbox("Data", datasets, key="exp_dataset")
+    if st.button("Generate Export"):
+        if date_to < date_from:
+            st.error("Tanggal akhir harus >= tanggal mulai")
+        else:
+            st.session_state.export_job = jobs.enqueue("export.payroll", {
+                "fmt": fmt, "date_from": date_from, "date_to": date_to, "year": int(year),
+                "status": None if status == "(Semua)" else status, "dataset": dataset}, created_by=int(user["id"]))
+    job_status_panel(st.session_state.get("export_job"), _export_done)
+
+def _export_done(result: dict):
+    path = result.get("path")
+    if not path or not os.path.exists(path):
+        st.info("File export sudah dibersihkan. Generate ulang.")
+        return
+    mime = ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if path.endswith(".xlsx")
+            else "text/csv")
+    st.success(f"Export selesai: {result.get('rows', 0)} baris.")
+    st.write(f"File: {os.path.basename(path)} • {human_size(os.path.getsize(path))}")
+    with open(path, "rb") as f:
+        st.download_button("Download Export", f, file_name=os.path.basename(path), mime=mime, key="dl_export")
+
+def page_hr_letters(user):
+    st.header("Surat Persetujuan (DOCX)")
+    today = date.today()
+    col1, col2 = st.columns(2)
+    with col1:
+        date_from = st.date_input("Periode Dari", today.replace(day=1), key="let_from")
+    with col2:
+        date_to = st.date_input("Periode Sampai", today, key="let_to")
+    st.caption(f"Template: {letters.LETTER_TEMPLATE or '(default)'} • Worker: {letters.LETTER_WORKERS} • "
+               f"Cache: {letters.LETTER_CACHE_DIR}")
+    if st.button("Generate Surat"):
+        if date_to < date_from:
+            st.error("Tanggal akhir harus >= tanggal mulai")
+        else:
+            st.session_state.letters_job = jobs.enqueue("letters.generate", {"date_from": date_from, "date_to": date_to},
+                                                        created_by=int(user["id"]))
+    job_status_panel(st.session_state.get("letters_job"), _letters_done)
+
+def _letters_done(result: dict):
+    path = result.get("path")
+    if not result.get("letters"):
+        st.info("Tidak ada request APPROVED pada periode ini.")
+        return
+    if not path or not os.path.exists(path):
+        st.info("File ZIP sudah dibersihkan. Generate ulang.")
+        return
+    st.success(f"{result['letters']} surat siap.")
+    st.write(f"File: {os.path.basename(path)} • {human_size(os.path.getsize(path))}")
+    with open(path, "rb") as f:
+        st.download_button("Download ZIP", f, file_name=os.path.basename(path), mime="application/zip",
+                           key="dl_letters")
+
+def _report_jobs_table(polling: bool):
+    jobs = reports.list_jobs()
+    if polling and not any(j["status"] in ("QUEUED", "RUNNING") for j in jobs):
+        st.rerun()  # semua job selesai: rerun penuh supaya polling berhenti
+    if not jobs:
+        st.info("Belum ada deck yang dibuat.")
+        return
+    for job in jobs:
+        label = f"{reports.MONTH_NAMES_ID[job['month'] - 1]} {job['year']} • {job['status']} • dibuat {job['created_at']}"
+        with st.container(border=True):
+            st.write(label)
+            if job["status"] == "DONE" and os.path.exists(job["path"]):
+                with open(job["path"], "rb") as f:
+                    st.download_button("Download PPTX", f, file_name=os.path.basename(job["path"]),
+                                       mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+                                       key=f"dl_report_{job['id']}")
+            elif job["status"] == "FAILED":
+                st.error(job["error"])
+
+def page_hr_reports(user):
+    st.header("Deck Ringkasan HR Bulanan (PPTX)")
+    today = date.today()
+    col1, col2 = st.columns(2)
+    with col1:
+        year = st.number_input("Tahun", min_value=2000, max_value=2100, value=today.year, step=1, key="rep_year")
+    with col2:
+        month = st.selectbox("Bulan", list(range(1, 13)), index=today.month - 1,
+                             format_func=lambda m: reports.MONTH_NAMES_ID[m - 1], key="rep_month")
+    if st.button("Generate Deck"):
+        reports.submit_monthly_deck(int(year), int(month), created_by=int(user["id"]))
+        st.success("Deck sedang dibuat di background. Status diperbarui otomatis.")
+    st.subheader("Riwayat")
+    running = any(j["status"] in ("QUEUED", "RUNNING") for j in reports.list_jobs())
+    # Selama ada job berjalan, hanya bagian ini yang di-rerun berkala
+    st.fragment(_report_jobs_table, run_every=2 if running else None)(running)
+
+def page_hr_diagnostics(user):
+    st.header("Diagnostics (Query & Rerun Timing)")
+    st.caption(f"Ring buffer: {dbtrace.QUERY_BUFFER_SIZE} query terakhir, {dbtrace.PAGE_BUFFER_SIZE} rerun terakhir • "
+               f"Slow query >= {dbtrace.SLOW_QUERY_MS:.0f} ms • Log: {dbtrace.SLOW_QUERY_LOG or '(nonaktif)'}")
+    if not dbtrace.TRACE_ENABLED:
+        st.warning("Tracing dimatikan (HRMS_QUERY_TRACE=0). Tidak ada data query yang dicatat.")
+    queries = dbtrace.query_records()
+    pages = dbtrace.page_records()
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Query tercatat", len(queries))
+    c2.metric("Slow query", sum(1 for q in queries if q["ms"] >= dbtrace.SLOW_QUERY_MS))
+    c3.metric("Rerun tercatat", len(pages))
+
+    st.subheader("Top Offenders (total waktu)")
+    top = dbtrace.top_queries(limit=25)
+    if top:
+        st.dataframe(pd.DataFrame(top)[["caller", "count", "total_ms", "avg_ms", "p95_ms", "max_ms", "rows", "sql"]],
+                     use_container_width=True, hide_index=True)
+        hist = pd.DataFrame(dbtrace.histogram([q["ms"] for q in queries]), columns=["bucket", "queries"])
+        st.bar_chart(hist.set_index("bucket"))
+    else:
+        st.info("Belum ada query yang tercatat.")
+
+    st.subheader("Rerun per Halaman")
+    summary = dbtrace.page_summary()
+    if summary:
+        st.dataframe(pd.DataFrame(summary)[["page", "count", "total_ms", "avg_ms", "p95_ms", "max_ms", "avg_queries"]],
+                     use_container_width=True, hide_index=True)
+        hist = pd.DataFrame(dbtrace.histogram([p["ms"] for p in pages]), columns=["bucket", "reruns"])
+        st.bar_chart(hist.set_index("bucket"))
+    else:
+        st.info("Belum ada rerun yang tercatat.")
+
+    with st.expander("Query terbaru (slow saja)"):
+        slow = [q for q in queries if q["ms"] >= dbtrace.SLOW_QUERY_MS]
+        if slow:
+            st.dataframe(pd.DataFrame(slow[::-1]), use_container_width=True, hide_index=True)
+        else:
+            st.write("Tidak ada slow query di buffer.")
+    if st.button("Reset Buffer"):
+        dbtrace.clear()
+        st.rerun()
+
+    if service.is_memory_db():
+        st.subheader("Database In-Memory")
+        st.caption(f"Snapshot: {service.MEMORY_SNAPSHOT_PATH or '(HRMS_MEMORY_SNAPSHOT belum diatur)'}")
+        if service.MEMORY_SNAPSHOT_PATH and st.button("Snapshot ke Disk"):
+            try:
+                path = service.snapshot_memory_db()
+                st.success(f"Snapshot tersimpan: {path}")
+            except (ServiceError, OSError) as e:
+                st.error(str(e))
+
+    st.subheader("Backup Database")
+    interval = (f"setiap {backup.BACKUP_INTERVAL_HOURS:g} jam" if backup.BACKUP_INTERVAL_HOURS > 0
+                else "terjadwal nonaktif (HRMS_BACKUP_INTERVAL_HOURS=0)")
+    st.caption(f"Folder: {backup.BACKUP_DIR} • {interval} • simpan {backup.BACKUP_KEEP} terbaru")
+    if backup.last_error():
+        st.error(f"Backup terakhir gagal: {backup.last_error()}")
+    c1, c2 = st.columns(2)
+    if c1.button("Backup Sekarang"):
+        try:
+            r = backup.run_backup()
+            st.success(f"{r.name}: {human_size(r.compressed_bytes)} (DB {human_size(r.db_bytes)}) "
+                       f"dalam {r.duration_seconds:.1f} detik.")
+        except Exception as e:
+            st.error(str(e))
+    backups = backup.list_backups()
+    if backups and c2.button("Verifikasi Backup Terbaru"):
+        v = backup.verify(backups[0].name)
+        if v.ok:
+            st.success(f"{v.name}: OK")
+        else:
+            st.error(f"{v.name}: " + " • ".join(v.problems[:10]))
+    if backups:
+        st.dataframe(pd.DataFrame([{"backup": b.name, "dibuat": b.created_at, "db": human_size(b.db_bytes),
+                                    "terkompres": human_size(b.compressed_bytes), "file upload": len(b.uploads),
+                                    "ukuran upload": human_size(b.upload_bytes), "durasi (detik)": b.duration_seconds}
+                                   for b in backups]), use_container_width=True, hide_index=True)
+    else:
+        st.info("Belum ada backup.")
+
+    st.subheader("Arsip Request")
+    days = st.number_input("Arsipkan request closed yang tidak berubah selama (hari)", min_value=1,
+                           value=archive.ARCHIVE_AFTER_DAYS, step=30, key="archive_days")
+    if st.button("Arsipkan Sekarang"):
+        try:
+            report = archive.archive_closed(int(days), dry_run=False)
+            st.success(f"{report.archived} request dipindah ke arsip ({report.batches} batch).")
+        except (ServiceError, OSError) as e:
+            st.error(str(e))
+    info = archive.stats()
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Request aktif (tabel utama)", info["hot"])
+    c2.metric("Request di arsip", info["archived"])
+    c3.metric(f"Siap diarsip (> {archive.ARCHIVE_AFTER_DAYS} hari)", info["candidates"])
+    st.caption(f"File arsip: {info['archive_path']} • Terakhir diarsip: {info['last_archived_at'] or '-'}")
+
+    st.subheader("Maintenance Database")
+    schedule = (f"jendela {maintenance.MAINT_WINDOW or 'kapan saja'}, setiap {maintenance.MAINT_INTERVAL_HOURS:g} jam"
+                if maintenance.MAINT_INTERVAL_HOURS > 0 else "terjadwal nonaktif (HRMS_MAINT_INTERVAL_HOURS=0)")
+    st.caption(f"{schedule} • batas waktu {maintenance.MAINT_TIME_BUDGET:g} detik per run")
+    if maintenance.last_error():
+        st.error(f"Maintenance terakhir bermasalah: {maintenance.last_error()}")
+    if st.button("Jalankan Maintenance Sekarang"):
+        try:
+            r = maintenance.run_maintenance()
+            msg = (f"{r.outcome}: freelist {r.freelist_before} → {r.freelist_after} halaman, "
+                   f"{r.duration_ms} ms")
+            (st.success if r.outcome == "ok" else st.warning)(msg)
+        except Exception as e:
+            st.error(str(e))
+    if maintenance.needs_auto_vacuum_migration():
+        st.warning("Database lama belum auto_vacuum=INCREMENTAL: incremental vacuum dilewati sampai dimigrasi. "
+                   "Migrasi menjalankan VACUUM penuh tanpa batas waktu dan mengunci database selama berjalan.")
+        if st.button("Migrasi auto_vacuum (VACUUM penuh)"):
+            try:
+                st.success(maintenance.migrate_auto_vacuum())
+            except Exception as e:
+                st.error(str(e))
+    runs = maintenance.history(90)
+    if runs.empty:
+        st.info("Belum ada run maintenance.")
+    else:
+        last = runs.iloc[0]
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Ukuran database", human_size(int(last["db_bytes"] or 0)))
+        c2.metric("Fragmentasi (freelist)", f"{(last['fragmentation'] or 0):.1%}")
+        c3.metric("Index tanpa statistik", int(last["unanalyzed_indexes"] or 0))
+        c4.metric("quick_check", last["quick_check"] or "-")
+        trend = runs.sort_values("started_at").set_index("started_at")
+        st.line_chart(trend[["fragmentation"]])
+        st.dataframe(runs[["started_at", "trigger", "outcome", "duration_ms", "page_count", "freelist_before",
+                           "freelist_after", "auto_vacuum", "journal_mode", "analyzed", "unanalyzed_indexes",
+                           "quick_check"]], use_container_width=True, hide_index=True)
+        with st.expander("Detail langkah run terakhir"):
+            st.dataframe(pd.DataFrame(json.loads(last["steps_json"] or "[]")), use_container_width=True,
+                         hide_index=True)
+
+    st.subheader("Hash Password")
+    st.caption(f"Hash baru: {passwords.PW_SCHEME} {passwords.current_params()} • hash lama diganti otomatis saat "
+               "user login. Kalibrasi work factor: python passwords.py calibrate --target-ms 250")
+    st.dataframe(service.password_hash_summary(), use_container_width=True, hide_index=True)
+
+    st.subheader("Notifikasi Email")
+    counts = notifications.status_counts()
+    target = (f"{notifications.SMTP_HOST}:{notifications.SMTP_PORT}" if notifications.smtp_configured()
+              else "nonaktif (HRMS_SMTP_HOST kosong)")
+    st.caption(f"SMTP: {target} • digest per penerima setelah {service.NOTIFY_COALESCE_SECONDS:g} detik • batch "
+               f"{notifications.NOTIFY_BATCH_SIZE} • " + " • ".join(f"{k}: {v}" for k, v in sorted(counts.items())))
+    if st.button("Kirim Sekarang", disabled=not counts.get("PENDING")):
+        jobs.enqueue(notifications.FLUSH_KIND, dedupe_key=notifications.FLUSH_KIND)
+        st.success("Flush notifikasi diantrekan.")
+    outbox = notifications.list_outbox(limit=100)
+    if not outbox.empty:
+        st.dataframe(outbox, use_container_width=True, hide_index=True)
+
+    st.subheader("Background Jobs")
+    pool = job_workers()
+    counts = jobs.status_counts()
+    st.caption(f"Worker hidup: {pool.alive}/{pool.workers} • lease {jobs.JOB_LEASE_SECONDS} detik • "
+               f"maks {jobs.JOB_MAX_ATTEMPTS} percobaan • " + " • ".join(f"{k}: {v}" for k, v in sorted(counts.items())))
+    recent = jobs.list_jobs(limit=100)
+    if not recent:
+        st.info("Belum ada job.")
+        return
+    df = pd.DataFrame(recent)[["id", "kind", "status", "attempts", "max_attempts", "run_after", "created_at",
+                               "finished_at", "worker", "error"]]
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    c1, c2, c3 = st.columns([2, 1, 1])
+    job_id = c1.number_input("Job ID", min_value=1, step=1, value=int(recent[0]["id"]), key="diag_job_id")
+    if c2.button("Ulangi Job"):
+        if jobs.retry(int(job_id)):
+            st.success(f"Job #{job_id} diantrekan ulang.")
+        else:
+            st.warning("Hanya job FAILED/CANCELLED yang bisa diulang.")
+    if c3.button("Batalkan Job"):
+        if jobs.cancel(int(job_id)):
+            st.success(f"Job #{job_id} dibatalkan.")
+        else:
+            st.warning("Hanya job QUEUED yang bisa dibatalkan.")
+
 def main():
     st.set_page_config(page_title="HR-MS CISTECH", layout="wide")
     col1, col2 = st.columns([1, 4])
@@ -1224,6 +1259,13 @@ def main():
     if pyholidays is None:
         st.warning("Package 'holidays' tidak ditemukan. Fitur kalender libur dinonaktifkan. Install: pip install holidays")
     init_db()
+    metrics.register_collector("queue_depth", service.collect_queue_depth)
+    metrics.register_collector("job_queue_depth", jobs.collect_depth)
+    metrics.register_collector("notification_outbox", notifications.collect_outbox)
+    metrics.start_exporter()
+    job_workers()
+    backup.start_scheduler()
+    maintenance.start_scheduler()
     if not st.session_state.authenticated:
         page_login()
         return
@@ -1233,32 +1275,40 @@ def main():
         return
     choice = sidebar_menu()
     if user["role"] == "EMPLOYEE":
-        if choice == "Dashboard":
-            page_employee_dashboard(user)
-        elif choice == "Submit Leave":
-            page_submit_leave(user)
-        elif choice == "Submit Change Off":
-            page_submit_changeoff(user)
-        elif choice == "My Requests":
-            page_my_requests(user)
+        pages = {
+            "Dashboard": page_employee_dashboard,
+            "Submit Leave": page_submit_leave,
+            "Submit Change Off": page_submit_changeoff,
+            "My Requests": page_my_requests,
+        }
     elif user["role"] == "MANAGER":
-        if choice == "Dashboard":
-            page_employee_dashboard(user)
-        elif choice == "Submit Leave":
-            page_submit_leave(user)
-        elif choice == "Submit Change Off":
-            page_submit_changeoff(user)
-        elif choice == "Pending (Manager)":
-            page_manager_pending(user)
-        elif choice == "Team Requests":
-            page_manager_team(user)
+        pages = {
+            "Dashboard": page_employee_dashboard,
+            "Submit Leave": page_submit_leave,
+            "Submit Change Off": page_submit_changeoff,
+            "Pending (Manager)": page_manager_pending,
+            "Team Requests": page_manager_team,
+        }
     elif user["role"] == "HR_ADMIN":
-        if choice == "Pending (HR)":
-            page_hr_pending(user)
-        elif choice == "Quotas":
-            page_hr_quotas(user)
-        elif choice == "Users":
-            page_hr_users(user)
+        pages = {
+            "Pending (HR)": page_hr_pending,
+            "Search": page_hr_search,
+            "Quotas": page_hr_quotas,
+            "Users": page_hr_users,
+            "Analytics": page_hr_analytics,
+            "Approval Latency": page_hr_latency,
+            "Export": page_hr_export,
+            "Letters": page_hr_letters,
+            "Reports": page_hr_reports,
+            "Diagnostics": page_hr_diagnostics,
+        }
+    else:
+        pages = {}
+    page = pages.get(choice)
+    if page:
+        # Timing per rerun halaman (termasuk rerun yang dipotong st.rerun())
+        with dbtrace.page_timer(page.__name__):
+            page(user)
 
 if __name__ == "__main__":
     main()
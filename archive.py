@@ -0,0 +1,135 @@
+"""Arsip request lama yang sudah closed ke file SQLite terpisah (hot/cold).
+
+Request APPROVED/REJECTED yang tidak berubah selama HRMS_ARCHIVE_AFTER_DAYS
+dipindah ke archive.requests_archive (service.ARCHIVE_PATH) per batch:
+
+1. salin batch ke arsip (INSERT OR REPLACE, ikut snapshot nama/email/divisi
+   karyawan supaya riwayat tetap terbaca walau user dihapus) lalu commit;
+2. hapus batch yang sama dari tabel utama (hanya id yang sudah ada di arsip).
+
+Dua langkah ini sengaja dua transaksi: commit lintas database ter-ATTACH di
+mode WAL tidak atomik, jadi urutan salin-dulu-baru-hapus memastikan tidak ada
+request yang hilang. Jika proses terputus di antaranya, baris ganda dilewati
+oleh view riwayat dan dibereskan pada run berikutnya.
+
+Activities (activities_json) dan referensi lampiran (timesheet_path) ikut
+pindah bersama barisnya; file lampiran tetap di HRMS_UPLOAD_DIR. Ruang kosong
+di database utama diklaim ulang oleh maintenance (incremental vacuum).
+
+    python archive.py run --days 365 --dry-run
+    python archive.py run
+    python archive.py stats
+"""
+import os
+import sys
+import json
+import argparse
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+import service
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("HRMS_ARCHIVE_AFTER_DAYS", 365))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("HRMS_ARCHIVE_BATCH_SIZE", 1000))
+CLOSED_STATUSES = ("APPROVED", "REJECTED")
+
+@dataclass
+class ArchiveReport:
+    cutoff: str
+    dry_run: bool
+    candidates: int = 0
+    archived: int = 0
+    batches: int = 0
+
+def cutoff_for(days: int, now: Optional[datetime] = None) -> str:
+    return ((now or datetime.utcnow()) - timedelta(days=days)).isoformat()
+
+def _candidate_where(alias: str = "") -> str:
+    prefix = f"{alias}." if alias else ""
+    return f"{prefix}status IN {CLOSED_STATUSES} AND {prefix}updated_at < :cutoff"
+
+def archive_closed(older_than_days: Optional[int] = None, dry_run: bool = True,
+                   batch_size: int = ARCHIVE_BATCH_SIZE) -> ArchiveReport:
+    """Pindahkan request closed yang updated_at-nya lebih lama dari older_than_days ke arsip."""
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else int(older_than_days)
+    if days < 1:
+        raise service.ValidationError("Umur arsip minimal 1 hari.")
+    report = ArchiveReport(cutoff_for(days), dry_run)
+    params = {"cutoff": report.cutoff}
+    conn = service.get_conn()
+    try:
+        report.candidates = conn.execute(f"SELECT COUNT(1) FROM requests WHERE {_candidate_where()}",
+                                         params).fetchone()[0]
+        if dry_run or not report.candidates:
+            return report
+        service.attach_archive(conn, create=True)
+        columns = [name for name, _ in service.request_columns(conn)]
+        col_list = ", ".join(columns)
+        extra = ", ".join(name for name, _ in service.ARCHIVE_EXTRA_COLUMNS)
+        last_id = 0
+        while True:
+            ids = [r[0] for r in conn.execute(
+                f"SELECT id FROM requests WHERE {_candidate_where()} AND id > :after ORDER BY id LIMIT :limit",
+                dict(params, after=last_id, limit=int(batch_size)))]
+            if not ids:
+                break
+            last_id = ids[-1]
+            batch = {"ids": json.dumps(ids), "now": datetime.utcnow().isoformat(), **params}
+            # 1) salin ke arsip
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"""
+                INSERT OR REPLACE INTO {service.ARCHIVE_SCHEMA}.requests_archive({col_list}, {extra})
+                SELECT {", ".join(f"r.{c}" for c in columns)}, u.name, u.email, u.division, :now
+                FROM main.requests r LEFT JOIN users u ON u.id = r.user_id
+                WHERE r.id IN (SELECT value FROM json_each(:ids)) AND {_candidate_where('r')}
+            """, batch)
+            conn.commit()
+            # 2) hapus dari tabel utama, hanya yang sudah pasti ada di arsip
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"""
+                DELETE FROM main.requests
+                WHERE id IN (SELECT value FROM json_each(:ids)) AND {_candidate_where()}
+                  AND id IN (SELECT id FROM {service.ARCHIVE_SCHEMA}.requests_archive)
+            """, batch)
+            report.archived += conn.execute("SELECT changes()").fetchone()[0]
+            conn.commit()
+            report.batches += 1
+    finally:
+        conn.close()
+    return report
+
+def stats() -> dict:
+    """Jumlah request di tabel utama vs arsip, plus kandidat arsip dengan umur default."""
+    conn = service.get_conn()
+    try:
+        out = {"hot": conn.execute("SELECT COUNT(1) FROM requests").fetchone()[0],
+               "candidates": conn.execute(f"SELECT COUNT(1) FROM requests WHERE {_candidate_where()}",
+                                          {"cutoff": cutoff_for(ARCHIVE_AFTER_DAYS)}).fetchone()[0],
+               "archived": 0, "last_archived_at": None, "archive_path": service.ARCHIVE_PATH}
+        if service.attach_archive(conn):
+            row = conn.execute(f"SELECT COUNT(1), MAX(archived_at) FROM {service.ARCHIVE_SCHEMA}.requests_archive").fetchone()
+            out["archived"], out["last_archived_at"] = row[0], row[1]
+    finally:
+        conn.close()
+    return out
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRMS request archival")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="Pindahkan request closed yang lama ke arsip")
+    p_run.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    p_run.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    p_run.add_argument("--dry-run", action="store_true")
+    sub.add_parser("stats", help="Jumlah request di tabel utama dan arsip")
+    args = parser.parse_args(argv)
+    service.init_db()
+    if args.command == "run":
+        report = archive_closed(args.days, dry_run=args.dry_run, batch_size=args.batch_size)
+        print(f"cutoff={report.cutoff} candidates={report.candidates} archived={report.archived} "
+              f"batches={report.batches} dry_run={report.dry_run}", file=sys.stderr)
+    else:
+        print(json.dumps(stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""Backup online database HRMS + manifest lampiran.
+
+Snapshot dibuat dengan sqlite3 backup API per langkah kecil
+(HRMS_BACKUP_PAGES_PER_STEP halaman, jeda HRMS_BACKUP_STEP_SLEEP detik) di dalam
+satu read transaction pada koneksi sumber: di mode WAL penulis tidak pernah
+diblokir, dan backup tidak restart walau ada commit baru selama proses (yang
+disalin adalah snapshot saat backup dimulai). Hasilnya di-quick_check, dikompres
+gzip, lalu ditulis atomik ke HRMS_BACKUP_DIR bersama manifest JSON berisi
+checksum database dan daftar file di UPLOAD_DIR (path, ukuran, mtime, sha256).
+Hanya HRMS_BACKUP_KEEP backup terbaru yang disimpan.
+
+Scheduler (start_scheduler) berjalan di thread daemon, sekali per proses,
+setiap HRMS_BACKUP_INTERVAL_HOURS (0 = mati).
+
+    python backup.py run
+    python backup.py list
+    python backup.py verify [hrms-20260101-020000.db.gz] [--deep]
+    python backup.py restore hrms-20260101-020000.db.gz [--target data/hrms.db]
+
+Restore harus dijalankan saat aplikasi berhenti: file database lama (beserta
+-wal/-shm) dipindah ke *.pre-restore-<waktu>, bukan dihapus.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+import traceback
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from typing import List, Optional
+
+import metrics
+import service
+
+BACKUP_DIR = os.environ.get("HRMS_BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.environ.get("HRMS_BACKUP_KEEP", 7))
+BACKUP_INTERVAL_HOURS = float(os.environ.get("HRMS_BACKUP_INTERVAL_HOURS", 24))  # 0 = scheduler mati
+BACKUP_PAGES_PER_STEP = int(os.environ.get("HRMS_BACKUP_PAGES_PER_STEP", 256))
+BACKUP_STEP_SLEEP = float(os.environ.get("HRMS_BACKUP_STEP_SLEEP", 0.005))  # detik
+BACKUP_COMPRESS_LEVEL = int(os.environ.get("HRMS_BACKUP_COMPRESS_LEVEL", 6))
+
+PREFIX = "hrms-"
+DB_SUFFIX = ".db.gz"
+MANIFEST_SUFFIX = ".manifest.json"
+_CHUNK = 1024 * 1024
+
+_backup_lock = threading.Lock()  # satu backup pada satu waktu per proses
+_scheduler_lock = threading.Lock()
+_scheduler_started = False
+_last_error: Optional[str] = None
+
+@dataclass
+class BackupResult:
+    name: str
+    created_at: str
+    duration_seconds: float
+    db_bytes: int
+    compressed_bytes: int
+    db_sha256: str
+    page_count: int
+    quick_check: str
+    uploads: List[dict] = field(default_factory=list)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(BACKUP_DIR, self.name + DB_SUFFIX)
+
+    @property
+    def upload_bytes(self) -> int:
+        return sum(f["size"] for f in self.uploads)
+
+@dataclass
+class VerifyResult:
+    name: str
+    ok: bool
+    problems: List[str] = field(default_factory=list)
+
+# -------------------- Util --------------------
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _manifest_path(name: str) -> str:
+    return os.path.join(BACKUP_DIR, name + MANIFEST_SUFFIX)
+
+def _name_from_arg(value: str) -> str:
+    base = os.path.basename(value)
+    for suffix in (DB_SUFFIX, MANIFEST_SUFFIX):
+        if base.endswith(suffix):
+            return base[:-len(suffix)]
+    return base
+
+def load_manifest(name: str) -> BackupResult:
+    with open(_manifest_path(name), encoding="utf-8") as f:
+        return BackupResult(**json.load(f))
+
+def list_backups() -> List[BackupResult]:
+    """Backup yang punya manifest, terbaru dulu."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    out = []
+    for entry in sorted(os.listdir(BACKUP_DIR), reverse=True):
+        if entry.startswith(PREFIX) and entry.endswith(MANIFEST_SUFFIX):
+            try:
+                out.append(load_manifest(entry[:-len(MANIFEST_SUFFIX)]))
+            except (OSError, ValueError, TypeError):
+                continue
+    return out
+
+def last_error() -> Optional[str]:
+    return _last_error
+
+# -------------------- Manifest upload --------------------
+def upload_manifest(previous: Optional[List[dict]] = None) -> List[dict]:
+    """Daftar file di UPLOAD_DIR. sha256 dari manifest sebelumnya dipakai ulang jika ukuran+mtime sama."""
+    known = {(f["path"], f["size"], f["mtime"]): f["sha256"] for f in previous or []}
+    files = []
+    root = service.UPLOAD_DIR
+    if not os.path.isdir(root):
+        return files
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            full = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue  # terhapus saat sedang di-scan
+            rel = os.path.relpath(full, root).replace(os.sep, "/")
+            mtime = int(st.st_mtime)
+            sha = known.get((rel, st.st_size, mtime)) or _sha256_file(full)
+            files.append({"path": rel, "size": st.st_size, "mtime": mtime, "sha256": sha})
+    files.sort(key=lambda f: f["path"])
+    return files
+
+# -------------------- Backup --------------------
+def _snapshot(dest_path: str) -> int:
+    """Salin database ke dest_path per langkah kecil; kembalikan jumlah halaman."""
+    src = service.get_conn()
+    dst = sqlite3.connect(dest_path)
+    try:
+        # Read transaction menahan snapshot WAL: backup konsisten tanpa restart, penulis tetap jalan
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(1) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=max(1, BACKUP_PAGES_PER_STEP), sleep=BACKUP_STEP_SLEEP)
+        src.rollback()
+        # Snapshot berdiri sendiri: tanpa WAL supaya satu file saja yang dikompres
+        dst.execute("PRAGMA journal_mode=DELETE")
+        return dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+def _quick_check(path: str) -> str:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = [r[0] for r in conn.execute("PRAGMA quick_check")]
+    finally:
+        conn.close()
+    return "ok" if rows == ["ok"] else "; ".join(rows[:20])
+
+def _compress(src_path: str, dest_path: str):
+    tmp = f"{dest_path}.tmp"
+    with open(src_path, "rb") as src, gzip.open(tmp, "wb", compresslevel=BACKUP_COMPRESS_LEVEL) as dst:
+        shutil.copyfileobj(src, dst, _CHUNK)
+    os.replace(tmp, dest_path)
+
+def run_backup() -> BackupResult:
+    """Buat satu backup (snapshot DB terkompres + manifest), lalu rotasi."""
+    global _last_error
+    with _backup_lock:
+        started = time.perf_counter()
+        now = datetime.now()
+        name = PREFIX + now.strftime("%Y%m%d-%H%M%S")
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        n = 1
+        while os.path.exists(_manifest_path(name)):  # dua backup di detik yang sama
+            n += 1
+            name = PREFIX + now.strftime("%Y%m%d-%H%M%S") + f"-{n}"
+        raw = os.path.join(BACKUP_DIR, name + ".db.tmp")
+        try:
+            page_count = _snapshot(raw)
+            check = _quick_check(raw)
+            if check != "ok":
+                raise service.InvalidState(f"Snapshot gagal quick_check: {check}")
+            db_bytes, db_sha = os.path.getsize(raw), _sha256_file(raw)
+            _compress(raw, os.path.join(BACKUP_DIR, name + DB_SUFFIX))
+            previous = list_backups()
+            uploads = upload_manifest(previous[0].uploads if previous else None)
+            result = BackupResult(name=name, created_at=now.isoformat(timespec="seconds"),
+                                  duration_seconds=0.0, db_bytes=db_bytes,
+                                  compressed_bytes=os.path.getsize(os.path.join(BACKUP_DIR, name + DB_SUFFIX)),
+                                  db_sha256=db_sha, page_count=page_count, quick_check=check, uploads=uploads)
+            result.duration_seconds = round(time.perf_counter() - started, 3)
+            tmp = _manifest_path(name) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(asdict(result), f, ensure_ascii=False, indent=1)
+            os.replace(tmp, _manifest_path(name))
+        except Exception as e:
+            _last_error = f"{type(e).__name__}: {e}"
+            metrics.BACKUPS.inc(outcome="error")
+            for leftover in (os.path.join(BACKUP_DIR, name + DB_SUFFIX), os.path.join(BACKUP_DIR, name + DB_SUFFIX + ".tmp")):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+        finally:
+            if os.path.exists(raw):
+                os.remove(raw)
+        _last_error = None
+        metrics.BACKUPS.inc(outcome="ok")
+        metrics.BACKUP_SECONDS.observe(result.duration_seconds)
+        metrics.BACKUP_LAST_SUCCESS.set(time.time())
+        metrics.BACKUP_LAST_BYTES.set(result.db_bytes, kind="db")
+        metrics.BACKUP_LAST_BYTES.set(result.compressed_bytes, kind="compressed")
+        metrics.BACKUP_LAST_BYTES.set(result.upload_bytes, kind="uploads")
+        rotate()
+        return result
+
+def rotate(keep: int = None) -> List[str]:
+    """Hapus backup lama di luar `keep` terbaru; kembalikan nama yang dihapus."""
+    keep = BACKUP_KEEP if keep is None else keep
+    removed = []
+    for old in list_backups()[max(1, keep):]:
+        for path in (old.path, _manifest_path(old.name)):
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(old.name)
+    return removed
+
+# -------------------- Verify & restore --------------------
+def _decompress(name: str, dest_path: str) -> str:
+    """Ekstrak backup ke dest_path sambil menghitung sha256."""
+    h = hashlib.sha256()
+    with gzip.open(os.path.join(BACKUP_DIR, name + DB_SUFFIX), "rb") as src, open(dest_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(_CHUNK), b""):
+            h.update(chunk)
+            dst.write(chunk)
+    return h.hexdigest()
+
+def verify(name: Optional[str] = None, deep: bool = False) -> VerifyResult:
+    """Cek checksum + integrity_check database backup dan keberadaan file upload di manifest.
+
+    deep=True juga menghitung ulang sha256 setiap file upload.
+    """
+    if name is None:
+        backups = list_backups()
+        if not backups:
+            raise service.ValidationError("Belum ada backup.")
+        name = backups[0].name
+    name = _name_from_arg(name)
+    manifest = load_manifest(name)
+    result = VerifyResult(name, ok=True)
+    tmp = os.path.join(BACKUP_DIR, name + ".verify.tmp")
+    try:
+        sha = _decompress(name, tmp)
+        if sha != manifest.db_sha256:
+            result.problems.append("Checksum database tidak cocok dengan manifest.")
+        conn = sqlite3.connect(f"file:{tmp}?mode=ro", uri=True)
+        try:
+            rows = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+        finally:
+            conn.close()
+        if rows != ["ok"]:
+            result.problems.append("integrity_check: " + "; ".join(rows[:20]))
+    except (OSError, EOFError, sqlite3.Error) as e:
+        result.problems.append(f"Gagal membaca backup: {e}")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    for f in manifest.uploads:
+        path = os.path.join(service.UPLOAD_DIR, f["path"])
+        if not os.path.exists(path):
+            result.problems.append(f"Upload hilang: {f['path']}")
+        elif os.path.getsize(path) != f["size"]:
+            result.problems.append(f"Ukuran upload berubah: {f['path']}")
+        elif deep and _sha256_file(path) != f["sha256"]:
+            result.problems.append(f"Checksum upload berubah: {f['path']}")
+    result.ok = not result.problems
+    return result
+
+def restore(name: str, target: Optional[str] = None) -> str:
+    """Pulihkan backup ke target (default HRMS_DB_PATH). Jalankan saat aplikasi berhenti.
+
+    Database lama beserta -wal/-shm dipindah ke <target>.pre-restore-<waktu>*.
+    """
+    name = _name_from_arg(name)
+    target = target or service.DB_PATH
+    manifest = load_manifest(name)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    tmp = f"{target}.restore.tmp"
+    try:
+        if _decompress(name, tmp) != manifest.db_sha256:
+            raise service.InvalidState("Checksum backup tidak cocok dengan manifest; restore dibatalkan.")
+        conn = sqlite3.connect(tmp)
+        try:
+            rows = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+        if rows != ["ok"]:
+            raise service.InvalidState("Backup gagal integrity_check; restore dibatalkan.")
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(target + suffix):
+                os.replace(target + suffix, f"{target}.pre-restore-{stamp}{suffix}")
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return target
+
+# -------------------- Scheduler --------------------
+def _seconds_until_due() -> float:
+    backups = list_backups()
+    if not backups:
+        return 0.0
+    last = datetime.fromisoformat(backups[0].created_at)
+    return max(0.0, BACKUP_INTERVAL_HOURS * 3600 - (datetime.now() - last).total_seconds())
+
+def _scheduler_loop():
+    while True:
+        wait = _seconds_until_due()
+        if wait > 0:
+            time.sleep(min(wait, 3600))
+            continue
+        try:
+            run_backup()
+        except Exception:
+            traceback.print_exc()
+            time.sleep(min(BACKUP_INTERVAL_HOURS * 3600, 900))  # jangan retry terus-menerus
+
+def start_scheduler() -> bool:
+    """Jalankan backup terjadwal sekali per proses. Aman dipanggil di setiap rerun."""
+    global _scheduler_started
+    if BACKUP_INTERVAL_HOURS <= 0:
+        return False
+    with _scheduler_lock:
+        if _scheduler_started:
+            return False
+        _scheduler_started = True
+    threading.Thread(target=_scheduler_loop, name="hrms-backup", daemon=True).start()
+    return True
+
+# -------------------- CLI --------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRMS database backup")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("run", help="Buat backup sekarang")
+    sub.add_parser("list", help="Daftar backup")
+    p_verify = sub.add_parser("verify", help="Verifikasi backup (default: terbaru)")
+    p_verify.add_argument("name", nargs="?")
+    p_verify.add_argument("--deep", action="store_true", help="Hitung ulang sha256 file upload")
+    p_restore = sub.add_parser("restore", help="Pulihkan backup (aplikasi harus berhenti)")
+    p_restore.add_argument("name")
+    p_restore.add_argument("--target", default=None)
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        service.init_db()
+        r = run_backup()
+        print(f"{r.name}: db={r.db_bytes} gz={r.compressed_bytes} uploads={len(r.uploads)} "
+              f"({r.upload_bytes} byte) durasi={r.duration_seconds}s", file=sys.stderr)
+    elif args.command == "list":
+        for r in list_backups():
+            print(f"{r.name}\t{r.created_at}\tdb={r.db_bytes}\tgz={r.compressed_bytes}\t"
+                  f"uploads={len(r.uploads)}\t{r.duration_seconds}s")
+    elif args.command == "verify":
+        r = verify(args.name, deep=args.deep)
+        print(f"{r.name}: {'OK' if r.ok else 'GAGAL'}")
+        for problem in r.problems:
+            print(f"  - {problem}")
+        sys.exit(0 if r.ok else 1)
+    else:
+        print(f"Restored ke {restore(args.name, args.target)}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
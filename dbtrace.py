@@ -0,0 +1,355 @@
+"""Instrumentasi data layer: timing per statement SQL dan durasi rerun per halaman.
+
+Modul ini sengaja dipisah dari app.py karena app.py dieksekusi ulang pada
+setiap rerun Streamlit, sedangkan modul yang di-import tetap hidup selama
+proses berjalan. Ring buffer di sini jadi bertahan lintas rerun dan lintas sesi.
+"""
+import os
+import sys
+import time
+import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+import sqlite3
+
+import metrics
+
+# -------------------- Konfigurasi --------------------
+TRACE_ENABLED = os.environ.get("HRMS_QUERY_TRACE", "1") not in ("0", "false", "no")
+QUERY_BUFFER_SIZE = int(os.environ.get("HRMS_QUERY_BUFFER_SIZE", 2000))
+PAGE_BUFFER_SIZE = int(os.environ.get("HRMS_PAGE_BUFFER_SIZE", 500))
+SLOW_QUERY_MS = float(os.environ.get("HRMS_SLOW_QUERY_MS", 200))
+SLOW_QUERY_LOG = os.environ.get("HRMS_SLOW_QUERY_LOG", "")  # kosong = tidak menulis file
+SQL_TEXT_MAX = 400
+DB_LOCK_RETRIES = int(os.environ.get("HRMS_DB_LOCK_RETRIES", 3))
+DB_LOCK_BACKOFF = float(os.environ.get("HRMS_DB_LOCK_BACKOFF", 0.05))  # detik, dikali 2 tiap retry
+
+# Batas bucket histogram (ms); bucket terakhir = di atas batas terakhir
+LATENCY_BUCKETS_MS = (1, 5, 20, 100, 500, 2000)
+
+_lock = threading.Lock()
+_queries = deque(maxlen=QUERY_BUFFER_SIZE)
+_pages = deque(maxlen=PAGE_BUFFER_SIZE)
+_local = threading.local()
+
+# Frame dari modul-modul ini dilewati saat mencari fungsi pemanggil
+_SKIP_MODULES = (__name__, "pandas", "sqlite3", "contextlib")
+
+def _normalize_sql(sql: str) -> str:
+    text = " ".join(str(sql).split())
+    if len(text) > SQL_TEXT_MAX:
+        text = text[:SQL_TEXT_MAX] + "..."
+    return text
+
+def _caller() -> str:
+    f = sys._getframe(2)
+    while f is not None:
+        mod = f.f_globals.get("__name__", "")
+        if not mod.startswith(_SKIP_MODULES):
+            return f.f_code.co_name
+        f = f.f_back
+    return "?"
+
+def _write_slow_log(rec: dict):
+    if not SLOW_QUERY_LOG:
+        return
+    try:
+        with _lock:
+            with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    except OSError:
+        # Log lambat tidak boleh menjatuhkan request
+        pass
+
+def _new_record(sql: str, elapsed_ms: float) -> dict:
+    rec = {
+        "ts": datetime.utcnow().isoformat(timespec="milliseconds"),
+        "sql": _normalize_sql(sql),
+        "ms": elapsed_ms,
+        "rows": 0,
+        "caller": _caller(),
+        "page": getattr(_local, "page", None),
+    }
+    with _lock:
+        _queries.append(rec)
+    page_stats = getattr(_local, "page_stats", None)
+    if page_stats is not None:
+        page_stats["queries"] += 1
+    return rec
+
+def _close_record(rec: dict):
+    page_stats = getattr(_local, "page_stats", None)
+    if page_stats is not None:
+        page_stats["query_ms"] += rec["ms"]
+    if rec["ms"] >= SLOW_QUERY_MS:
+        _write_slow_log(rec)
+
+def _is_lock_error(msg: str) -> bool:
+    return "locked" in msg or "busy" in msg
+
+def _with_lock_retry(operation: str, fn, *args, can_retry=None):
+    """Jalankan fn, ulangi dengan backoff jika SQLite mengembalikan 'database is locked'.
+
+    can_retry() dipanggil sebelum mengulang; False = error diteruskan apa adanya.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            msg = str(e).lower()
+            if attempt >= DB_LOCK_RETRIES or not _is_lock_error(msg) or (can_retry is not None and not can_retry()):
+                raise
+            attempt += 1
+            metrics.DB_LOCK_RETRIES.inc(operation=operation)
+            time.sleep(DB_LOCK_BACKOFF * (2 ** (attempt - 1)))
+
+class _ParamProgress:
+    """Iterator parameter executemany yang mencatat berapa set parameter sudah dipakai.
+
+    executemany yang gagal di tengah sudah menulis baris-baris sebelumnya, dan generator
+    tidak bisa dibaca ulang: retry hanya aman jika gagal di set pertama. Set pertama
+    disimpan supaya bisa diulang tanpa membaca ulang sumbernya.
+    """
+
+    def __init__(self, params):
+        self._it = iter(params)
+        self._first = None
+        self._replay = False
+        self.used = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._replay:
+            self._replay = False
+            return self._first
+        item = next(self._it)
+        self.used += 1
+        if self.used == 1:
+            self._first = item
+        return item
+
+    def rewind(self) -> bool:
+        if self.used > 1:
+            return False
+        self._replay = self.used == 1
+        return True
+
+# -------------------- Connection / Cursor --------------------
+class TracedCursor(sqlite3.Cursor):
+    """Cursor yang mencatat latency (execute + fetch), jumlah baris, dan pemanggil."""
+    _record = None
+
+    def _finish(self):
+        rec = self._record
+        if rec is not None:
+            self._record = None
+            _close_record(rec)
+
+    def _start(self, sql: str, t0: float):
+        if not TRACE_ENABLED:
+            return
+        rec = _new_record(sql, (time.perf_counter() - t0) * 1000.0)
+        if self.description is None:
+            # Statement tanpa result set (INSERT/UPDATE/DDL): langsung selesai
+            rec["rows"] = max(self.rowcount, 0)
+            _close_record(rec)
+        else:
+            self._record = rec
+
+    def _add_fetch(self, t0: float, n: int, exhausted: bool):
+        rec = self._record
+        if rec is None:
+            return
+        rec["ms"] += (time.perf_counter() - t0) * 1000.0
+        rec["rows"] += n
+        if exhausted:
+            self._finish()
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        t0 = time.perf_counter()
+        try:
+            return _with_lock_retry("execute", super().execute, sql, parameters)
+        finally:
+            self._start(sql, t0)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        t0 = time.perf_counter()
+        try:
+            params = _ParamProgress(seq_of_parameters)
+            return _with_lock_retry("execute", super().executemany, sql, params, can_retry=params.rewind)
+        finally:
+            self._start(sql, t0)
+
+    def executescript(self, sql_script):
+        self._finish()
+        t0 = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._start(sql_script, t0)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._add_fetch(t0, 0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add_fetch(t0, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._add_fetch(t0, len(rows), True)
+        return rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add_fetch(t0, 0, True)
+            raise
+        self._add_fetch(t0, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+class TracedConnection(sqlite3.Connection):
+    """Connection yang selalu membuat TracedCursor, termasuk untuk conn.execute()."""
+
+    def commit(self):
+        return _with_lock_retry("commit", super().commit)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+def connection_factory():
+    """Factory untuk sqlite3.connect().
+
+    Selalu TracedConnection supaya retry saat database terkunci tetap aktif;
+    HRMS_QUERY_TRACE=0 hanya mematikan pencatatan ke ring buffer.
+    """
+    return TracedConnection
+
+# -------------------- Page timing --------------------
+@contextmanager
+def page_timer(page: str):
+    """Ukur durasi satu rerun halaman beserta jumlah dan total waktu query-nya."""
+    prev_page = getattr(_local, "page", None)
+    prev_stats = getattr(_local, "page_stats", None)
+    stats = {"queries": 0, "query_ms": 0.0}
+    _local.page = page
+    _local.page_stats = stats
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        rec = {
+            "ts": datetime.utcnow().isoformat(timespec="milliseconds"),
+            "page": page,
+            "ms": (time.perf_counter() - t0) * 1000.0,
+            "queries": stats["queries"],
+            "query_ms": stats["query_ms"],
+        }
+        with _lock:
+            _pages.append(rec)
+        metrics.RERUN_SECONDS.observe(rec["ms"] / 1000.0, page=page)
+        _local.page = prev_page
+        _local.page_stats = prev_stats
+
+# -------------------- Statistik untuk halaman Diagnostics --------------------
+def query_records() -> list:
+    with _lock:
+        return [dict(r) for r in _queries]
+
+def page_records() -> list:
+    with _lock:
+        return [dict(r) for r in _pages]
+
+def clear():
+    with _lock:
+        _queries.clear()
+        _pages.clear()
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+def _aggregate(records: list, key_fields: tuple) -> list:
+    groups = {}
+    for r in records:
+        groups.setdefault(tuple(r[k] for k in key_fields), []).append(r)
+    out = []
+    for key, items in groups.items():
+        ms = sorted(i["ms"] for i in items)
+        row = dict(zip(key_fields, key))
+        row.update({
+            "count": len(items),
+            "total_ms": round(sum(ms), 2),
+            "avg_ms": round(sum(ms) / len(ms), 2),
+            "p95_ms": round(_percentile(ms, 95), 2),
+            "max_ms": round(ms[-1], 2),
+        })
+        if "rows" in items[0]:
+            row["rows"] = sum(i["rows"] for i in items)
+        if "queries" in items[0]:
+            row["avg_queries"] = round(sum(i["queries"] for i in items) / len(items), 1)
+        out.append(row)
+    out.sort(key=lambda r: r["total_ms"], reverse=True)
+    return out
+
+def top_queries(limit: int = 20) -> list:
+    """Statement dengan total waktu terbesar, dikelompokkan per (sql, caller)."""
+    return _aggregate(query_records(), ("sql", "caller"))[:limit]
+
+def page_summary() -> list:
+    return _aggregate(page_records(), ("page",))
+
+def histogram(values, buckets=LATENCY_BUCKETS_MS) -> list:
+    """Hitung jumlah nilai per bucket latency; hasil berupa list (label, count)."""
+    counts = [0] * (len(buckets) + 1)
+    for v in values:
+        for i, upper in enumerate(buckets):
+            if v < upper:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    # Label diberi nomor urut supaya urutan bucket tetap benar saat di-chart
+    labels = []
+    lower = 0
+    for i, upper in enumerate(buckets):
+        labels.append(f"{i + 1}. {lower}-{upper} ms")
+        lower = upper
+    labels.append(f"{len(buckets) + 1}. >= {buckets[-1]} ms")
+    return list(zip(labels, counts))
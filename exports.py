@@ -0,0 +1,157 @@
+"""Export streaming data request dan saldo kuota untuk payroll close.
+
+Baris dibaca dari cursor per batch (fetchmany) dan langsung ditulis ke
+openpyxl write-only workbook atau csv.writer, sehingga memori tetap datar
+walaupun jumlah baris ratusan ribu.
+"""
+import os
+import csv
+import time
+import uuid
+from datetime import date, datetime
+from typing import Iterator, Optional
+
+import service
+
+EXPORT_DIR = os.environ.get("HRMS_EXPORT_DIR", "exports")
+EXPORT_FETCH_SIZE = int(os.environ.get("HRMS_EXPORT_FETCH_SIZE", 2000))
+EXPORT_TTL_HOURS = float(os.environ.get("HRMS_EXPORT_TTL_HOURS", 24))
+
+REQUEST_COLUMNS = [
+    "id", "type", "status", "employee_email", "employee_name", "division", "manager_name",
+    "start_date", "end_date", "departure_date", "return_date", "days", "hours", "reason",
+    "location", "pic", "job_execution", "created_at", "manager_at", "hr_at",
+]
+BALANCE_COLUMNS = [
+    "user_id", "email", "name", "role", "division", "year",
+    "leave_total", "leave_used", "leave_balance", "changeoff_earned", "changeoff_used", "co_balance",
+]
+
+def _iter_cursor(cur, size: int = EXPORT_FETCH_SIZE):
+    while True:
+        rows = cur.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+def _request_days(row) -> Optional[int]:
+    start = row["start_date"] or row["departure_date"]
+    end = row["end_date"] or row["return_date"]
+    if not start or not end:
+        return None
+    return service.inclusive_days(date.fromisoformat(start), date.fromisoformat(end))
+
+def iter_requests(date_from: Optional[date], date_to: Optional[date], status: Optional[str] = None) -> Iterator[list]:
+    """Baris request (join user, division, manager) untuk periode tertentu."""
+    where, params = service.request_filter_sql(status, date_from, date_to)
+    conn = service.get_conn()
+    try:
+        cur = conn.execute(f"""
+            SELECT r.id, r.type, r.status, u.email AS employee_email, u.name AS employee_name,
+                   u.division, m.name AS manager_name, r.start_date, r.end_date,
+                   r.departure_date, r.return_date, r.hours, r.reason, r.location, r.pic,
+                   r.job_execution, r.created_at, r.manager_at, r.hr_at
+            FROM requests r
+            JOIN users u ON u.id = r.user_id
+            LEFT JOIN users m ON m.id = u.manager_id
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY r.id
+        """, params)
+        for row in _iter_cursor(cur):
+            values = dict(row)
+            values["days"] = _request_days(row)
+            yield [values[c] for c in REQUEST_COLUMNS]
+    finally:
+        conn.close()
+
+def iter_balances(year: int) -> Iterator[list]:
+    """Saldo kuota per user untuk satu tahun; user tanpa baris kuota memakai default."""
+    conn = service.get_conn()
+    try:
+        cur = conn.execute("""
+            SELECT u.id AS user_id, u.email, u.name, u.role, u.division, ? AS year,
+                   COALESCE(q.leave_total, ?) AS leave_total, COALESCE(q.leave_used, 0) AS leave_used,
+                   COALESCE(q.changeoff_earned, 0) AS changeoff_earned, COALESCE(q.changeoff_used, 0) AS changeoff_used
+            FROM users u
+            LEFT JOIN quotas q ON q.user_id = u.id AND q.year = ?
+            ORDER BY u.division, u.name
+        """, (year, service.DEFAULT_LEAVE_TOTAL, year))
+        for row in _iter_cursor(cur):
+            values = dict(row)
+            values["leave_balance"] = values["leave_total"] - values["leave_used"]
+            values["co_balance"] = values["changeoff_earned"] - values["changeoff_used"]
+            yield [values[c] for c in BALANCE_COLUMNS]
+    finally:
+        conn.close()
+
+def _new_path(prefix: str, ext: str) -> str:
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    return os.path.join(EXPORT_DIR, f"{prefix}-{stamp}-{uuid.uuid4().hex[:8]}{ext}")
+
+def write_xlsx(path: str, sheets: list) -> int:
+    """sheets: list (judul, header, iterator baris). Kembalikan total baris data."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    total = 0
+    for title, header, rows in sheets:
+        ws = wb.create_sheet(title=title)
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+            total += 1
+    tmp = f"{path}.tmp"
+    wb.save(tmp)
+    os.replace(tmp, path)
+    return total
+
+def write_csv(path: str, header: list, rows) -> int:
+    total = 0
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            total += 1
+    os.replace(tmp, path)
+    return total
+
+def cleanup_exports(max_age_hours: float = EXPORT_TTL_HOURS):
+    """Hapus file export lama supaya EXPORT_DIR tidak tumbuh terus."""
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age_hours * 3600
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def export_payroll(fmt: str, date_from: Optional[date], date_to: Optional[date], year: int,
+                   status: Optional[str] = None, dataset: str = "all"):
+    """Tulis export ke EXPORT_DIR; kembalikan (path, jumlah baris).
+
+    fmt "xlsx": satu workbook dengan sheet Requests dan/atau Balances.
+    fmt "csv": satu file per dataset, jadi dataset wajib "requests" atau "balances".
+    """
+    cleanup_exports()
+    if fmt == "xlsx":
+        sheets = []
+        if dataset in ("all", "requests"):
+            sheets.append(("Requests", REQUEST_COLUMNS, iter_requests(date_from, date_to, status)))
+        if dataset in ("all", "balances"):
+            sheets.append((f"Balances {year}", BALANCE_COLUMNS, iter_balances(year)))
+        path = _new_path("payroll", ".xlsx")
+        return path, write_xlsx(path, sheets)
+    if fmt == "csv":
+        if dataset == "requests":
+            path = _new_path("requests", ".csv")
+            return path, write_csv(path, REQUEST_COLUMNS, iter_requests(date_from, date_to, status))
+        if dataset == "balances":
+            path = _new_path(f"balances-{year}", ".csv")
+            return path, write_csv(path, BALANCE_COLUMNS, iter_balances(year))
+        raise service.ValidationError("Export CSV hanya untuk satu dataset (requests atau balances).")
+    raise service.ValidationError(f"Format export tidak dikenal: {fmt}")
@@ -0,0 +1,426 @@
+"""Antrian job background yang tahan restart (tabel SQLite `jobs`) + worker pool.
+
+Tombol di UI cukup enqueue() lalu langsung kembali; pekerjaan lanjutan
+(export, generate dokumen, import user, rebuild/rollover kuota, GC lampiran,
+email notifikasi) dikerjakan worker thread dan UI mem-polling status job dari tabel.
+
+Semantik:
+- klaim: dalam BEGIN IMMEDIATE, job QUEUED yang run_after-nya sudah lewat atau
+  job RUNNING yang lease-nya habis (worker mati/proses restart) diambil paling
+  lama dulu; status RUNNING, attempts+1, lease_token baru, lease_until = now + lease.
+- lease: handler memperpanjang lease lewat ctx.progress()/ctx.heartbeat().
+  Hasil hanya disimpan jika lease_token masih sama, jadi worker yang lease-nya
+  sudah diambil alih tidak menimpa hasil worker lain.
+- retry: exception selain ServiceError dicoba lagi dengan backoff eksponensial
+  sampai max_attempts; ServiceError (input/state salah) langsung FAILED.
+- dedupe_key: enqueue dengan key yang sama selagi job lama masih QUEUED
+  digabung ke job itu (mis. beberapa klik Rebuild berturut-turut).
+
+Worker dijalankan sekali per proses: app.py lewat st.cache_resource, atau
+proses terpisah `python jobs.py worker`.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import traceback
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import metrics
+import service
+
+JOB_WORKERS = int(os.environ.get("HRMS_JOB_WORKERS", 2))
+JOB_POLL_SECONDS = float(os.environ.get("HRMS_JOB_POLL_SECONDS", 1.0))
+JOB_LEASE_SECONDS = int(os.environ.get("HRMS_JOB_LEASE_SECONDS", 300))
+JOB_MAX_ATTEMPTS = int(os.environ.get("HRMS_JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get("HRMS_JOB_RETRY_BASE_SECONDS", 30))
+JOB_RETRY_MAX_SECONDS = float(os.environ.get("HRMS_JOB_RETRY_MAX_SECONDS", 3600))
+JOB_KEEP_DAYS = int(os.environ.get("HRMS_JOB_KEEP_DAYS", 30))  # job DONE/FAILED/CANCELLED lebih lama dihapus
+JOB_GC_INTERVAL_HOURS = float(os.environ.get("HRMS_JOB_GC_INTERVAL_HOURS", 24))  # 0 = GC lampiran tidak terjadwal
+# Lampiran yang belum dirujuk request baru dihapus setelah lewat masa ini (upload yang submit-nya gagal, dll.)
+ATTACHMENT_GC_GRACE_HOURS = float(os.environ.get("HRMS_ATTACHMENT_GC_GRACE_HOURS", 72))
+
+_PROGRESS_INTERVAL = 0.5  # detik; update progress lebih sering dari ini tidak ditulis ke database
+
+_wake = threading.Event()
+
+class LeaseLost(Exception):
+    """Lease job sudah diambil alih worker lain (atau job dibatalkan)."""
+
+@dataclass
+class JobType:
+    kind: str
+    fn: Callable[[dict, "JobContext"], Optional[dict]]
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    lease_seconds: int = JOB_LEASE_SECONDS
+
+_HANDLERS: Dict[str, JobType] = {}
+
+def handler(kind: str, max_attempts: int = None, lease_seconds: int = None):
+    """Daftarkan fungsi fn(payload, ctx) -> dict|None sebagai handler satu jenis job."""
+    def register(fn):
+        _HANDLERS[kind] = JobType(kind, fn, max_attempts or JOB_MAX_ATTEMPTS, lease_seconds or JOB_LEASE_SECONDS)
+        return fn
+    return register
+
+def kinds() -> List[str]:
+    return sorted(_HANDLERS)
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+# -------------------- Enqueue & status --------------------
+def enqueue(kind: str, payload: Optional[dict] = None, run_after: Optional[datetime] = None,
+            dedupe_key: Optional[str] = None, created_by: Optional[int] = None) -> int:
+    """Masukkan job ke antrian dan bangunkan worker di proses ini; kembalikan id job."""
+    job_type = _HANDLERS.get(kind)
+    if job_type is None:
+        raise service.ValidationError(f"Jenis job tidak dikenal: {kind}")
+    with service.transaction() as cur:
+        job_id = service._enqueue_job(cur, kind, payload, run_after=run_after, dedupe_key=dedupe_key,
+                                      max_attempts=job_type.max_attempts, created_by=created_by)
+    _wake.set()
+    return job_id
+
+def _row_dict(row) -> dict:
+    job = dict(row)
+    job["payload"] = json.loads(job.pop("payload_json") or "{}")
+    job["result"] = json.loads(job.pop("result_json") or "null")
+    return job
+
+def get_job(job_id: int) -> Optional[dict]:
+    conn = service.get_conn()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id=?", (int(job_id),)).fetchone()
+    finally:
+        conn.close()
+    return _row_dict(row) if row else None
+
+def list_jobs(kind: Optional[str] = None, status: Optional[str] = None, created_by: Optional[int] = None,
+              limit: int = 50) -> List[dict]:
+    where, params = [], []
+    for column, value in (("kind", kind), ("status", status), ("created_by", created_by)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    conn = service.get_conn()
+    try:
+        rows = conn.execute(f"""SELECT * FROM jobs {'WHERE ' + ' AND '.join(where) if where else ''}
+                                ORDER BY id DESC LIMIT ?""", params + [int(limit)]).fetchall()
+    finally:
+        conn.close()
+    return [_row_dict(r) for r in rows]
+
+def status_counts() -> Dict[str, int]:
+    conn = service.get_conn()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    return {r["status"]: r["n"] for r in rows}
+
+def cancel(job_id: int) -> bool:
+    """Batalkan job yang belum diklaim worker."""
+    with service.transaction() as cur:
+        cur.execute("""UPDATE jobs SET status='CANCELLED', finished_at=? WHERE id=? AND status='QUEUED'""",
+                    (_now().isoformat(), int(job_id)))
+        return cur.rowcount > 0
+
+def retry(job_id: int) -> bool:
+    """Antrekan ulang job FAILED/CANCELLED dengan jatah percobaan baru."""
+    with service.transaction() as cur:
+        cur.execute("""UPDATE jobs SET status='QUEUED', attempts=0, run_after=?, finished_at=NULL, error=NULL
+                       WHERE id=? AND status IN ('FAILED', 'CANCELLED')""", (_now().isoformat(), int(job_id)))
+        changed = cur.rowcount > 0
+    if changed:
+        _wake.set()
+    return changed
+
+def prune(keep_days: int = None) -> int:
+    keep_days = JOB_KEEP_DAYS if keep_days is None else keep_days
+    cutoff = (_now() - timedelta(days=keep_days)).isoformat()
+    with service.transaction() as cur:
+        cur.execute("DELETE FROM jobs WHERE status IN ('DONE', 'FAILED', 'CANCELLED') AND finished_at < ?", (cutoff,))
+        return cur.rowcount
+
+def collect_depth():
+    """Collector metrics: jumlah job per status."""
+    counts = status_counts()
+    for status in service.JOB_STATUSES:
+        metrics.JOB_QUEUE_DEPTH.set(counts.get(status, 0), status=status)
+
+# -------------------- Klaim, lease, hasil --------------------
+class JobContext:
+    """Diberikan ke handler: progress/heartbeat memperpanjang lease dan gagal jika lease hilang."""
+
+    def __init__(self, job: dict, token: str, lease_seconds: int):
+        self.job_id = job["id"]
+        self.attempt = job["attempts"]
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self._last_write = 0.0
+
+    def _touch(self, sql: str = "", params: tuple = ()):
+        lease_until = (_now() + timedelta(seconds=self.lease_seconds)).isoformat()
+        with service.transaction() as cur:
+            cur.execute(f"UPDATE jobs SET lease_until=?{sql} WHERE id=? AND lease_token=? AND status='RUNNING'",
+                        (lease_until,) + params + (self.job_id, self.token))
+            if cur.rowcount == 0:
+                raise LeaseLost(f"Lease job #{self.job_id} hilang")
+        self._last_write = time.monotonic()
+
+    def heartbeat(self):
+        self._touch()
+
+    def progress(self, done: int, total: int):
+        if done < total and time.monotonic() - self._last_write < _PROGRESS_INTERVAL:
+            return
+        self._touch(", progress_done=?, progress_total=?", (int(done), int(total)))
+
+def claim(worker: str) -> Optional[tuple]:
+    """Klaim satu job siap jalan untuk handler yang terdaftar; (job, token, JobType) atau None."""
+    if not _HANDLERS:
+        return None
+    now = _now()
+    token = uuid.uuid4().hex
+    marks = ",".join("?" * len(_HANDLERS))
+    with service.transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        # Lease habis setelah percobaan terakhir: tidak diulang lagi
+        cur.execute("""UPDATE jobs SET status='FAILED', lease_token=NULL, finished_at=:now,
+                               error=COALESCE(error || char(10), '') || 'Lease habis (worker berhenti?) pada percobaan ' || attempts
+                        WHERE status='RUNNING' AND lease_until < :now AND attempts >= max_attempts""",
+                    {"now": now.isoformat()})
+        cur.execute(f"""SELECT * FROM jobs
+                        WHERE kind IN ({marks})
+                          AND ((status='QUEUED' AND run_after <= ?) OR (status='RUNNING' AND lease_until < ?))
+                        ORDER BY run_after, id LIMIT 1""", tuple(_HANDLERS) + (now.isoformat(), now.isoformat()))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        job_type = _HANDLERS[row["kind"]]
+        cur.execute("""UPDATE jobs SET status='RUNNING', attempts=attempts+1, lease_token=?, lease_until=?,
+                              worker=?, started_at=?, progress_done=NULL, progress_total=NULL
+                       WHERE id=?""",
+                    (token, (now + timedelta(seconds=job_type.lease_seconds)).isoformat(), worker,
+                     now.isoformat(), row["id"]))
+    job = _row_dict(row)
+    job["attempts"] += 1
+    return job, token, job_type
+
+def _finish(job_id: int, token: str, sql: str, params: tuple) -> bool:
+    with service.transaction() as cur:
+        cur.execute(f"UPDATE jobs SET {sql}, lease_token=NULL, lease_until=NULL WHERE id=? AND lease_token=?",
+                    params + (job_id, token))
+        return cur.rowcount > 0
+
+def _retry_delay(attempt: int) -> float:
+    return min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempt - 1))
+
+def run_one(worker: str = "main") -> bool:
+    """Klaim dan jalankan satu job. False jika tidak ada job siap."""
+    claimed = claim(worker)
+    if claimed is None:
+        return False
+    job, token, job_type = claimed
+    ctx = JobContext(job, token, job_type.lease_seconds)
+    started = time.perf_counter()
+    try:
+        result = job_type.fn(job["payload"], ctx)
+        stored = _finish(job["id"], token, "status='DONE', result_json=?, error=NULL, finished_at=?",
+                         (json.dumps(result, default=str), _now().isoformat()))
+        outcome = "done" if stored else "lease_lost"
+    except LeaseLost:
+        outcome = "lease_lost"
+    except Exception as e:
+        error = str(e) if isinstance(e, service.ServiceError) else f"{type(e).__name__}: {e}"
+        if not isinstance(e, service.ServiceError):
+            traceback.print_exc()
+        if not isinstance(e, service.ServiceError) and job["attempts"] < job["max_attempts"]:
+            run_after = (_now() + timedelta(seconds=_retry_delay(job["attempts"]))).isoformat()
+            _finish(job["id"], token, "status='QUEUED', run_after=?, error=?", (run_after, error))
+            outcome = "retry"
+        else:
+            _finish(job["id"], token, "status='FAILED', error=?, finished_at=?", (error, _now().isoformat()))
+            outcome = "failed"
+    metrics.JOBS.inc(kind=job["kind"], outcome=outcome)
+    metrics.JOB_SECONDS.observe(time.perf_counter() - started, kind=job["kind"])
+    return True
+
+# -------------------- Worker pool --------------------
+class WorkerPool:
+    """Thread worker yang mengklaim job selama proses hidup."""
+
+    def __init__(self, workers: int = None):
+        self.workers = max(1, JOB_WORKERS if workers is None else workers)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> "WorkerPool":
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, args=(f"{os.getpid()}-{i}", i == 0),
+                                 name=f"hrms-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        _wake.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    @property
+    def alive(self) -> int:
+        return sum(t.is_alive() for t in self._threads)
+
+    def _loop(self, name: str, housekeeping: bool):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                ran = run_one(name)
+                if housekeeping and time.monotonic() - last_prune > 3600:
+                    prune()
+                    last_prune = time.monotonic()
+            except Exception:  # database sementara tidak tersedia, dll.: coba lagi di putaran berikut
+                traceback.print_exc()
+                ran = False
+            if not ran:
+                _wake.wait(JOB_POLL_SECONDS)
+                _wake.clear()
+
+def schedule_periodic():
+    """Pastikan job berkala (GC lampiran, sisa outbox notifikasi) ada di antrian; aman dipanggil setiap start."""
+    if JOB_GC_INTERVAL_HOURS > 0:
+        enqueue("attachments.gc", dedupe_key="attachments.gc")
+    import notifications
+    if notifications.has_backlog():
+        # Outbox tertinggal (flush gagal total / proses mati saat mengirim)
+        enqueue(notifications.FLUSH_KIND, dedupe_key=notifications.FLUSH_KIND)
+
+def start_workers(workers: int = None) -> WorkerPool:
+    schedule_periodic()
+    return WorkerPool(workers).start()
+
+# -------------------- Handler bawaan --------------------
+def _date(value) -> Optional[date]:
+    return date.fromisoformat(value) if value else None
+
+@handler("usage_summary.rebuild")
+def _rebuild_usage_summary(payload: dict, ctx: JobContext) -> dict:
+    return {"rows": service.rebuild_usage_summary()}
+
+def _rollover_result(report) -> dict:
+    return {"applied": report.applied, "counts": report.counts(), "csv": report.write_csv() if report.rows else None}
+
+@handler("quota.rollover")
+def _quota_rollover(payload: dict, ctx: JobContext) -> dict:
+    import rollover
+    return _rollover_result(rollover.rollover(int(payload["to_year"]), dry_run=False))
+
+@handler("quota.expire_carry")
+def _quota_expire_carry(payload: dict, ctx: JobContext) -> dict:
+    import rollover
+    return _rollover_result(rollover.expire_carry_over(dry_run=False))
+
+@handler("export.payroll", lease_seconds=900)
+def _export_payroll(payload: dict, ctx: JobContext) -> dict:
+    import exports
+    path, total = exports.export_payroll(payload["fmt"], _date(payload.get("date_from")), _date(payload.get("date_to")),
+                                         int(payload["year"]), payload.get("status"), payload.get("dataset", "all"))
+    return {"path": path, "rows": total}
+
+@handler("letters.generate", lease_seconds=900)
+def _letters_generate(payload: dict, ctx: JobContext) -> dict:
+    import letters
+    rows = letters.fetch_approved(_date(payload.get("date_from")), _date(payload.get("date_to")))
+    if not rows:
+        return {"letters": 0, "path": None}
+    paths = letters.generate_letters(rows, progress=ctx.progress)
+    return {"letters": len(paths), "path": letters.build_zip(rows, paths)}
+
+@handler("letters.prewarm")
+def _letters_prewarm(payload: dict, ctx: JobContext) -> dict:
+    """Render surat untuk request yang baru APPROVED supaya generate batch tinggal memakai cache."""
+    import letters
+    rows = letters.fetch_approved(None, None, request_ids=payload["request_ids"])
+    letters.generate_letters(rows, workers=1)
+    return {"letters": len(rows)}
+
+@handler("report.deck", lease_seconds=900)
+def _report_deck(payload: dict, ctx: JobContext) -> dict:
+    import reports
+    return {"path": reports.build_deck(int(payload["year"]), int(payload["month"]), payload["path"])}
+
+@handler("attachments.gc")
+def _attachments_gc(payload: dict, ctx: JobContext) -> dict:
+    import exports
+    import letters
+    import preview
+    import thumbnails
+    grace = float(payload.get("grace_hours", ATTACHMENT_GC_GRACE_HOURS))
+    removed = service.remove_orphan_uploads(grace)
+    ctx.heartbeat()
+    keep = {preview.file_sha256(p) for p in service.upload_files()}
+    result = {"uploads_removed": len(removed), "previews_removed": preview.prune_cache(keep),
+              "thumbnails_removed": thumbnails.prune_cache(keep)}
+    exports.cleanup_exports()
+    letters.cleanup_zips()
+    if JOB_GC_INTERVAL_HOURS > 0:
+        enqueue("attachments.gc", run_after=_now() + timedelta(hours=JOB_GC_INTERVAL_HOURS),
+                dedupe_key="attachments.gc")
+    return result
+
+@handler("users.import", max_attempts=1, lease_seconds=900)
+def _users_import(payload: dict, ctx: JobContext) -> dict:
+    # Satu percobaan: file staging dihapus setelah dijalankan, import bisa diulang dari UI
+    import user_import
+    report = user_import.import_staged(payload["path"], payload["filename"], int(payload["year"]),
+                                       progress=ctx.progress)
+    return report.as_result()
+
+@handler("notifications.flush", max_attempts=5)
+def _notifications_flush(payload: dict, ctx: JobContext) -> dict:
+    import notifications
+    return notifications.flush(ctx)
+
+# -------------------- CLI --------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRMS background jobs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_worker = sub.add_parser("worker", help="Jalankan worker di foreground")
+    p_worker.add_argument("--workers", type=int, default=JOB_WORKERS)
+    p_list = sub.add_parser("list", help="Job terbaru")
+    p_list.add_argument("--status", choices=service.JOB_STATUSES)
+    p_list.add_argument("--limit", type=int, default=30)
+    p_enq = sub.add_parser("enqueue", help="Masukkan job ke antrian")
+    p_enq.add_argument("kind", choices=kinds())
+    p_enq.add_argument("--payload", default="{}", help="JSON")
+    p_retry = sub.add_parser("retry", help="Antrekan ulang job FAILED/CANCELLED")
+    p_retry.add_argument("job_id", type=int)
+    args = parser.parse_args(argv)
+    service.init_db()
+    if args.command == "worker":
+        pool = start_workers(args.workers)
+        print(f"{pool.workers} worker berjalan (Ctrl+C untuk berhenti)", file=sys.stderr)
+        try:
+            while pool.alive:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pool.stop()
+    elif args.command == "list":
+        for j in list_jobs(status=args.status, limit=args.limit):
+            print(f"#{j['id']:<6}{j['kind']:<24}{j['status']:<10}{j['attempts']}/{j['max_attempts']}  "
+                  f"{j['created_at']}  {j['error'] or ''}")
+    elif args.command == "enqueue":
+        print(enqueue(args.kind, json.loads(args.payload)))
+    else:
+        print("ok" if retry(args.job_id) else "job tidak bisa diulang")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Generate surat persetujuan (DOCX) untuk request APPROVED secara batch.
+
+Render dilakukan paralel di process pool (python-docx murni CPU), hasilnya
+di-cache per (request id, updated_at) sehingga generate ulang hanya
+merender surat yang berubah, lalu dibundel ke ZIP yang ditulis bertahap ke disk.
+"""
+import os
+import time
+import hashlib
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from typing import Callable, List, Optional
+
+import service
+
+LETTER_DIR = os.environ.get("HRMS_LETTER_DIR", "letters")
+LETTER_CACHE_DIR = os.path.join(LETTER_DIR, "cache")
+LETTER_TEMPLATE = os.environ.get("HRMS_LETTER_TEMPLATE", "")  # .docx opsional (kop surat, placeholder)
+LETTER_WORKERS = int(os.environ.get("HRMS_LETTER_WORKERS", min(4, os.cpu_count() or 1)))
+LETTER_ZIP_TTL_HOURS = float(os.environ.get("HRMS_LETTER_ZIP_TTL_HOURS", 24))
+
+DAY_NAMES_ID = ["Senin", "Selasa", "Rabu", "Kamis", "Jumat", "Sabtu", "Minggu"]
+
+def fetch_approved(date_from: Optional[date], date_to: Optional[date],
+                   request_ids: Optional[List[int]] = None) -> List[dict]:
+    """Request APPROVED pada periode tertentu (opsional: hanya id tertentu) beserta data karyawan dan approver."""
+    where, params = service.request_filter_sql("APPROVED", date_from, date_to)
+    if request_ids is not None:
+        where.append(f"r.id IN ({','.join('?' * len(request_ids)) or 'NULL'})")
+        params += [int(i) for i in request_ids]
+    conn = service.get_conn()
+    try:
+        rows = conn.execute(f"""
+            SELECT r.*, u.name AS employee_name, u.email AS employee_email, u.division AS employee_division,
+                   mb.name AS manager_name, hb.name AS hr_name
+            FROM requests r
+            JOIN users u ON u.id = r.user_id
+            LEFT JOIN users mb ON mb.id = r.manager_by
+            LEFT JOIN users hb ON hb.id = r.hr_by
+            WHERE {' AND '.join(where)}
+            ORDER BY r.id
+        """, params).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+def cache_path(row: dict) -> str:
+    version = hashlib.sha1(str(row.get("updated_at") or "").encode()).hexdigest()[:12]
+    return os.path.join(LETTER_CACHE_DIR, f"{int(row['id'])}-{version}.docx")
+
+def letter_number(row: dict) -> str:
+    year = (row.get("hr_at") or row.get("created_at") or "")[:4] or str(date.today().year)
+    kind = "CUTI" if row["type"] == "LEAVE" else "CO"
+    return f"HRMS/{kind}/{year}/{int(row['id']):05d}"
+
+def _fmt_date(value: Optional[str]) -> str:
+    if not value:
+        return "-"
+    try:
+        d = date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return str(value)
+    return f"{DAY_NAMES_ID[d.weekday()]}, {d.strftime('%d-%m-%Y')}"
+
+def _replace_placeholders(doc, values: dict):
+    for p in doc.paragraphs:
+        if "{" not in p.text:
+            continue
+        text = p.text
+        for key, val in values.items():
+            text = text.replace("{" + key + "}", str(val))
+        if text != p.text:
+            for run in p.runs[1:]:
+                run.text = ""
+            if p.runs:
+                p.runs[0].text = text
+
+def _add_table(doc, header: list, rows: list):
+    table = doc.add_table(rows=1, cols=len(header))
+    table.style = "Table Grid"
+    for cell, text in zip(table.rows[0].cells, header):
+        cell.text = str(text)
+    for row in rows:
+        cells = table.add_row().cells
+        for cell, text in zip(cells, row):
+            cell.text = "" if text is None else str(text)
+    return table
+
+def render_letter(row: dict, out_path: str, template_path: str = "") -> str:
+    """Render satu surat ke out_path. Dipanggil di worker process, jadi harus top-level."""
+    from docx import Document
+
+    doc = Document(template_path) if template_path else Document()
+    number = letter_number(row)
+    _replace_placeholders(doc, {
+        "nomor": number,
+        "nama": row.get("employee_name") or "-",
+        "email": row.get("employee_email") or "-",
+        "divisi": row.get("employee_division") or "-",
+        "tanggal": _fmt_date(date.today().isoformat()),
+    })
+    is_leave = row["type"] == "LEAVE"
+    doc.add_heading("SURAT PERSETUJUAN " + ("CUTI" if is_leave else "CHANGE OFF"), level=1)
+    doc.add_paragraph(f"Nomor: {number}")
+    doc.add_paragraph(
+        f"Dengan ini menyatakan bahwa pengajuan {'cuti' if is_leave else 'change off'} atas nama "
+        f"{row.get('employee_name')} ({row.get('employee_email')}), Divisi {row.get('employee_division') or '-'}, "
+        f"telah disetujui oleh Manager dan HR dengan rincian sebagai berikut:"
+    )
+    if is_leave:
+        details = [
+            ("Tanggal Mulai", _fmt_date(row.get("start_date"))),
+            ("Tanggal Akhir", _fmt_date(row.get("end_date"))),
+            ("Alasan", row.get("reason") or "-"),
+        ]
+    else:
+        details = [
+            ("Tanggal Keberangkatan", _fmt_date(row.get("departure_date"))),
+            ("Tanggal Kepulangan", _fmt_date(row.get("return_date"))),
+            ("Lokasi", row.get("location") or "-"),
+            ("PIC", row.get("pic") or "-"),
+            ("Job Eksekusi", row.get("job_execution") or "-"),
+            ("Total Jam", row.get("hours") or 0),
+        ]
+    details += [
+        ("Disetujui Manager", f"{row.get('manager_name') or '-'} ({row.get('manager_at') or '-'})"),
+        ("Disetujui HR", f"{row.get('hr_name') or '-'} ({row.get('hr_at') or '-'})"),
+    ]
+    _add_table(doc, ["Keterangan", "Detail"], details)
+
+    activities = service._load_activities(row.get("activities_json"))
+    if activities:
+        doc.add_heading("Detail Aktivitas per Hari", level=2)
+        _add_table(doc, ["Hari", "Tanggal", "Mulai", "Selesai", "Aktivitas"], [
+            (a.get("hari", i + 1), _fmt_date(a.get("tanggal")), a.get("waktu_mulai"),
+             a.get("waktu_selesai"), a.get("aktivitas"))
+            for i, a in enumerate(activities)
+        ])
+    doc.add_paragraph("")
+    doc.add_paragraph(f"Dokumen ini dibuat otomatis oleh HRMS pada {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC.")
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp = f"{out_path}.{os.getpid()}.tmp"
+    doc.save(tmp)
+    os.replace(tmp, out_path)
+    return out_path
+
+def _drop_stale_versions(keep: dict):
+    """Hapus versi lama surat untuk request di keep ({request id: path versi sekarang}); satu listdir per batch."""
+    with os.scandir(LETTER_CACHE_DIR) as entries:
+        for entry in entries:
+            request_id, sep, _ = entry.name.partition("-")
+            if not sep or not entry.name.endswith(".docx") or not request_id.isdigit():
+                continue
+            current = keep.get(int(request_id))
+            if current is not None and entry.path != current:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+def generate_letters(rows: List[dict], progress: Optional[Callable[[int, int], None]] = None,
+                     workers: int = LETTER_WORKERS) -> List[str]:
+    """Render surat yang belum ada di cache; kembalikan path untuk semua row (urut sama)."""
+    os.makedirs(LETTER_CACHE_DIR, exist_ok=True)
+    paths = [cache_path(r) for r in rows]
+    todo = [(r, p) for r, p in zip(rows, paths) if not os.path.exists(p)]
+    total, done = len(rows), len(rows) - len(todo)
+    if progress:
+        progress(done, total)
+    if todo and workers > 1 and len(todo) > 1:
+        try:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(workers, len(todo)), mp_context=ctx) as pool:
+                futures = {pool.submit(render_letter, r, p, LETTER_TEMPLATE): r for r, p in todo}
+                for fut in as_completed(futures):
+                    fut.result()
+                    done += 1
+                    if progress:
+                        progress(done, total)
+            todo = []
+        except (OSError, BrokenProcessPool):
+            # Lingkungan tanpa dukungan multiprocessing: lanjut render di proses ini
+            todo = [(r, p) for r, p in todo if not os.path.exists(p)]
+    for r, p in todo:
+        render_letter(r, p, LETTER_TEMPLATE)
+        done += 1
+        if progress:
+            progress(done, total)
+    _drop_stale_versions({int(r["id"]): p for r, p in zip(rows, paths)})
+    return paths
+
+def cleanup_zips(max_age_hours: float = LETTER_ZIP_TTL_HOURS):
+    """Hapus bundel ZIP lama; cache DOCX tetap dipakai ulang."""
+    if not os.path.isdir(LETTER_DIR):
+        return
+    cutoff = time.time() - max_age_hours * 3600
+    for name in os.listdir(LETTER_DIR):
+        path = os.path.join(LETTER_DIR, name)
+        try:
+            if name.endswith(".zip") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def build_zip(rows: List[dict], paths: List[str], zip_path: Optional[str] = None) -> str:
+    """Bundel surat ke ZIP; file ditulis satu per satu (streaming ke disk)."""
+    cleanup_zips()
+    os.makedirs(LETTER_DIR, exist_ok=True)
+    zip_path = zip_path or os.path.join(LETTER_DIR, f"letters-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.zip")
+    tmp = f"{zip_path}.tmp"
+    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for row, path in zip(rows, paths):
+            safe_name = "".join(c if c.isalnum() else "_" for c in (row.get("employee_name") or "karyawan"))
+            zf.write(path, arcname=f"{int(row['id']):05d}-{row['type']}-{safe_name}.docx")
+    os.replace(tmp, zip_path)
+    return zip_path
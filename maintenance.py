@@ -0,0 +1,394 @@
+"""Maintenance rutin database HRMS: statistik planner, incremental vacuum, checkpoint, quick_check.
+
+Setelah delete_quota/delete_user, arsip, dan perubahan status request, halaman
+kosong menumpuk di freelist dan file hrms.db tidak pernah menyusut; tanpa
+sqlite_stat1 planner juga menebak selektivitas index. Satu run menjalankan:
+
+1. cek mode auto_vacuum (database baru sudah INCREMENTAL dari service.init_schema);
+2. PRAGMA incremental_vacuum per HRMS_MAINT_VACUUM_PAGES halaman sampai
+   freelist kosong atau waktu habis;
+3. wal_checkpoint(TRUNCATE) (service.init_schema mengaktifkan WAL);
+4. ANALYZE jika ada index tanpa statistik atau ANALYZE terakhir lebih lama
+   dari HRMS_MAINT_ANALYZE_DAYS, selain itu PRAGMA optimize (keduanya
+   dibatasi PRAGMA analysis_limit);
+5. PRAGMA quick_check.
+
+Database lama (auto_vacuum=NONE) butuh VACUUM penuh sekali untuk pindah ke
+INCREMENTAL. Itu bukan bagian dari run berbatas waktu (VACUUM yang terpotong
+batas waktu akan diulang dan gagal terus): jalankan terpisah lewat
+migrate_auto_vacuum() / "python maintenance.py migrate-auto-vacuum" saat
+aplikasi sepi. Sampai itu dilakukan, langkah incremental_vacuum dilewati.
+
+Seluruh run dibatasi HRMS_MAINT_TIME_BUDGET detik lewat progress handler
+SQLite: langkah yang melewati batas dibatalkan (di-rollback oleh SQLite) dan
+dicatat "timeout", langkah berikutnya dilewati. Hasilnya disimpan di tabel
+maintenance_runs (fragmentasi, kesehatan statistik planner, detail per langkah).
+
+Scheduler (start_scheduler) berjalan di thread daemon, sekali per proses, dan
+hanya menjalankan maintenance di dalam HRMS_MAINT_WINDOW (jam sepi, waktu
+lokal, mis. "01:00-05:00"; boleh melewati tengah malam) jika run sukses
+terakhir lebih lama dari HRMS_MAINT_INTERVAL_HOURS (0 = mati).
+
+    python maintenance.py run [--budget 60]
+    python maintenance.py migrate-auto-vacuum
+    python maintenance.py history [--limit 30]
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import traceback
+from dataclasses import dataclass, field
+from datetime import datetime, time as dtime
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+import metrics
+import service
+
+MAINT_WINDOW = os.environ.get("HRMS_MAINT_WINDOW", "01:00-05:00").strip()  # kosong = kapan saja
+MAINT_INTERVAL_HOURS = float(os.environ.get("HRMS_MAINT_INTERVAL_HOURS", 24))  # 0 = scheduler mati
+MAINT_TIME_BUDGET = float(os.environ.get("HRMS_MAINT_TIME_BUDGET", 60))  # detik per run
+MAINT_VACUUM_PAGES = int(os.environ.get("HRMS_MAINT_VACUUM_PAGES", 500))  # halaman per langkah incremental_vacuum
+MAINT_ANALYSIS_LIMIT = int(os.environ.get("HRMS_MAINT_ANALYSIS_LIMIT", 1000))  # baris sampel per index (0 = penuh)
+MAINT_ANALYZE_DAYS = float(os.environ.get("HRMS_MAINT_ANALYZE_DAYS", 7))  # ANALYZE penuh minimal sekali per periode ini
+MAINT_KEEP_RUNS = int(os.environ.get("HRMS_MAINT_KEEP_RUNS", 365))
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+_PROGRESS_OPS = 10000  # instruksi VM antar pengecekan batas waktu
+
+_run_lock = threading.Lock()  # satu run maintenance pada satu waktu per proses
+_scheduler_lock = threading.Lock()
+_scheduler_started = False
+_last_error: Optional[str] = None
+
+class TimeBudgetExceeded(Exception):
+    pass
+
+@dataclass
+class MaintenanceReport:
+    started_at: str
+    trigger: str
+    outcome: str = "ok"
+    duration_ms: int = 0
+    page_size: int = 0
+    page_count: int = 0
+    freelist_before: int = 0
+    freelist_after: int = 0
+    auto_vacuum: str = ""
+    journal_mode: str = ""
+    wal_frames: Optional[int] = None
+    analyzed: bool = False
+    stat_indexes: int = 0
+    unanalyzed_indexes: int = 0
+    quick_check: Optional[str] = None
+    steps: List[dict] = field(default_factory=list)
+
+    @property
+    def fragmentation(self) -> float:
+        return self.freelist_after / self.page_count if self.page_count else 0.0
+
+# -------------------- Window --------------------
+def parse_window(value: str) -> Optional[Tuple[dtime, dtime]]:
+    """"HH:MM-HH:MM" -> (mulai, selesai); string kosong = tanpa batas jam."""
+    if not value:
+        return None
+    try:
+        start, end = (dtime.fromisoformat(part.strip()) for part in value.split("-", 1))
+    except ValueError as e:
+        raise service.ValidationError(f"HRMS_MAINT_WINDOW tidak valid: {value!r} (format HH:MM-HH:MM)") from e
+    return start, end
+
+def in_window(now: Optional[datetime] = None, window: Optional[str] = None) -> bool:
+    bounds = parse_window(MAINT_WINDOW if window is None else window)
+    if bounds is None:
+        return True
+    start, end = bounds
+    t = (now or datetime.now()).time()
+    if start <= end:
+        return start <= t < end
+    return t >= start or t < end  # melewati tengah malam
+
+def last_error() -> Optional[str]:
+    return _last_error
+
+# -------------------- Statistik --------------------
+def _pragma(conn: sqlite3.Connection, name: str):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+def planner_stats(conn: sqlite3.Connection) -> Tuple[int, int]:
+    """(index dengan statistik di sqlite_stat1, index tanpa statistik pada tabel yang berisi data).
+
+    ANALYZE tidak menulis statistik untuk tabel kosong, jadi index di tabel kosong tidak dihitung.
+    """
+    has_stat1 = conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()
+    known = {r[0] for r in conn.execute("SELECT DISTINCT idx FROM sqlite_stat1 WHERE idx IS NOT NULL")} if has_stat1 else set()
+    indexes = conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type='index' AND tbl_name NOT LIKE 'sqlite_%'").fetchall()
+    missing_tables = {tbl for name, tbl in indexes if name not in known}
+    non_empty = {tbl for tbl in missing_tables
+                 if conn.execute(f'SELECT EXISTS(SELECT 1 FROM "{tbl}")').fetchone()[0]}
+    with_stats = sum(1 for name, _ in indexes if name in known)
+    return with_stats, sum(1 for name, tbl in indexes if name not in known and tbl in non_empty)
+
+# -------------------- Run --------------------
+def _step(report: MaintenanceReport, conn: sqlite3.Connection, deadline: float, name: str, fn):
+    """Jalankan satu langkah dengan batas waktu bersama; catat status dan durasinya."""
+    if report.outcome == "timeout":
+        report.steps.append({"step": name, "status": "skipped", "ms": 0, "detail": "waktu habis"})
+        return
+    t0 = time.perf_counter()
+    entry = {"step": name, "status": "ok", "ms": 0, "detail": ""}
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, _PROGRESS_OPS)
+    try:
+        if time.monotonic() > deadline:
+            raise TimeBudgetExceeded()
+        entry["detail"] = fn() or ""
+    except TimeBudgetExceeded:
+        entry["status"], report.outcome = "timeout", "timeout"
+    except sqlite3.OperationalError as e:
+        if "interrupt" in str(e).lower():
+            entry["status"], report.outcome = "timeout", "timeout"
+        else:
+            entry["status"], entry["detail"], report.outcome = "error", str(e), "error"
+    finally:
+        conn.set_progress_handler(None, 0)
+        if conn.in_transaction:
+            conn.rollback()
+    entry["ms"] = round((time.perf_counter() - t0) * 1000)
+    report.steps.append(entry)
+
+def _auto_vacuum_status(conn: sqlite3.Connection) -> str:
+    if _pragma(conn, "auto_vacuum") == 2:
+        return "incremental"
+    if service.is_memory_db():
+        return "dilewati (database in-memory)"
+    return "perlu migrasi: python maintenance.py migrate-auto-vacuum (VACUUM penuh)"
+
+def needs_auto_vacuum_migration() -> bool:
+    conn = service.get_conn()
+    try:
+        return _pragma(conn, "auto_vacuum") != 2 and not service.is_memory_db()
+    finally:
+        conn.close()
+
+def migrate_auto_vacuum() -> str:
+    """Ubah database lama ke auto_vacuum=INCREMENTAL dengan VACUUM penuh, tanpa batas waktu.
+
+    VACUUM menulis ulang seluruh file dan mengunci database selama berjalan: jalankan saat sepi.
+    """
+    if not _run_lock.acquire(blocking=False):
+        raise service.InvalidState("Maintenance sedang berjalan.")
+    try:
+        conn = service.get_conn()
+        try:
+            if _pragma(conn, "auto_vacuum") == 2:
+                return "sudah incremental"
+            if service.is_memory_db():
+                return "dilewati (database in-memory)"
+            t0 = time.perf_counter()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")  # mode auto_vacuum baru berlaku setelah VACUUM penuh
+            mode = AUTO_VACUUM_MODES.get(_pragma(conn, "auto_vacuum"), "?")
+            return f"VACUUM penuh {round((time.perf_counter() - t0) * 1000)} ms, auto_vacuum={mode}"
+        finally:
+            conn.close()
+    finally:
+        _run_lock.release()
+
+def _incremental_vacuum(conn: sqlite3.Connection, deadline: float) -> str:
+    if _pragma(conn, "auto_vacuum") != 2:
+        return "dilewati (auto_vacuum bukan incremental)"
+    freed = 0
+    while time.monotonic() < deadline:
+        before = _pragma(conn, "freelist_count")
+        if not before:
+            break
+        # executescript men-step pragma sampai selesai; execute() berhenti setelah satu halaman
+        conn.executescript(f"PRAGMA incremental_vacuum({max(1, MAINT_VACUUM_PAGES)})")
+        after = _pragma(conn, "freelist_count")
+        freed += before - after
+        if after >= before:
+            break
+    if _pragma(conn, "freelist_count") and time.monotonic() >= deadline:
+        raise TimeBudgetExceeded()
+    return f"{freed} halaman dibebaskan"
+
+def _checkpoint(conn: sqlite3.Connection, report: MaintenanceReport) -> str:
+    if report.journal_mode != "wal":
+        return f"dilewati (journal_mode={report.journal_mode})"
+    busy, frames, done = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    report.wal_frames = frames
+    return f"busy={busy} frames={frames} checkpointed={done}"
+
+def _analyze_due(conn: sqlite3.Connection) -> Optional[str]:
+    """Alasan ANALYZE penuh perlu dijalankan, atau None jika PRAGMA optimize cukup."""
+    _, missing = planner_stats(conn)
+    if missing:
+        return f"{missing} index tanpa statistik"
+    row = conn.execute("SELECT MAX(started_at) FROM maintenance_runs WHERE analyzed=1").fetchone()
+    if not row[0]:
+        return "belum pernah ANALYZE"
+    age = datetime.now() - datetime.fromisoformat(row[0])
+    if age.total_seconds() >= MAINT_ANALYZE_DAYS * 86400:
+        return f"statistik berumur {age.days} hari"
+    return None
+
+def _analyze(conn: sqlite3.Connection, report: MaintenanceReport) -> str:
+    conn.execute(f"PRAGMA analysis_limit={max(0, MAINT_ANALYSIS_LIMIT)}")
+    reason = _analyze_due(conn)
+    if reason:
+        conn.execute("ANALYZE")
+        report.analyzed = True
+        return f"ANALYZE ({reason})"
+    # optimize hanya menganalisis ulang tabel yang ukurannya berubah jauh sejak statistik terakhir
+    conn.executescript("PRAGMA optimize")
+    return "PRAGMA optimize"
+
+def _quick_check(conn: sqlite3.Connection, report: MaintenanceReport) -> str:
+    rows = [r[0] for r in conn.execute("PRAGMA quick_check")]
+    report.quick_check = "ok" if rows == ["ok"] else "; ".join(rows[:20])
+    if report.quick_check != "ok":
+        report.outcome = "error"
+    return report.quick_check
+
+def _record(conn: sqlite3.Connection, report: MaintenanceReport):
+    conn.execute("""
+        INSERT INTO maintenance_runs(started_at, finished_at, trigger, outcome, duration_ms, page_size, page_count,
+            freelist_before, freelist_after, auto_vacuum, journal_mode, wal_frames, analyzed, stat_indexes,
+            unanalyzed_indexes, quick_check, steps_json)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """, (report.started_at, datetime.now().isoformat(timespec="seconds"), report.trigger, report.outcome,
+          report.duration_ms, report.page_size, report.page_count, report.freelist_before, report.freelist_after,
+          report.auto_vacuum, report.journal_mode, report.wal_frames, int(report.analyzed), report.stat_indexes,
+          report.unanalyzed_indexes, report.quick_check, json.dumps(report.steps, ensure_ascii=False)))
+    conn.execute("DELETE FROM maintenance_runs WHERE id <= (SELECT MAX(id) FROM maintenance_runs) - ?",
+                 (max(1, MAINT_KEEP_RUNS),))
+    conn.commit()
+
+def run_maintenance(budget_seconds: Optional[float] = None, trigger: str = "manual") -> MaintenanceReport:
+    """Satu run maintenance dengan batas waktu budget_seconds (default HRMS_MAINT_TIME_BUDGET)."""
+    global _last_error
+    budget = MAINT_TIME_BUDGET if budget_seconds is None else float(budget_seconds)
+    if budget <= 0:
+        raise service.ValidationError("Batas waktu maintenance harus lebih dari 0 detik.")
+    if not _run_lock.acquire(blocking=False):
+        raise service.InvalidState("Maintenance sedang berjalan.")
+    try:
+        started = time.perf_counter()
+        deadline = time.monotonic() + budget
+        report = MaintenanceReport(datetime.now().isoformat(timespec="seconds"), trigger)
+        conn = service.get_conn()
+        try:
+            report.page_size = _pragma(conn, "page_size")
+            report.freelist_before = _pragma(conn, "freelist_count")
+            report.auto_vacuum = AUTO_VACUUM_MODES.get(_pragma(conn, "auto_vacuum"), "?")
+            report.journal_mode = str(_pragma(conn, "journal_mode")).lower()
+            _step(report, conn, deadline, "auto_vacuum", lambda: _auto_vacuum_status(conn))
+            _step(report, conn, deadline, "incremental_vacuum", lambda: _incremental_vacuum(conn, deadline))
+            _step(report, conn, deadline, "wal_checkpoint", lambda: _checkpoint(conn, report))
+            _step(report, conn, deadline, "analyze", lambda: _analyze(conn, report))
+            _step(report, conn, deadline, "quick_check", lambda: _quick_check(conn, report))
+            report.page_count = _pragma(conn, "page_count")
+            report.freelist_after = _pragma(conn, "freelist_count")
+            report.stat_indexes, report.unanalyzed_indexes = planner_stats(conn)
+            report.duration_ms = round((time.perf_counter() - started) * 1000)
+            _record(conn, report)
+        except Exception as e:
+            _last_error = f"{type(e).__name__}: {e}"
+            metrics.MAINTENANCE_RUNS.inc(outcome="error")
+            raise
+        finally:
+            conn.close()
+        errors = [f"{s['step']}: {s['detail']}" for s in report.steps if s["status"] == "error"]
+        if report.quick_check not in (None, "ok"):
+            errors.append(f"quick_check: {report.quick_check}")
+        _last_error = "; ".join(errors) or None
+        metrics.MAINTENANCE_RUNS.inc(outcome=report.outcome)
+        metrics.MAINTENANCE_SECONDS.observe(report.duration_ms / 1000)
+        metrics.DB_FREELIST_RATIO.set(report.fragmentation)
+        return report
+    finally:
+        _run_lock.release()
+
+def history(limit: int = 30) -> pd.DataFrame:
+    """Riwayat run maintenance terbaru dulu, dengan kolom fragmentation (freelist_after/page_count)."""
+    conn = service.get_conn()
+    try:
+        df = pd.read_sql_query("""
+            SELECT *, CAST(freelist_after AS REAL) / NULLIF(page_count, 0) AS fragmentation,
+                   page_count * page_size AS db_bytes
+            FROM maintenance_runs ORDER BY id DESC LIMIT ?
+        """, conn, params=(int(limit),))
+    finally:
+        conn.close()
+    return df
+
+# -------------------- Scheduler --------------------
+def _last_ok_run() -> Optional[datetime]:
+    conn = service.get_conn()
+    try:
+        row = conn.execute("SELECT MAX(started_at) FROM maintenance_runs WHERE outcome='ok'").fetchone()
+    finally:
+        conn.close()
+    return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+def is_due(now: Optional[datetime] = None) -> bool:
+    now = now or datetime.now()
+    if not in_window(now):
+        return False
+    last = _last_ok_run()
+    return last is None or (now - last).total_seconds() >= MAINT_INTERVAL_HOURS * 3600
+
+def _scheduler_loop():
+    while True:
+        try:
+            if is_due():
+                run_maintenance(trigger="schedule")
+        except Exception:
+            traceback.print_exc()
+        time.sleep(600)  # cek ulang tiap 10 menit; run yang timeout dilanjutkan di jendela yang sama
+
+def start_scheduler() -> bool:
+    """Jalankan maintenance terjadwal sekali per proses. Aman dipanggil di setiap rerun."""
+    global _scheduler_started
+    if MAINT_INTERVAL_HOURS <= 0:
+        return False
+    parse_window(MAINT_WINDOW)  # konfigurasi salah langsung terlihat saat start
+    with _scheduler_lock:
+        if _scheduler_started:
+            return False
+        _scheduler_started = True
+    threading.Thread(target=_scheduler_loop, name="hrms-maintenance", daemon=True).start()
+    return True
+
+# -------------------- CLI --------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRMS database maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="Jalankan maintenance sekarang (abaikan jendela waktu)")
+    p_run.add_argument("--budget", type=float, default=MAINT_TIME_BUDGET, help="Batas waktu (detik)")
+    sub.add_parser("migrate-auto-vacuum", help="Ubah database lama ke auto_vacuum=INCREMENTAL (VACUUM penuh, tanpa batas waktu)")
+    p_hist = sub.add_parser("history", help="Riwayat run maintenance")
+    p_hist.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args(argv)
+    service.init_db()
+    if args.command == "run":
+        r = run_maintenance(args.budget, trigger="cli")
+        for s in r.steps:
+            print(f"{s['step']:<20}{s['status']:<9}{s['ms']:>7} ms  {s['detail']}", file=sys.stderr)
+        print(f"outcome={r.outcome} pages={r.page_count} freelist={r.freelist_before}->{r.freelist_after} "
+              f"fragmentation={r.fragmentation:.1%} unanalyzed_indexes={r.unanalyzed_indexes} "
+              f"durasi={r.duration_ms} ms", file=sys.stderr)
+        sys.exit(0 if r.outcome == "ok" else 1)
+    elif args.command == "migrate-auto-vacuum":
+        print(migrate_auto_vacuum(), file=sys.stderr)
+    else:
+        df = history(args.limit)
+        print(df.drop(columns=["steps_json"]).to_string(index=False) if not df.empty else "Belum ada run.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Metrics proses HRMS dalam format teks Prometheus.
+
+Registry hidup di level modul sehingga bertahan lintas rerun Streamlit.
+Export lewat file (untuk textfile collector) dan/atau endpoint HTTP kecil
+di port samping, keduanya opsional dan diatur lewat environment variable.
+"""
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -------------------- Konfigurasi --------------------
+METRICS_FILE = os.environ.get("HRMS_METRICS_FILE", "")  # kosong = tidak menulis file
+METRICS_PORT = int(os.environ.get("HRMS_METRICS_PORT", 0) or 0)  # 0 = endpoint HTTP mati
+METRICS_ADDR = os.environ.get("HRMS_METRICS_ADDR", "127.0.0.1")
+METRICS_INTERVAL = float(os.environ.get("HRMS_METRICS_INTERVAL", 15))
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = {}
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def replace(self, values: dict):
+        """Ganti semua seri sekaligus; key = tuple nilai label."""
+        with _lock:
+            self._values = {tuple(str(v) for v in k): val for k, val in values.items()}
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted((k, (list(c), t)) for k, (c, t) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for upper, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_fmt_value(upper)}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+# -------------------- Metrics HRMS --------------------
+LOGINS = Counter("hrms_logins_total", "Percobaan login per role dan hasil.", ("role", "outcome"))
+PASSWORD_REHASHES = Counter("hrms_password_rehashes_total", "Hash password yang diganti saat login, per skema lama.",
+                            ("scheme",))
+SUBMISSIONS = Counter("hrms_submissions_total", "Pengajuan request per tipe dan hasil.", ("type", "outcome"))
+DECISIONS = Counter("hrms_decisions_total", "Keputusan approval per role dan hasil.", ("role", "outcome"))
+QUEUE_DEPTH = Gauge("hrms_queue_depth", "Jumlah request per status antrian.", ("status",))
+DB_LOCK_RETRIES = Counter("hrms_db_lock_retries_total", "Retry karena database SQLite terkunci.", ("operation",))
+UPLOAD_BYTES = Counter("hrms_upload_bytes_total", "Total byte file yang diupload.")
+RERUN_SECONDS = Histogram("hrms_rerun_duration_seconds", "Durasi rerun Streamlit per halaman.", ("page",))
+SCRAPE_ERRORS = Counter("hrms_metrics_collector_errors_total", "Error saat menjalankan collector.", ("collector",))
+BACKUPS = Counter("hrms_backups_total", "Backup database per hasil.", ("outcome",))
+BACKUP_SECONDS = Histogram("hrms_backup_duration_seconds", "Durasi backup database (snapshot + kompresi).",
+                           buckets=(1, 5, 15, 30, 60, 120, 300, 900))
+BACKUP_LAST_SUCCESS = Gauge("hrms_backup_last_success_timestamp_seconds", "Waktu (epoch) backup sukses terakhir.")
+BACKUP_LAST_BYTES = Gauge("hrms_backup_last_size_bytes", "Ukuran backup sukses terakhir.", ("kind",))
+MAINTENANCE_RUNS = Counter("hrms_maintenance_runs_total", "Run maintenance database per hasil.", ("outcome",))
+MAINTENANCE_SECONDS = Histogram("hrms_maintenance_duration_seconds", "Durasi satu run maintenance database.",
+                                buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300))
+DB_FREELIST_RATIO = Gauge("hrms_db_freelist_ratio", "Porsi halaman kosong (freelist_count/page_count) setelah maintenance.")
+JOBS = Counter("hrms_jobs_total", "Job background yang selesai diproses, per jenis dan hasil.", ("kind", "outcome"))
+JOB_SECONDS = Histogram("hrms_job_duration_seconds", "Durasi eksekusi job background.", ("kind",),
+                        buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0))
+JOB_QUEUE_DEPTH = Gauge("hrms_job_queue_depth", "Jumlah job per status di tabel jobs.", ("status",))
+NOTIFY_MESSAGES = Counter("hrms_notifications_total", "Baris outbox notifikasi yang diproses, per jenis dan hasil.",
+                          ("kind", "outcome"))
+NOTIFY_DIGESTS = Counter("hrms_notification_digests_total", "Email digest notifikasi per hasil.", ("outcome",))
+NOTIFY_BATCH_SECONDS = Histogram("hrms_notification_batch_duration_seconds", "Durasi kirim satu batch digest via SMTP.",
+                                 buckets=(0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0))
+NOTIFY_OUTBOX = Gauge("hrms_notification_outbox", "Jumlah baris outbox notifikasi per status.", ("status",))
+
+# -------------------- Collector & render --------------------
+def register_collector(name: str, fn):
+    """Daftarkan callback yang dipanggil sebelum render (mis. hitung queue depth).
+
+    Nama dipakai sebagai key supaya pendaftaran ulang di setiap rerun
+    menggantikan callback lama, bukan menumpuk.
+    """
+    with _lock:
+        _collectors[name] = fn
+
+def render() -> str:
+    with _lock:
+        collectors = list(_collectors.items())
+        registered = list(_metrics)
+    for name, fn in collectors:
+        try:
+            fn()
+        except Exception:
+            SCRAPE_ERRORS.inc(collector=name)
+    lines = []
+    for m in registered:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+def write_file(path: str = None):
+    """Tulis snapshot metrics secara atomik (tmp + rename)."""
+    path = path or METRICS_FILE
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+# -------------------- Exporter --------------------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_exporter_started = False
+
+def _file_loop():
+    while True:
+        try:
+            write_file()
+        except OSError:
+            pass
+        time.sleep(METRICS_INTERVAL)
+
+def start_exporter() -> bool:
+    """Jalankan exporter file/HTTP sekali per proses. Aman dipanggil di setiap rerun."""
+    global _exporter_started
+    with _lock:
+        if _exporter_started:
+            return False
+        _exporter_started = True
+    if METRICS_FILE:
+        threading.Thread(target=_file_loop, name="hrms-metrics-file", daemon=True).start()
+    if METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer((METRICS_ADDR, METRICS_PORT), _Handler)
+        except OSError:
+            # Port sudah dipakai (mis. proses lain); aplikasi tetap jalan tanpa endpoint
+            return False
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="hrms-metrics-http", daemon=True).start()
+    return True
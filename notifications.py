@@ -0,0 +1,308 @@
+"""Kirim notifikasi email dari tabel notification_outbox (transactional outbox).
+
+service.py menulis baris outbox di transaksi yang sama dengan perubahan status
+request (submit → manager pemohon, keputusan Manager/HR → pemohon), jadi
+notifikasi tidak pernah hilang atau terkirim untuk transaksi yang di-rollback.
+Transaksi itu juga menjadwalkan job "notifications.flush" (jobs.py) paling
+cepat HRMS_NOTIFY_COALESCE_SECONDS setelah baris pertama; perubahan lain di
+jendela itu ikut job yang sama.
+
+flush():
+- klaim semua baris PENDING dengan claim_token (status SENDING);
+- gabungkan per penerima menjadi satu email digest;
+- kirim lewat SATU koneksi SMTP untuk seluruh flush, per batch
+  HRMS_NOTIFY_BATCH_SIZE digest; status SENT di-commit setiap batch;
+- penerima yang ditolak server dicoba lagi di flush berikutnya sampai
+  HRMS_NOTIFY_MAX_ATTEMPTS lalu FAILED; koneksi gagal/putus mengembalikan sisa
+  baris ke PENDING dan job di-retry oleh jobs.py. Pengiriman at-least-once:
+  proses mati di tengah batch bisa mengirim ulang digest batch itu.
+
+Tanpa HRMS_SMTP_HOST baris ditandai SKIPPED (notifikasi nonaktif). Uji lokal
+dengan debugging SMTP server yang mencetak email ke stdout:
+
+    python -m smtpd -n -c DebuggingServer localhost:1025     # Python <= 3.11
+    python -m aiosmtpd -n -l localhost:1025                   # pip install aiosmtpd
+    HRMS_SMTP_HOST=localhost HRMS_SMTP_PORT=1025 python notifications.py test saya@example.com
+"""
+import os
+import ssl
+import time
+import uuid
+import argparse
+import smtplib
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formataddr, formatdate, make_msgid, parseaddr
+from typing import Dict, List, Optional
+
+import metrics
+import service
+
+SMTP_HOST = os.environ.get("HRMS_SMTP_HOST", "")
+SMTP_PORT = int(os.environ.get("HRMS_SMTP_PORT", 25))
+SMTP_USER = os.environ.get("HRMS_SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("HRMS_SMTP_PASSWORD", "")
+SMTP_SECURITY = os.environ.get("HRMS_SMTP_SECURITY", "none").strip().lower()  # "none", "starttls" atau "ssl"
+SMTP_TIMEOUT = float(os.environ.get("HRMS_SMTP_TIMEOUT", 15))
+MAIL_FROM = os.environ.get("HRMS_MAIL_FROM", "HRMS <hrms@localhost>")
+APP_URL = os.environ.get("HRMS_APP_URL", "")
+NOTIFY_BATCH_SIZE = int(os.environ.get("HRMS_NOTIFY_BATCH_SIZE", 50))
+NOTIFY_MAX_ROWS = int(os.environ.get("HRMS_NOTIFY_MAX_ROWS", 5000))  # baris per flush; sisanya flush berikutnya
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("HRMS_NOTIFY_MAX_ATTEMPTS", 5))
+NOTIFY_RETRY_SECONDS = float(os.environ.get("HRMS_NOTIFY_RETRY_SECONDS", 300))
+NOTIFY_STALE_SECONDS = float(os.environ.get("HRMS_NOTIFY_STALE_SECONDS", 900))
+NOTIFY_KEEP_DAYS = int(os.environ.get("HRMS_NOTIFY_KEEP_DAYS", 30))
+
+OUTBOX_STATUSES = ("PENDING", "SENDING", "SENT", "FAILED", "SKIPPED")
+FLUSH_KIND = "notifications.flush"
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+def smtp_configured() -> bool:
+    return bool(SMTP_HOST)
+
+def _connect() -> smtplib.SMTP:
+    if SMTP_SECURITY == "ssl":
+        smtp = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT, context=ssl.create_default_context())
+    else:
+        smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_SECURITY == "starttls":
+            smtp.starttls(context=ssl.create_default_context())
+    if SMTP_USER:
+        smtp.login(SMTP_USER, SMTP_PASSWORD)
+    return smtp
+
+def _quit(smtp: smtplib.SMTP):
+    try:
+        smtp.quit()
+    except (OSError, smtplib.SMTPException):
+        smtp.close()
+
+def schedule_flush(cur, delay_seconds: float = 0):
+    """Jadwalkan job flush di transaksi pemanggil (digabung dengan flush yang masih QUEUED)."""
+    service._enqueue_job(cur, FLUSH_KIND, run_after=_now() + timedelta(seconds=delay_seconds), dedupe_key=FLUSH_KIND)
+
+# -------------------- Digest --------------------
+def build_digest(name: str, email: str, items: List[dict]) -> EmailMessage:
+    """Satu email untuk semua notifikasi seorang penerima (urut waktu dibuat)."""
+    msg = EmailMessage()
+    msg["From"] = MAIL_FROM
+    msg["To"] = formataddr((name or "", email))
+    msg["Subject"] = f"[HRMS] {items[0]['subject']}" if len(items) == 1 else f"[HRMS] {len(items)} pembaruan request"
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid(domain=parseaddr(MAIL_FROM)[1].rpartition("@")[2] or "localhost")
+    lines = [f"Halo {name or email},", ""]
+    for item in items:
+        lines += [f"- {item['subject']}", f"  {item['body']}", ""]
+    if APP_URL:
+        lines.append(f"Buka HRMS: {APP_URL}")
+    lines.append("Email ini dikirim otomatis oleh HRMS, tidak perlu dibalas.")
+    msg.set_content("\n".join(lines))
+    return msg
+
+def _claim(token: str) -> List[dict]:
+    now = _now().isoformat()
+    with service.transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""UPDATE notification_outbox SET status='SENDING', claim_token=?, claimed_at=?
+                       WHERE id IN (SELECT id FROM notification_outbox WHERE status='PENDING' ORDER BY id LIMIT ?)""",
+                    (token, now, NOTIFY_MAX_ROWS))
+        # Penerima sudah dihapus/tanpa email: tidak ada yang bisa dikirimi
+        cur.execute("""UPDATE notification_outbox SET status='SKIPPED', claim_token=NULL, error='Penerima tidak ditemukan'
+                       WHERE claim_token=? AND recipient_id NOT IN (SELECT id FROM users WHERE email <> '')""",
+                    (token,))
+        cur.execute("""SELECT o.id, o.recipient_id, o.kind, o.subject, o.body, u.name, u.email
+                       FROM notification_outbox o JOIN users u ON u.id = o.recipient_id
+                       WHERE o.claim_token=? ORDER BY o.recipient_id, o.id""", (token,))
+        return [dict(r) for r in cur.fetchall()]
+
+def _group(rows: List[dict]) -> List[List[dict]]:
+    groups: Dict[int, List[dict]] = {}
+    for row in rows:
+        groups.setdefault(row["recipient_id"], []).append(row)
+    return list(groups.values())
+
+def _marks(items: List[dict]) -> str:
+    return ",".join("?" * len(items))
+
+def _record_batch(token: str, sent: List[tuple], failed: List[tuple]):
+    """Simpan hasil satu batch: digest terkirim → SENT, ditolak → PENDING lagi (atau FAILED)."""
+    if not sent and not failed:
+        return
+    now = _now().isoformat()
+    with service.transaction() as cur:
+        for digest_id, items in sent:
+            cur.execute(f"""UPDATE notification_outbox SET status='SENT', sent_at=?, digest_id=?, claim_token=NULL,
+                                   attempts=attempts+1, error=NULL
+                            WHERE claim_token=? AND id IN ({_marks(items)})""",
+                        (now, digest_id, token) + tuple(i["id"] for i in items))
+        for items, error in failed:
+            cur.execute(f"""UPDATE notification_outbox
+                            SET status=CASE WHEN attempts+1 >= ? THEN 'FAILED' ELSE 'PENDING' END,
+                                attempts=attempts+1, error=?, claim_token=NULL
+                            WHERE claim_token=? AND id IN ({_marks(items)})""",
+                        (NOTIFY_MAX_ATTEMPTS, error, token) + tuple(i["id"] for i in items))
+        if failed:
+            schedule_flush(cur, NOTIFY_RETRY_SECONDS)
+    for _, items in sent:
+        for item in items:
+            metrics.NOTIFY_MESSAGES.inc(kind=item["kind"], outcome="sent")
+    for items, _ in failed:
+        for item in items:
+            metrics.NOTIFY_MESSAGES.inc(kind=item["kind"], outcome="refused")
+
+def _release(where: str, params: tuple, error: str) -> int:
+    """Kembalikan baris SENDING ke PENDING (attempts+1; FAILED jika jatah habis)."""
+    with service.transaction() as cur:
+        cur.execute(f"""UPDATE notification_outbox
+                        SET status=CASE WHEN attempts+1 >= ? THEN 'FAILED' ELSE 'PENDING' END,
+                            attempts=attempts+1, error=?, claim_token=NULL
+                        WHERE status='SENDING' AND {where}""", (NOTIFY_MAX_ATTEMPTS, error) + params)
+        return cur.rowcount
+
+def _skip_pending() -> int:
+    with service.transaction() as cur:
+        cur.execute("""UPDATE notification_outbox SET status='SKIPPED', error='HRMS_SMTP_HOST tidak diset'
+                       WHERE status='PENDING'""")
+        skipped = cur.rowcount
+    if skipped:
+        metrics.NOTIFY_MESSAGES.inc(skipped, kind="all", outcome="skipped")
+    return skipped
+
+# -------------------- Flush --------------------
+def flush(ctx=None) -> dict:
+    """Kirim semua notifikasi PENDING sebagai digest per penerima lewat satu koneksi SMTP.
+
+    ctx (jobs.JobContext) dipakai untuk memperpanjang lease setiap batch.
+    Error koneksi dilempar ulang supaya job di-retry; baris yang belum terkirim kembali PENDING.
+    """
+    stats = {"rows": 0, "digests": 0, "sent": 0, "refused": 0, "batches": 0, "skipped": 0}
+    stale = (_now() - timedelta(seconds=NOTIFY_STALE_SECONDS)).isoformat()
+    _release("claimed_at < ?", (stale,), "Klaim kedaluwarsa (proses berhenti saat mengirim?)")
+    prune()
+    if not smtp_configured():
+        stats["skipped"] = _skip_pending()
+        return stats
+    token = uuid.uuid4().hex
+    rows = _claim(token)
+    stats["rows"] = len(rows)
+    if not rows:
+        return stats
+    groups = _group(rows)
+    try:
+        smtp = _connect()
+    except (OSError, smtplib.SMTPException) as e:
+        _release("claim_token = ?", (token,), f"Koneksi SMTP gagal: {type(e).__name__}: {e}")
+        metrics.NOTIFY_DIGESTS.inc(len(groups), outcome="connect_error")
+        raise
+    try:
+        for start in range(0, len(groups), max(1, NOTIFY_BATCH_SIZE)):
+            started = time.perf_counter()
+            sent, failed = [], []
+            try:
+                for items in groups[start:start + max(1, NOTIFY_BATCH_SIZE)]:
+                    msg = build_digest(items[0]["name"], items[0]["email"], items)
+                    try:
+                        smtp.send_message(msg)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        failed.append((items, f"{type(e).__name__}: {e}"))
+                        continue
+                    sent.append((msg["Message-ID"], items))
+            finally:
+                # Commit yang sudah terkirim walau koneksi putus di tengah batch
+                _record_batch(token, sent, failed)
+                metrics.NOTIFY_BATCH_SECONDS.observe(time.perf_counter() - started)
+                metrics.NOTIFY_DIGESTS.inc(len(sent), outcome="sent")
+                metrics.NOTIFY_DIGESTS.inc(len(failed), outcome="refused")
+            stats["batches"] += 1
+            stats["digests"] += len(sent)
+            stats["sent"] += sum(len(items) for _, items in sent)
+            stats["refused"] += sum(len(items) for items, _ in failed)
+            if ctx is not None:
+                ctx.heartbeat()
+    except (OSError, smtplib.SMTPException) as e:
+        _release("claim_token = ?", (token,), f"Koneksi SMTP putus: {type(e).__name__}: {e}")
+        metrics.NOTIFY_DIGESTS.inc(outcome="connect_error")
+        raise
+    finally:
+        _quit(smtp)
+    if len(rows) >= NOTIFY_MAX_ROWS:
+        with service.transaction() as cur:
+            schedule_flush(cur)
+    return stats
+
+def send_test(email: str) -> str:
+    """Kirim satu email uji ke alamat tertentu (cek konfigurasi SMTP); kembalikan Message-ID."""
+    if not smtp_configured():
+        raise service.ValidationError("HRMS_SMTP_HOST belum diset.")
+    msg = build_digest(email, email, [{"subject": "Email uji HRMS",
+                                       "body": f"Dikirim {_now().isoformat(timespec='seconds')} UTC lewat {SMTP_HOST}:{SMTP_PORT}."}])
+    smtp = _connect()
+    try:
+        smtp.send_message(msg)
+    finally:
+        _quit(smtp)
+    return msg["Message-ID"]
+
+# -------------------- Status --------------------
+def prune(keep_days: int = None) -> int:
+    keep_days = NOTIFY_KEEP_DAYS if keep_days is None else keep_days
+    cutoff = (_now() - timedelta(days=keep_days)).isoformat()
+    with service.transaction() as cur:
+        cur.execute("DELETE FROM notification_outbox WHERE status IN ('SENT','SKIPPED','FAILED') AND created_at < ?",
+                    (cutoff,))
+        return cur.rowcount
+
+def status_counts() -> Dict[str, int]:
+    conn = service.get_conn()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM notification_outbox GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    return {r["status"]: r["n"] for r in rows}
+
+def has_backlog() -> bool:
+    counts = status_counts()
+    return bool(counts.get("PENDING") or counts.get("SENDING"))
+
+def list_outbox(status: Optional[str] = None, limit: int = 100):
+    import pandas as pd
+    conn = service.get_conn()
+    try:
+        where, params = ("WHERE o.status=?", (status, limit)) if status else ("", (limit,))
+        return pd.read_sql_query(f"""SELECT o.id, o.created_at, u.email AS penerima, o.kind, o.subject, o.status,
+                                            o.attempts, o.sent_at, o.error
+                                     FROM notification_outbox o LEFT JOIN users u ON u.id = o.recipient_id
+                                     {where} ORDER BY o.id DESC LIMIT ?""", conn, params=params)
+    finally:
+        conn.close()
+
+def collect_outbox():
+    """Collector metrics: jumlah baris outbox per status."""
+    counts = status_counts()
+    for status in OUTBOX_STATUSES:
+        metrics.NOTIFY_OUTBOX.set(counts.get(status, 0), status=status)
+
+# -------------------- CLI --------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRMS email notifications")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("flush", help="Kirim notifikasi PENDING sekarang (tanpa worker)")
+    sub.add_parser("status", help="Jumlah baris outbox per status")
+    p_test = sub.add_parser("test", help="Kirim email uji")
+    p_test.add_argument("email")
+    args = parser.parse_args(argv)
+    service.init_db()
+    if args.command == "flush":
+        stats = flush()
+        print(f"{stats['digests']} digest ({stats['sent']} notifikasi) terkirim dalam {stats['batches']} batch, "
+              f"{stats['refused']} ditolak, {stats['skipped']} dilewati")
+    elif args.command == "status":
+        counts = status_counts()
+        print("  ".join(f"{s}={counts.get(s, 0)}" for s in OUTBOX_STATUSES))
+    else:
+        print(send_test(args.email))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Hash password ber-salt dengan parameter yang bisa disetel (scrypt atau PBKDF2).
+
+Setiap hash disimpan sebagai string ter-encode yang membawa skema, parameter,
+salt acak per user, dan digest (base64 tanpa padding):
+
+    scrypt$ln=14,r=8,p=1$<salt>$<digest>
+    pbkdf2_sha256$600000$<salt>$<digest>
+
+Skema default dipilih lewat HRMS_PW_SCHEME. Parameter lain dari hash baru
+(HRMS_PW_SCRYPT_LOG_N/R/P, HRMS_PW_PBKDF2_ITERATIONS) sebaiknya ditentukan
+dengan benchmark kalibrasi di hardware server:
+
+    python passwords.py calibrate --target-ms 250
+
+Hash lama (sha256 hex tanpa salt) tetap bisa diverifikasi. needs_rehash()
+menandai hash lama atau hash dengan skema/parameter yang beda dari konfigurasi,
+dan login akan menggantinya dengan hash baru begitu password-nya diketahui.
+hashlib.scrypt/pbkdf2_hmac melepas GIL, jadi hashing massal bisa paralel di
+thread pool (lihat user_import.py).
+"""
+import os
+import sys
+import hmac
+import time
+import base64
+import hashlib
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+PW_SCHEME = os.environ.get("HRMS_PW_SCHEME", "scrypt").strip().lower()  # "scrypt" atau "pbkdf2_sha256"
+PW_SCRYPT_LOG_N = int(os.environ.get("HRMS_PW_SCRYPT_LOG_N", 14))  # N = 2**log_n; memori ~ 128 * r * N byte
+PW_SCRYPT_R = int(os.environ.get("HRMS_PW_SCRYPT_R", 8))
+PW_SCRYPT_P = int(os.environ.get("HRMS_PW_SCRYPT_P", 1))
+PW_PBKDF2_ITERATIONS = int(os.environ.get("HRMS_PW_PBKDF2_ITERATIONS", 600000))
+PW_SALT_BYTES = int(os.environ.get("HRMS_PW_SALT_BYTES", 16))
+
+SCHEMES = ("scrypt", "pbkdf2_sha256")
+LEGACY_SCHEME = "sha256"
+_DIGEST_BYTES = 32
+
+@dataclass
+class HashInfo:
+    scheme: str
+    params: dict
+    salt: bytes = b""
+    digest: bytes = b""
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+def _scrypt_maxmem(n: int, r: int, p: int) -> int:
+    # Kebutuhan OpenSSL ~128*r*(N+p) byte; default maxmem 32 MB terlalu kecil untuk N besar
+    return 128 * r * (n + p + 2) + 1024 * 1024
+
+def _derive(scheme: str, params: dict, password: str, salt: bytes) -> bytes:
+    data = password.encode("utf-8")
+    if scheme == "scrypt":
+        n, r, p = 1 << params["ln"], params["r"], params["p"]
+        return hashlib.scrypt(data, salt=salt, n=n, r=r, p=p, maxmem=_scrypt_maxmem(n, r, p), dklen=_DIGEST_BYTES)
+    if scheme == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", data, salt, params["iterations"], _DIGEST_BYTES)
+    raise ValueError(f"Skema password tidak dikenal: {scheme}")
+
+def current_params(scheme: str = None) -> dict:
+    """Parameter hash baru untuk skema (default HRMS_PW_SCHEME) sesuai konfigurasi."""
+    scheme = scheme or PW_SCHEME
+    if scheme == "scrypt":
+        return {"ln": PW_SCRYPT_LOG_N, "r": PW_SCRYPT_R, "p": PW_SCRYPT_P}
+    if scheme == "pbkdf2_sha256":
+        return {"iterations": PW_PBKDF2_ITERATIONS}
+    raise ValueError(f"HRMS_PW_SCHEME tidak valid: {scheme} (pilih {', '.join(SCHEMES)})")
+
+def _encode(info: HashInfo) -> str:
+    if info.scheme == "scrypt":
+        params = f"ln={info.params['ln']},r={info.params['r']},p={info.params['p']}"
+    else:
+        params = str(info.params["iterations"])
+    return f"{info.scheme}${params}${_b64(info.salt)}${_b64(info.digest)}"
+
+def parse_hash(encoded: str) -> Optional[HashInfo]:
+    """Uraikan hash tersimpan; None jika formatnya tidak dikenali."""
+    encoded = (encoded or "").strip()
+    if "$" not in encoded:
+        if len(encoded) == 64 and all(c in "0123456789abcdef" for c in encoded.lower()):
+            return HashInfo(LEGACY_SCHEME, {}, digest=bytes.fromhex(encoded))
+        return None
+    try:
+        scheme, params, salt, digest = encoded.split("$")
+        if scheme == "scrypt":
+            kv = dict(item.split("=", 1) for item in params.split(","))
+            parsed = {"ln": int(kv["ln"]), "r": int(kv["r"]), "p": int(kv["p"])}
+        elif scheme == "pbkdf2_sha256":
+            parsed = {"iterations": int(params)}
+        else:
+            return None
+        return HashInfo(scheme, parsed, _unb64(salt), _unb64(digest))
+    except (ValueError, KeyError):
+        return None
+
+def hash_password(password: str, scheme: str = None, params: dict = None) -> str:
+    """Hash password dengan salt acak baru; hasilnya string ter-encode siap disimpan."""
+    scheme = scheme or PW_SCHEME
+    params = params or current_params(scheme)
+    salt = os.urandom(PW_SALT_BYTES)
+    return _encode(HashInfo(scheme, params, salt, _derive(scheme, params, password, salt)))
+
+def verify_password(password: str, encoded: str) -> bool:
+    """Cocokkan password dengan hash tersimpan (termasuk sha256 lama); perbandingan constant-time."""
+    info = parse_hash(encoded)
+    if info is None:
+        return False
+    if info.scheme == LEGACY_SCHEME:
+        candidate = hashlib.sha256(password.encode("utf-8")).digest()
+    else:
+        candidate = _derive(info.scheme, info.params, password, info.salt)
+    return hmac.compare_digest(candidate, info.digest)
+
+def needs_rehash(encoded: str) -> bool:
+    """True jika hash lama atau skema/parameternya beda dari konfigurasi sekarang."""
+    info = parse_hash(encoded)
+    if info is None or info.scheme != PW_SCHEME:
+        return True
+    return info.params != current_params()
+
+def scheme_of(encoded: str) -> str:
+    info = parse_hash(encoded)
+    return info.scheme if info else "unknown"
+
+# -------------------- Kalibrasi --------------------
+def time_hash(scheme: str, params: dict, rounds: int = 3) -> float:
+    """Median durasi (detik) satu hash dengan parameter tertentu."""
+    samples = []
+    for _ in range(max(1, rounds)):
+        t0 = time.perf_counter()
+        _derive(scheme, params, "kalibrasi-password", b"\x00" * PW_SALT_BYTES)
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+def calibrate(target_ms: float, scheme: str = None, rounds: int = 3, max_log_n: int = 20) -> dict:
+    """Cari work factor terbesar yang durasi hash-nya tidak melebihi target_ms di mesin ini.
+
+    scrypt: N digandakan (r/p tetap dari konfigurasi) sampai melewati target;
+    PBKDF2: iterasi diskalakan linear dari satu pengukuran lalu diverifikasi.
+    """
+    scheme = scheme or PW_SCHEME
+    target = target_ms / 1000.0
+    if scheme == "scrypt":
+        best = {"ln": 10, "r": PW_SCRYPT_R, "p": PW_SCRYPT_P}
+        best_s = time_hash(scheme, best, rounds)
+        for ln in range(11, max_log_n + 1):
+            params = {"ln": ln, "r": PW_SCRYPT_R, "p": PW_SCRYPT_P}
+            seconds = time_hash(scheme, params, rounds)
+            if seconds > target:
+                break
+            best, best_s = params, seconds
+        return {"scheme": scheme, "params": best, "ms": round(best_s * 1000, 1),
+                "memory_bytes": 128 * best["r"] * (1 << best["ln"])}
+    if scheme == "pbkdf2_sha256":
+        probe = 50000
+        per_iter = time_hash(scheme, {"iterations": probe}, rounds) / probe
+        iterations = max(10000, int(target / per_iter) // 1000 * 1000)
+        params = {"iterations": iterations}
+        return {"scheme": scheme, "params": params, "ms": round(time_hash(scheme, params, rounds) * 1000, 1),
+                "memory_bytes": 0}
+    raise ValueError(f"Skema password tidak dikenal: {scheme}")
+
+def env_lines(result: dict) -> list:
+    params = result["params"]
+    if result["scheme"] == "scrypt":
+        return ["HRMS_PW_SCHEME=scrypt", f"HRMS_PW_SCRYPT_LOG_N={params['ln']}",
+                f"HRMS_PW_SCRYPT_R={params['r']}", f"HRMS_PW_SCRYPT_P={params['p']}"]
+    return ["HRMS_PW_SCHEME=pbkdf2_sha256", f"HRMS_PW_PBKDF2_ITERATIONS={params['iterations']}"]
+
+def bench(count: int, workers: int) -> dict:
+    """Throughput hash dengan konfigurasi sekarang: serial vs thread pool (estimasi waktu import massal)."""
+    t0 = time.perf_counter()
+    for i in range(count):
+        hash_password(f"pw{i}")
+    serial = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(hash_password, [f"pw{i}" for i in range(count)]))
+    parallel = time.perf_counter() - t0
+    return {"count": count, "workers": workers, "serial_s": round(serial, 3), "parallel_s": round(parallel, 3),
+            "per_hash_ms": round(serial / count * 1000, 1), "speedup": round(serial / parallel, 2) if parallel else None}
+
+# -------------------- CLI --------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRMS password hashing")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_cal = sub.add_parser("calibrate", help="Cari work factor untuk target latensi login")
+    p_cal.add_argument("--target-ms", type=float, default=250)
+    p_cal.add_argument("--scheme", choices=SCHEMES, default=None)
+    p_cal.add_argument("--rounds", type=int, default=3)
+    p_bench = sub.add_parser("bench", help="Ukur durasi hash dengan konfigurasi sekarang")
+    p_bench.add_argument("--count", type=int, default=16)
+    p_bench.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+    args = parser.parse_args(argv)
+    if args.command == "calibrate":
+        r = calibrate(args.target_ms, args.scheme, args.rounds)
+        print(f"{r['scheme']} {r['params']} → {r['ms']} ms/hash (target {args.target_ms:g} ms)"
+              + (f", memori {r['memory_bytes'] // (1024 * 1024)} MB" if r["memory_bytes"] else ""), file=sys.stderr)
+        print("\n".join(env_lines(r)))
+    else:
+        r = bench(args.count, args.workers)
+        print(f"{PW_SCHEME} {current_params()}: {r['per_hash_ms']} ms/hash, {r['count']} hash serial "
+              f"{r['serial_s']} s, {r['workers']} thread {r['parallel_s']} s (x{r['speedup']})")
+
+if __name__ == "__main__":
+    main()
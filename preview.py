@@ -0,0 +1,270 @@
+"""Preview lampiran non-PDF (teks/CSV, XLSX, DOCX) dengan batas ukuran dan cache di disk.
+
+Teks/CSV hanya membaca prefix HRMS_TEXT_PREVIEW_MAX_BYTES lewat mmap, didekode
+dengan incremental decoder (karakter multi-byte yang terpotong di ujung prefix
+dibuang). XLSX dibaca openpyxl read-only (streaming) sampai HRMS_PREVIEW_MAX_ROWS
+baris x HRMS_PREVIEW_MAX_COLS kolom per sheet; DOCX dibaca python-docx sesuai
+urutan paragraf/tabel di body sampai batas blok dan byte yang sama. XLSX/DOCX
+adalah arsip ZIP yang tidak bisa dibaca sebagian, jadi file di atas
+HRMS_PREVIEW_MAX_FILE_BYTES tidak di-preview.
+
+Hasil render (JSON) di-cache di HRMS_PREVIEW_CACHE_DIR dengan key sha256 isi
+file + versi format/batas, sehingga file yang sama (termasuk salinan dengan
+nama lain) hanya dirender sekali. sha256 dihitung lewat mmap dan diingat per
+(path, ukuran, mtime) selama proses hidup.
+"""
+import os
+import csv
+import json
+import mmap
+import codecs
+import hashlib
+import threading
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional, Tuple
+
+TEXT_PREVIEW_MAX_BYTES = int(os.environ.get("HRMS_TEXT_PREVIEW_MAX_BYTES", 200 * 1024))  # 200 KB
+PREVIEW_MAX_ROWS = int(os.environ.get("HRMS_PREVIEW_MAX_ROWS", 50))
+PREVIEW_MAX_COLS = int(os.environ.get("HRMS_PREVIEW_MAX_COLS", 30))
+PREVIEW_MAX_SHEETS = int(os.environ.get("HRMS_PREVIEW_MAX_SHEETS", 3))
+PREVIEW_MAX_FILE_BYTES = int(os.environ.get("HRMS_PREVIEW_MAX_FILE_BYTES", 20 * 1024 * 1024))  # XLSX/DOCX
+PREVIEW_CACHE_DIR = os.environ.get("HRMS_PREVIEW_CACHE_DIR", os.path.join("cache", "previews"))
+
+TEXT_EXTENSIONS = (".txt", ".log", ".md", ".json", ".xml")
+CSV_EXTENSIONS = (".csv", ".tsv")
+XLSX_EXTENSIONS = (".xlsx", ".xlsm")
+DOCX_EXTENSIONS = (".docx",)
+PREVIEWABLE_EXTENSIONS = TEXT_EXTENSIONS + CSV_EXTENSIONS + XLSX_EXTENSIONS + DOCX_EXTENSIONS
+
+_FORMAT_VERSION = 1
+_FALLBACK_ENCODING = "cp1252"
+_CHUNK = 1024 * 1024
+
+_hash_lock = threading.Lock()
+_hash_cache: Dict[Tuple[str, int, int], str] = {}
+
+@dataclass
+class Preview:
+    """Hasil preview siap render. blocks: {"type": "text", "text"} atau {"type": "table", "title", "rows"}."""
+    kind: str
+    truncated: bool = False
+    encoding: Optional[str] = None
+    message: Optional[str] = None
+    blocks: List[dict] = field(default_factory=list)
+
+def is_previewable(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in PREVIEWABLE_EXTENSIONS
+
+# -------------------- Hash & cache --------------------
+def file_sha256(path: str) -> str:
+    """sha256 isi file via mmap; diingat per (path, ukuran, mtime)."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _hash_lock:
+        cached = _hash_cache.get(key)
+    if cached:
+        return cached
+    h = hashlib.sha256()
+    if st.st_size:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in range(0, st.st_size, _CHUNK):
+                h.update(mm[offset:offset + _CHUNK])
+    digest = h.hexdigest()
+    with _hash_lock:
+        _hash_cache[key] = digest
+    return digest
+
+def _cache_path(digest: str) -> str:
+    # Batas ikut masuk key: mengubah HRMS_PREVIEW_* tidak memakai render lama
+    limits = f"{_FORMAT_VERSION}:{TEXT_PREVIEW_MAX_BYTES}:{PREVIEW_MAX_ROWS}:{PREVIEW_MAX_COLS}:{PREVIEW_MAX_SHEETS}"
+    variant = hashlib.sha1(limits.encode()).hexdigest()[:8]
+    return os.path.join(PREVIEW_CACHE_DIR, digest[:2], f"{digest}-{variant}.json")
+
+def _load_cached(path: str) -> Optional[Preview]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return Preview(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+def _store_cached(path: str, result: Preview):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(asdict(result), f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def prune_cache(keep_digests: set) -> int:
+    """Hapus render di cache yang sha256-nya tidak ada di keep_digests (lampiran sudah dihapus)."""
+    return _prune_digest_dir(PREVIEW_CACHE_DIR, keep_digests)
+
+def _prune_digest_dir(root: str, keep_digests: set) -> int:
+    """Hapus file <root>/<xx>/<sha256>-<varian>.* yang digest-nya tidak dipertahankan."""
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    for bucket in os.scandir(root):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            if entry.name.split("-", 1)[0] in keep_digests:
+                continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+# -------------------- Teks & CSV --------------------
+def read_prefix(path: str, limit: int = None) -> Tuple[bytes, bool]:
+    """(maksimal `limit` byte pertama, apakah file lebih besar dari limit)."""
+    limit = TEXT_PREVIEW_MAX_BYTES if limit is None else limit
+    size = os.path.getsize(path)
+    if not size:
+        return b"", False
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm[:limit], size > limit
+
+def decode_prefix(data: bytes, truncated: bool) -> Tuple[str, str]:
+    """Dekode prefix; byte UTF-8 yang terpotong di ujung dibuang, selain UTF-8 jatuh ke cp1252."""
+    encoding = "utf-8-sig" if data.startswith(codecs.BOM_UTF8) else "utf-8"
+    try:
+        return codecs.getincrementaldecoder(encoding)().decode(data, final=not truncated), encoding
+    except UnicodeDecodeError:
+        return data.decode(_FALLBACK_ENCODING, errors="replace"), _FALLBACK_ENCODING
+
+def _looks_binary(data: bytes) -> bool:
+    return b"\x00" in data[:8192]
+
+def _preview_text(path: str) -> Preview:
+    data, truncated = read_prefix(path)
+    if _looks_binary(data):
+        return Preview("unsupported", message="File terlihat biner, preview teks tidak tersedia.")
+    text, encoding = decode_prefix(data, truncated)
+    return Preview("text", truncated, encoding, blocks=[{"type": "text", "text": text}])
+
+def _preview_csv(path: str) -> Preview:
+    data, truncated = read_prefix(path)
+    if _looks_binary(data):
+        return Preview("unsupported", message="File terlihat biner, preview CSV tidak tersedia.")
+    text, encoding = decode_prefix(data, truncated)
+    lines = text.splitlines()
+    if truncated and lines:
+        lines = lines[:-1]  # baris terakhir kemungkinan terpotong
+    sample = "\n".join(lines[:20])
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel_tab if path.lower().endswith(".tsv") else csv.excel
+    rows = []
+    for row in csv.reader(lines, dialect):
+        if len(rows) > PREVIEW_MAX_ROWS:  # header + PREVIEW_MAX_ROWS baris data
+            truncated = True
+            break
+        rows.append(row[:PREVIEW_MAX_COLS])
+    return Preview("table", truncated, encoding, blocks=[{"type": "table", "title": None, "rows": rows}])
+
+# -------------------- XLSX & DOCX --------------------
+def _cell_text(value) -> str:
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+def _preview_xlsx(path: str) -> Preview:
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    result = Preview("table")
+    try:
+        for index, ws in enumerate(wb.worksheets):
+            if index >= PREVIEW_MAX_SHEETS:
+                result.truncated = True
+                break
+            rows = []
+            for values in ws.iter_rows(max_row=PREVIEW_MAX_ROWS + 1, max_col=PREVIEW_MAX_COLS, values_only=True):
+                rows.append([_cell_text(v) for v in values])
+            # Dimensi sheet read-only bisa tidak diketahui (None); hanya tandai terpotong jika jelas lebih besar
+            if (ws.max_row or 0) > PREVIEW_MAX_ROWS + 1 or (ws.max_column or 0) > PREVIEW_MAX_COLS:
+                result.truncated = True
+            # iter_rows(max_col=...) mengisi sel kosong sampai max_col: buang baris/kolom kosong di ujung
+            while rows and not any(rows[-1]):
+                rows.pop()
+            width = max((max((i + 1 for i, v in enumerate(r) if v), default=0) for r in rows), default=0)
+            rows = [r[:width] for r in rows]
+            result.blocks.append({"type": "table", "title": ws.title, "rows": rows})
+    finally:
+        wb.close()
+    return result
+
+def _preview_docx(path: str) -> Preview:
+    from docx import Document
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    doc = Document(path)
+    result = Preview("document")
+    budget = TEXT_PREVIEW_MAX_BYTES
+    text_lines: List[str] = []
+
+    def flush_text():
+        if text_lines:
+            result.blocks.append({"type": "text", "text": "\n".join(text_lines)})
+            text_lines.clear()
+
+    for child in doc.element.body.iterchildren():
+        if budget <= 0 or len(result.blocks) >= PREVIEW_MAX_ROWS:
+            result.truncated = True
+            break
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            line = Paragraph(child, doc).text
+            if line.strip():
+                text_lines.append(line[:budget])
+                budget -= len(line.encode("utf-8"))
+        elif tag == "tbl":
+            flush_text()
+            rows = []
+            for row in Table(child, doc).rows:
+                if len(rows) > PREVIEW_MAX_ROWS:
+                    result.truncated = True
+                    break
+                cells = [c.text for c in row.cells[:PREVIEW_MAX_COLS]]
+                budget -= sum(len(c.encode("utf-8")) for c in cells)
+                rows.append(cells)
+            result.blocks.append({"type": "table", "title": None, "rows": rows})
+    flush_text()
+    return result
+
+# -------------------- API --------------------
+def _render(path: str, ext: str) -> Preview:
+    if ext in CSV_EXTENSIONS:
+        return _preview_csv(path)
+    if ext in TEXT_EXTENSIONS:
+        return _preview_text(path)
+    if os.path.getsize(path) > PREVIEW_MAX_FILE_BYTES:
+        return Preview("unsupported", message=f"File lebih besar dari batas preview "
+                                              f"({PREVIEW_MAX_FILE_BYTES // (1024 * 1024)} MB).")
+    if ext in XLSX_EXTENSIONS:
+        return _preview_xlsx(path)
+    return _preview_docx(path)
+
+def build_preview(path: str, use_cache: bool = True) -> Preview:
+    """Preview lampiran (teks/CSV/XLSX/DOCX); hasil di-cache per sha256 isi file."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in PREVIEWABLE_EXTENSIONS:
+        return Preview("unsupported", message="Preview tidak tersedia untuk tipe file ini.")
+    cache = _cache_path(file_sha256(path)) if use_cache else None
+    if cache:
+        hit = _load_cached(cache)
+        if hit is not None:
+            return hit
+    try:
+        result = _render(path, ext)
+    except ImportError as e:
+        return Preview("unsupported", message=f"Library preview tidak terpasang: {e.name}")
+    except Exception as e:  # file rusak/bukan format yang diklaim ekstensinya
+        return Preview("unsupported", message=f"Gagal membaca file: {e}")
+    if cache:
+        _store_cached(cache, result)
+    return result
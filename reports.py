@@ -0,0 +1,222 @@
+"""Deck ringkasan HR bulanan (PPTX) dari agregat SQL.
+
+Semua angka dihitung dengan GROUP BY di SQLite (hanya baris ringkasan yang
+dibawa ke Python), lalu dirender menjadi chart dan tabel native PowerPoint.
+Generate berjalan sebagai job "report.deck" di antrian jobs.py supaya sesi HR
+tidak terblokir; status job ada di tabel jobs sehingga bertahan lintas rerun
+maupun restart proses.
+"""
+import os
+import uuid
+import calendar
+from datetime import date, datetime
+from typing import List, Optional
+
+import jobs
+import service
+
+REPORT_DIR = os.environ.get("HRMS_REPORT_DIR", "reports")
+REPORT_TOP_LOCATIONS = int(os.environ.get("HRMS_REPORT_TOP_LOCATIONS", 10))
+REPORT_MAX_JOBS = 50  # riwayat job yang ditampilkan
+
+MONTH_NAMES_ID = ["Januari", "Februari", "Maret", "April", "Mei", "Juni", "Juli",
+                  "Agustus", "September", "Oktober", "November", "Desember"]
+
+# -------------------- Agregat --------------------
+def month_bounds(year: int, month: int):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+def usage_by_division(year: int, month: int) -> List[dict]:
+    """Hari cuti dan Change Off APPROVED per divisi, dibaca dari service.usage_summary."""
+    conn = service.get_conn()
+    try:
+        rows = conn.execute("""
+            SELECT division,
+                   SUM(CASE WHEN type = 'LEAVE' THEN requests ELSE 0 END) AS leave_requests,
+                   SUM(CASE WHEN type = 'LEAVE' THEN days ELSE 0 END) AS leave_days,
+                   SUM(CASE WHEN type = 'CHANGEOFF' THEN requests ELSE 0 END) AS changeoff_requests,
+                   SUM(CASE WHEN type = 'CHANGEOFF' THEN days ELSE 0 END) AS changeoff_days
+            FROM usage_summary
+            WHERE year = ? AND month = ? AND status = 'APPROVED'
+            GROUP BY division
+            ORDER BY division
+        """, (year, month)).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+def approval_backlog() -> List[dict]:
+    """Request yang masih menunggu, per status, beserta umur antrian (hari)."""
+    conn = service.get_conn()
+    try:
+        rows = conn.execute("""
+            SELECT status, COUNT(*) AS requests,
+                   ROUND(AVG(julianday('now') - julianday(created_at)), 1) AS avg_age_days,
+                   ROUND(MAX(julianday('now') - julianday(created_at)), 1) AS max_age_days
+            FROM requests
+            WHERE status IN ('PENDING_MANAGER', 'PENDING_HR')
+            GROUP BY status
+            ORDER BY status
+        """).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+def top_changeoff_locations(year: int, month: int, limit: int = REPORT_TOP_LOCATIONS) -> List[dict]:
+    first, last = month_bounds(year, month)
+    conn = service.get_conn()
+    try:
+        rows = conn.execute("""
+            SELECT COALESCE(NULLIF(TRIM(location), ''), '-') AS location, COUNT(*) AS requests,
+                   COALESCE(SUM(hours), 0) AS hours
+            FROM requests
+            WHERE type = 'CHANGEOFF' AND status = 'APPROVED'
+              AND departure_date <= ? AND return_date >= ?
+            GROUP BY 1
+            ORDER BY requests DESC, hours DESC
+            LIMIT ?
+        """, (last.isoformat(), first.isoformat(), limit)).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+def quota_by_division(year: int) -> List[dict]:
+    """Total kuota per divisi; user tanpa baris kuota dihitung dengan default."""
+    conn = service.get_conn()
+    try:
+        rows = conn.execute("""
+            SELECT COALESCE(u.division, '-') AS division, COUNT(*) AS users,
+                   SUM(COALESCE(q.leave_total, ?)) AS leave_total,
+                   SUM(COALESCE(q.leave_used, 0)) AS leave_used,
+                   SUM(COALESCE(q.changeoff_earned, 0)) AS co_earned,
+                   SUM(COALESCE(q.changeoff_used, 0)) AS co_used
+            FROM users u
+            LEFT JOIN quotas q ON q.user_id = u.id AND q.year = ?
+            GROUP BY COALESCE(u.division, '-')
+            ORDER BY division
+        """, (service.DEFAULT_LEAVE_TOTAL, year)).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+# -------------------- Render PPTX --------------------
+def _add_title_slide(prs, title: str, subtitle: str):
+    slide = prs.slides.add_slide(prs.slide_layouts[0])
+    slide.shapes.title.text = title
+    slide.placeholders[1].text = subtitle
+
+def _add_table(slide, header: list, rows: list, left, top, width, height):
+    from pptx.util import Pt
+    table = slide.shapes.add_table(len(rows) + 1, len(header), left, top, width, height).table
+    for c, text in enumerate(header):
+        table.cell(0, c).text = str(text)
+    for r, row in enumerate(rows, start=1):
+        for c, value in enumerate(row):
+            table.cell(r, c).text = "" if value is None else str(value)
+    for row in table.rows:
+        for cell in row.cells:
+            for p in cell.text_frame.paragraphs:
+                p.font.size = Pt(11)
+    return table
+
+def _add_bar_chart(slide, categories: list, series: dict, left, top, width, height, title: str):
+    from pptx.chart.data import CategoryChartData
+    from pptx.enum.chart import XL_CHART_TYPE, XL_LEGEND_POSITION
+    data = CategoryChartData()
+    data.categories = categories
+    for name, values in series.items():
+        data.add_series(name, values)
+    chart = slide.shapes.add_chart(XL_CHART_TYPE.COLUMN_CLUSTERED, left, top, width, height, data).chart
+    chart.has_title = True
+    chart.chart_title.text_frame.text = title
+    chart.has_legend = len(series) > 1
+    if chart.has_legend:
+        chart.legend.position = XL_LEGEND_POSITION.BOTTOM
+        chart.legend.include_in_layout = False
+    return chart
+
+def _content_slide(prs, title: str):
+    slide = prs.slides.add_slide(prs.slide_layouts[5])  # Title Only
+    slide.shapes.title.text = title
+    return slide
+
+def build_deck(year: int, month: int, path: str) -> str:
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    usage = usage_by_division(year, month)
+    backlog = approval_backlog()
+    locations = top_changeoff_locations(year, month)
+    quotas = quota_by_division(year)
+
+    prs = Presentation()
+    prs.slide_width, prs.slide_height = Inches(13.333), Inches(7.5)
+    full = (Inches(0.5), Inches(1.4), Inches(12.3), Inches(5.6))
+    left_half = (Inches(0.5), Inches(1.4), Inches(6.4), Inches(5.6))
+    right_half = (Inches(7.1), Inches(1.4), Inches(5.7), Inches(5.6))
+
+    _add_title_slide(prs, f"Ringkasan HR {MONTH_NAMES_ID[month - 1]} {year}",
+                     f"Dibuat {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC")
+
+    slide = _content_slide(prs, "Pemakaian Cuti & Change Off per Divisi")
+    if usage:
+        _add_bar_chart(slide, [u["division"] for u in usage], {
+            "Hari Cuti": [u["leave_days"] or 0 for u in usage],
+            "Hari Change Off": [u["changeoff_days"] or 0 for u in usage],
+        }, *left_half, title="Hari terpakai (APPROVED)")
+        _add_table(slide, ["Divisi", "Req Cuti", "Hari Cuti", "Req CO", "Hari CO"],
+                   [(u["division"], u["leave_requests"], u["leave_days"], u["changeoff_requests"], u["changeoff_days"])
+                    for u in usage], *right_half)
+    else:
+        slide.shapes.add_textbox(*full).text_frame.text = "Tidak ada request APPROVED pada bulan ini."
+
+    slide = _content_slide(prs, "Backlog Approval")
+    if backlog:
+        _add_bar_chart(slide, [b["status"] for b in backlog], {"Request": [b["requests"] for b in backlog]},
+                       *left_half, title="Request menunggu")
+        _add_table(slide, ["Status", "Request", "Rata-rata umur (hari)", "Umur maks (hari)"],
+                   [(b["status"], b["requests"], b["avg_age_days"], b["max_age_days"]) for b in backlog], *right_half)
+    else:
+        slide.shapes.add_textbox(*full).text_frame.text = "Tidak ada request yang menunggu approval."
+
+    slide = _content_slide(prs, f"Top {REPORT_TOP_LOCATIONS} Lokasi Change Off")
+    if locations:
+        _add_bar_chart(slide, [loc["location"] for loc in locations], {"Request": [loc["requests"] for loc in locations]},
+                       *left_half, title="Request per lokasi")
+        _add_table(slide, ["Lokasi", "Request", "Total Jam"],
+                   [(loc["location"], loc["requests"], loc["hours"]) for loc in locations], *right_half)
+    else:
+        slide.shapes.add_textbox(*full).text_frame.text = "Tidak ada Change Off APPROVED pada bulan ini."
+
+    slide = _content_slide(prs, f"Saldo Kuota per Divisi ({year})")
+    _add_table(slide, ["Divisi", "User", "Cuti Total", "Cuti Terpakai", "Saldo Cuti", "CO Earned", "CO Terpakai", "Saldo CO"],
+               [(q["division"], q["users"], q["leave_total"], q["leave_used"], q["leave_total"] - q["leave_used"],
+                 q["co_earned"], q["co_used"], q["co_earned"] - q["co_used"]) for q in quotas], *full)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    prs.save(tmp)
+    os.replace(tmp, path)
+    return path
+
+# -------------------- Background job --------------------
+def _deck_job(job: dict) -> dict:
+    payload, result = job["payload"], job["result"] or {}
+    return {"id": job["id"], "year": payload["year"], "month": payload["month"], "status": job["status"],
+            "path": result.get("path") or payload["path"], "error": job["error"],
+            "created_at": (job["created_at"] or "")[:19], "started_at": job["started_at"],
+            "finished_at": job["finished_at"]}
+
+def submit_monthly_deck(year: int, month: int, created_by: Optional[int] = None) -> int:
+    """Antrikan pembuatan deck di antrian job; kembalikan id job untuk dipantau lewat job_status()."""
+    if not 1 <= month <= 12:
+        raise service.ValidationError("Bulan harus 1-12.")
+    path = os.path.join(REPORT_DIR, f"hr-summary-{year}-{month:02d}-{uuid.uuid4().hex[:12]}.pptx")
+    return jobs.enqueue("report.deck", {"year": int(year), "month": int(month), "path": path}, created_by=created_by)
+
+def job_status(job_id: int) -> Optional[dict]:
+    job = jobs.get_job(job_id)
+    return _deck_job(job) if job and job["kind"] == "report.deck" else None
+
+def list_jobs() -> List[dict]:
+    return [_deck_job(j) for j in jobs.list_jobs(kind="report.deck", limit=REPORT_MAX_JOBS)]
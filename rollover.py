@@ -0,0 +1,202 @@
+"""Rollover kuota akhir tahun dengan aturan carry-over.
+
+Rollover membuat kuota tahun baru untuk SEMUA user dengan satu
+INSERT ... SELECT: leave_total = default + sisa cuti yang dibawa (dibatasi
+HRMS_CARRY_LEAVE_MAX), changeoff_earned = sisa Change Off yang dibawa
+(dibatasi HRMS_CARRY_CO_MAX). Baris yang sudah ada (dibuat lazy) ditambah
+carry-nya; baris yang sudah pernah di-rollover dilewati, jadi aman dijalankan
+berulang. Saldo bawaan hangus setelah carry_expires_on (akhir bulan ke
+HRMS_CARRY_EXPIRY_MONTHS) lewat expire_carry_over(). User tanpa kuota tahun
+sebelumnya tidak membawa saldo apa pun; kuota tahun berjalan untuk user baru
+langsung ditandai rollover_at saat dibuat.
+
+Bisa dipicu HR dari halaman Quotas atau dijadwalkan (cron harian):
+
+    python rollover.py auto                 # rollover tahun berjalan + expiry, idempoten
+    python rollover.py rollover --to-year 2027 --dry-run
+    python rollover.py expire
+"""
+import os
+import sys
+import calendar
+import argparse
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import List, Optional
+
+import exports
+import service
+
+CARRY_LEAVE_MAX = int(os.environ.get("HRMS_CARRY_LEAVE_MAX", 5))
+CARRY_CO_MAX = int(os.environ.get("HRMS_CARRY_CO_MAX", 5))
+CARRY_EXPIRY_MONTHS = int(os.environ.get("HRMS_CARRY_EXPIRY_MONTHS", 3))  # 0 = tidak hangus
+
+ROLLOVER_COLUMNS = [
+    "user_id", "email", "name", "division", "action",
+    "leave_balance_prev", "leave_carry", "leave_forfeit", "leave_total_before", "leave_total_after",
+    "co_balance_prev", "co_carry", "co_forfeit", "co_earned_before", "co_earned_after",
+]
+EXPIRY_COLUMNS = ["user_id", "email", "name", "year", "leave_carried", "leave_used", "leave_forfeit",
+                  "co_carried", "co_used", "co_forfeit"]
+
+@dataclass
+class RolloverReport:
+    kind: str
+    dry_run: bool
+    columns: List[str]
+    rows: List[dict] = field(default_factory=list)
+    applied: int = 0
+
+    def counts(self) -> dict:
+        out = {}
+        for r in self.rows:
+            out[r.get("action", "expire")] = out.get(r.get("action", "expire"), 0) + 1
+        return out
+
+    def write_csv(self) -> str:
+        path = exports._new_path(f"{self.kind}{'-dryrun' if self.dry_run else ''}", ".csv")
+        exports.write_csv(path, self.columns, ([r[c] for c in self.columns] for r in self.rows))
+        return path
+
+def carry_expiry_date(year: int) -> Optional[str]:
+    if CARRY_EXPIRY_MONTHS <= 0:
+        return None
+    month = min(CARRY_EXPIRY_MONTHS, 12)
+    return date(year, month, calendar.monthrange(year, month)[1]).isoformat()
+
+# Rencana rollover per user; dipakai untuk laporan dan untuk INSERT ... SELECT
+_PLAN_CTE = """
+    WITH prev AS (
+        SELECT u.id AS user_id, u.email, u.name, u.division,
+               -- Tanpa kuota tahun sebelumnya (user baru) tidak ada saldo yang dibawa
+               CASE WHEN p.user_id IS NULL THEN 0 ELSE p.leave_total - p.leave_used END AS leave_balance_prev,
+               CASE WHEN p.user_id IS NULL THEN 0 ELSE p.changeoff_earned - p.changeoff_used END AS co_balance_prev,
+               n.id AS target_id, n.rollover_at, n.leave_total AS leave_total_before,
+               n.changeoff_earned AS co_earned_before
+        FROM users u
+        LEFT JOIN quotas p ON p.user_id = u.id AND p.year = :from_year
+        LEFT JOIN quotas n ON n.user_id = u.id AND n.year = :to_year
+    ), plan AS (
+        SELECT prev.*,
+               MIN(:leave_cap, MAX(0, leave_balance_prev)) AS leave_carry,
+               MIN(:co_cap, MAX(0, co_balance_prev)) AS co_carry
+        FROM prev
+    )
+"""
+
+def _plan_params(to_year: int, now: str) -> dict:
+    return {"default": service.DEFAULT_LEAVE_TOTAL, "from_year": to_year - 1, "to_year": to_year,
+            "leave_cap": CARRY_LEAVE_MAX, "co_cap": CARRY_CO_MAX,
+            "expires": carry_expiry_date(to_year), "now": now}
+
+def _report_row(r) -> dict:
+    row = dict(r)
+    if row["rollover_at"]:
+        row["action"] = "skip"
+        row["leave_total_after"], row["co_earned_after"] = row["leave_total_before"], row["co_earned_before"]
+        row["leave_carry"] = row["co_carry"] = 0
+    elif row["target_id"] is None:
+        row["action"] = "create"
+        row["leave_total_after"] = service.DEFAULT_LEAVE_TOTAL + row["leave_carry"]
+        row["co_earned_after"] = row["co_carry"]
+    else:
+        row["action"] = "update"
+        row["leave_total_after"] = row["leave_total_before"] + row["leave_carry"]
+        row["co_earned_after"] = row["co_earned_before"] + row["co_carry"]
+    row["leave_forfeit"] = max(0, row["leave_balance_prev"]) - row["leave_carry"] if row["action"] != "skip" else 0
+    row["co_forfeit"] = max(0, row["co_balance_prev"]) - row["co_carry"] if row["action"] != "skip" else 0
+    return row
+
+def rollover(to_year: int, dry_run: bool = True) -> RolloverReport:
+    """Buat/lengkapi kuota to_year dari saldo to_year-1 untuk semua user."""
+    now = datetime.utcnow().isoformat()
+    params = _plan_params(int(to_year), now)
+    report = RolloverReport("rollover", dry_run, ROLLOVER_COLUMNS)
+    with service.transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(_PLAN_CTE + "SELECT * FROM plan ORDER BY division, name", params)
+        report.rows = [_report_row(r) for r in cur.fetchall()]
+        if dry_run:
+            return report
+        cur.execute(_PLAN_CTE + """
+            INSERT INTO quotas(user_id, year, leave_total, leave_used, changeoff_earned, changeoff_used,
+                               created_at, updated_at, leave_carried, co_carried, carry_expires_on, rollover_at)
+            SELECT user_id, :to_year, :default + leave_carry, 0, co_carry, 0,
+                   :now, :now, leave_carry, co_carry, :expires, :now
+            FROM plan WHERE rollover_at IS NULL
+            ON CONFLICT(user_id, year) DO UPDATE SET
+                leave_total = leave_total + excluded.leave_carried,
+                changeoff_earned = changeoff_earned + excluded.co_carried,
+                leave_carried = excluded.leave_carried,
+                co_carried = excluded.co_carried,
+                carry_expires_on = excluded.carry_expires_on,
+                rollover_at = excluded.rollover_at,
+                updated_at = excluded.updated_at
+            WHERE quotas.rollover_at IS NULL
+        """, params)
+        # rowcount tidak terisi untuk statement yang diawali WITH
+        report.applied = cur.execute("SELECT changes()").fetchone()[0]
+    return report
+
+_EXPIRE_WHERE = """
+    q.carry_expires_on < :today AND q.carry_expired_at IS NULL AND (q.leave_carried > 0 OR q.co_carried > 0)
+"""
+
+def expire_carry_over(today: Optional[date] = None, dry_run: bool = True) -> RolloverReport:
+    """Hanguskan sisa carry-over yang lewat carry_expires_on (carry dianggap terpakai lebih dulu)."""
+    params = {"today": (today or date.today()).isoformat(), "now": datetime.utcnow().isoformat()}
+    report = RolloverReport("carry-expiry", dry_run, EXPIRY_COLUMNS)
+    with service.transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(f"""
+            SELECT q.user_id, u.email, u.name, q.year, q.leave_carried, q.leave_used,
+                   MAX(0, q.leave_carried - q.leave_used) AS leave_forfeit,
+                   q.co_carried, q.changeoff_used AS co_used,
+                   MAX(0, q.co_carried - q.changeoff_used) AS co_forfeit
+            FROM quotas q JOIN users u ON u.id = q.user_id
+            WHERE {_EXPIRE_WHERE}
+            ORDER BY u.name
+        """, params)
+        report.rows = [dict(r) for r in cur.fetchall()]
+        if dry_run:
+            return report
+        cur.execute(f"""
+            UPDATE quotas AS q SET
+                leave_total = leave_total - MAX(0, leave_carried - leave_used),
+                changeoff_earned = changeoff_earned - MAX(0, co_carried - changeoff_used),
+                carry_expired_at = :now,
+                updated_at = :now
+            WHERE {_EXPIRE_WHERE}
+        """, params)
+        report.applied = cur.rowcount
+    return report
+
+def run_scheduled(today: Optional[date] = None) -> List[RolloverReport]:
+    """Untuk cron harian: rollover ke tahun berjalan lalu hanguskan carry yang kedaluwarsa."""
+    today = today or date.today()
+    return [rollover(today.year, dry_run=False), expire_carry_over(today, dry_run=False)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRMS quota rollover")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_roll = sub.add_parser("rollover", help="Buat kuota tahun baru dengan carry-over")
+    p_roll.add_argument("--to-year", type=int, default=date.today().year)
+    p_roll.add_argument("--dry-run", action="store_true")
+    p_exp = sub.add_parser("expire", help="Hanguskan carry-over yang kedaluwarsa")
+    p_exp.add_argument("--dry-run", action="store_true")
+    sub.add_parser("auto", help="rollover tahun berjalan + expire (idempoten, untuk cron)")
+    args = parser.parse_args(argv)
+    service.init_db()
+    if args.command == "rollover":
+        reports = [rollover(args.to_year, dry_run=args.dry_run)]
+    elif args.command == "expire":
+        reports = [expire_carry_over(dry_run=args.dry_run)]
+    else:
+        reports = run_scheduled()
+    for report in reports:
+        path = report.write_csv()
+        print(f"{report.kind}: {report.counts()} applied={report.applied} dry_run={report.dry_run} report={path}",
+              file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1970 @@
+"""Service layer HRMS: database, user, kuota, lifecycle request, dan file.
+
+Tidak ada dependensi ke Streamlit di modul ini. Error bisnis dilempar sebagai
+ServiceError (pesannya aman untuk ditampilkan ke user), sehingga fungsi yang
+sama bisa dipanggil dari UI, API, CLI, maupun worker/process pool.
+"""
+import os
+import json
+import uuid
+import atexit
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime, date, timedelta
+from typing import Optional, List, Tuple
+
+import pandas as pd
+
+import dbtrace
+import metrics
+import passwords
+
+# -------------------- Konfigurasi --------------------
+DB_PATH = os.environ.get("HRMS_DB_PATH", "data/hrms.db")
+# "file" (default) atau "memory": database in-memory shared-cache, hidup selama proses berjalan
+DB_MODE = os.environ.get("HRMS_DB_MODE", "file").strip().lower()
+MEMORY_DB_NAME = os.environ.get("HRMS_MEMORY_DB_NAME", "hrms_mem")
+MEMORY_SNAPSHOT_PATH = os.environ.get("HRMS_MEMORY_SNAPSHOT", "")  # kosong = tanpa snapshot ke disk
+UPLOAD_DIR = os.environ.get("HRMS_UPLOAD_DIR", "uploads")
+# File SQLite terpisah untuk request lama yang sudah closed (lihat archive.py); di-ATTACH saat membaca riwayat
+ARCHIVE_PATH = os.environ.get("HRMS_ARCHIVE_PATH") or os.path.join(os.path.dirname(DB_PATH), "hrms_archive.db")
+# "reject" (default): tanggal bentrok dengan request aktif milik user yang sama ditolak; "warn": tetap disimpan + peringatan
+OVERLAP_POLICY = os.environ.get("HRMS_OVERLAP_POLICY", "reject").strip().lower()
+# Peringatan jika porsi tim yang off di salah satu hari >= rasio ini
+TEAM_ABSENCE_WARN_RATIO = float(os.environ.get("HRMS_TEAM_ABSENCE_WARN_RATIO", 0.5))
+# Request yang menunggu di satu antrian approval lebih lama dari ini ditandai di halaman Approval Latency
+APPROVAL_SLA_HOURS = float(os.environ.get("HRMS_APPROVAL_SLA_HOURS", 48))
+# Notifikasi email dikirim paling cepat sekian detik setelah perubahan pertama, supaya perubahan
+# berdekatan untuk penerima yang sama tergabung dalam satu digest (lihat notifications.py)
+NOTIFY_COALESCE_SECONDS = float(os.environ.get("HRMS_NOTIFY_COALESCE_SECONDS", 60))
+DEFAULT_LEAVE_TOTAL = int(os.environ.get("HRMS_DEFAULT_LEAVE_TOTAL", 12))
+
+ROLES = ("EMPLOYEE", "MANAGER", "HR_ADMIN")
+STATUSES = ("PENDING_MANAGER", "PENDING_HR", "APPROVED", "REJECTED")
+LEAVE_REASONS = ("PERSONAL", "SAKIT", "CHANGEOFF")
+JOB_STATUSES = ("QUEUED", "RUNNING", "DONE", "FAILED", "CANCELLED")
+
+# -------------------- Exceptions --------------------
+class ServiceError(Exception):
+    """Error bisnis; pesannya ditujukan untuk user akhir."""
+
+class DatabaseUnavailable(ServiceError):
+    pass
+
+class NotFound(ServiceError, ValueError):
+    pass
+
+class NotAuthorized(ServiceError, PermissionError):
+    pass
+
+class InvalidState(ServiceError, ValueError):
+    pass
+
+class ValidationError(ServiceError, ValueError):
+    pass
+
+class InsufficientBalance(ServiceError, ValueError):
+    pass
+
+class ManagerNotAssigned(ServiceError):
+    pass
+
+class OverlapConflict(ValidationError):
+    pass
+
+class DuplicateEmail(ServiceError, ValueError):
+    pass
+
+# -------------------- Result objects --------------------
+@dataclass(frozen=True)
+class User:
+    id: int
+    email: str
+    name: str
+    role: str
+    manager_id: Optional[int]
+    division: Optional[str]
+    created_at: str
+    updated_at: str
+
+    @classmethod
+    def from_row(cls, row) -> "User":
+        return cls(id=int(row["id"]), email=row["email"], name=row["name"], role=row["role"],
+                   manager_id=row["manager_id"], division=row["division"],
+                   created_at=row["created_at"], updated_at=row["updated_at"])
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+@dataclass(frozen=True)
+class Quota:
+    user_id: int
+    year: int
+    leave_total: int
+    leave_used: int
+    changeoff_earned: int
+    changeoff_used: int
+    leave_carried: int = 0
+    co_carried: int = 0
+    carry_expires_on: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row) -> "Quota":
+        return cls(user_id=int(row["user_id"]), year=int(row["year"]),
+                   leave_total=int(row["leave_total"]), leave_used=int(row["leave_used"]),
+                   changeoff_earned=int(row["changeoff_earned"]), changeoff_used=int(row["changeoff_used"]),
+                   leave_carried=int(row["leave_carried"] or 0), co_carried=int(row["co_carried"] or 0),
+                   carry_expires_on=row["carry_expires_on"])
+
+    @property
+    def leave_balance(self) -> int:
+        return self.leave_total - self.leave_used
+
+    @property
+    def co_balance(self) -> int:
+        return self.changeoff_earned - self.changeoff_used
+
+    def as_dict(self) -> dict:
+        return {
+            "year": self.year,
+            "leave_total": self.leave_total,
+            "leave_used": self.leave_used,
+            "leave_balance": self.leave_balance,
+            "co_earned": self.changeoff_earned,
+            "co_used": self.changeoff_used,
+            "co_balance": self.co_balance,
+            "leave_carried": self.leave_carried,
+            "co_carried": self.co_carried,
+            "carry_expires_on": self.carry_expires_on,
+        }
+
+@dataclass(frozen=True)
+class SubmitResult:
+    request_id: int
+    message: str
+    warnings: tuple = ()
+
+# -------------------- DB Helpers --------------------
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS users(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    role TEXT NOT NULL CHECK(role IN ('EMPLOYEE','MANAGER','HR_ADMIN')),
+    manager_id INTEGER,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    division TEXT,
+    FOREIGN KEY(manager_id) REFERENCES users(id)
+);
+CREATE TABLE IF NOT EXISTS quotas(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    leave_total INTEGER NOT NULL DEFAULT 12,
+    leave_used INTEGER NOT NULL DEFAULT 0,
+    changeoff_earned INTEGER NOT NULL DEFAULT 0,
+    changeoff_used INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    leave_carried INTEGER NOT NULL DEFAULT 0,
+    co_carried INTEGER NOT NULL DEFAULT 0,
+    carry_expires_on TEXT,
+    carry_expired_at TEXT,
+    rollover_at TEXT,
+    UNIQUE(user_id, year),
+    FOREIGN KEY(user_id) REFERENCES users(id)
+);
+CREATE TABLE IF NOT EXISTS requests(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    type TEXT NOT NULL CHECK(type IN ('LEAVE','CHANGEOFF')),
+    start_date TEXT,
+    end_date TEXT,
+    single_date TEXT,
+    hours INTEGER,
+    reason TEXT,
+    status TEXT NOT NULL CHECK(status IN ('PENDING_MANAGER','PENDING_HR','APPROVED','REJECTED')),
+    manager_by INTEGER,
+    manager_at TEXT,
+    hr_by INTEGER,
+    hr_at TEXT,
+    timesheet_path TEXT,
+    location TEXT,
+    activity TEXT,
+    pic TEXT,
+    job_execution TEXT,
+    payload_json TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    file_uploaded BOOLEAN DEFAULT 0,
+    activity_start_time TEXT,
+    activity_end_time TEXT,
+    departure_date TEXT,
+    return_date TEXT,
+    activities_json TEXT,
+    FOREIGN KEY(user_id) REFERENCES users(id),
+    FOREIGN KEY(manager_by) REFERENCES users(id),
+    FOREIGN KEY(hr_by) REFERENCES users(id)
+);
+CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status, id);
+CREATE INDEX IF NOT EXISTS idx_requests_user ON requests(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_users_manager ON users(manager_id);
+CREATE TABLE IF NOT EXISTS usage_summary(
+    division TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    status TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    days INTEGER NOT NULL DEFAULT 0,
+    hours REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY(division, year, month, type, reason, status)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_usage_summary_period ON usage_summary(year, month);
+CREATE TABLE IF NOT EXISTS schema_backfills(
+    name TEXT PRIMARY KEY,
+    done_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS org_closure(
+    ancestor INTEGER NOT NULL,
+    descendant INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY(ancestor, descendant)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_org_closure_descendant ON org_closure(descendant, ancestor, depth);
+CREATE TABLE IF NOT EXISTS request_events(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    from_status TEXT,
+    to_status TEXT NOT NULL,
+    actor_id INTEGER,
+    at TEXT NOT NULL,
+    backfilled INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_request_events_request ON request_events(request_id, at, id);
+CREATE INDEX IF NOT EXISTS idx_request_events_at ON request_events(at);
+CREATE TRIGGER IF NOT EXISTS request_events_no_update BEFORE UPDATE ON request_events
+BEGIN SELECT RAISE(ABORT, 'request_events hanya boleh ditambah (append-only)'); END;
+CREATE TRIGGER IF NOT EXISTS request_events_no_delete BEFORE DELETE ON request_events
+BEGIN SELECT RAISE(ABORT, 'request_events hanya boleh ditambah (append-only)'); END;
+CREATE TABLE IF NOT EXISTS maintenance_runs(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT NOT NULL,
+    trigger TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    duration_ms INTEGER NOT NULL,
+    page_size INTEGER,
+    page_count INTEGER,
+    freelist_before INTEGER,
+    freelist_after INTEGER,
+    auto_vacuum TEXT,
+    journal_mode TEXT,
+    wal_frames INTEGER,
+    analyzed INTEGER NOT NULL DEFAULT 0,
+    stat_indexes INTEGER,
+    unanalyzed_indexes INTEGER,
+    quick_check TEXT,
+    steps_json TEXT
+);
+CREATE TABLE IF NOT EXISTS jobs(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload_json TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL CHECK(status IN ('QUEUED','RUNNING','DONE','FAILED','CANCELLED')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after TEXT NOT NULL,
+    dedupe_key TEXT,
+    lease_token TEXT,
+    lease_until TEXT,
+    worker TEXT,
+    progress_done INTEGER,
+    progress_total INTEGER,
+    result_json TEXT,
+    error TEXT,
+    created_by INTEGER,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_after, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key, status) WHERE dedupe_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_jobs_kind ON jobs(kind, id);
+CREATE TABLE IF NOT EXISTS notification_outbox(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    request_id INTEGER,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'PENDING' CHECK(status IN ('PENDING','SENDING','SENT','FAILED','SKIPPED')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claim_token TEXT,
+    claimed_at TEXT,
+    digest_id TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON notification_outbox(status, recipient_id, id);
+"""
+
+# Rentang tanggal request lintas tipe. Query overlap harus memakai ekspresi
+# dan kondisi yang persis sama supaya idx_requests_user_span terpakai.
+SPAN_START_SQL = "COALESCE(start_date, departure_date)"
+SPAN_END_SQL = "COALESCE(end_date, return_date)"
+ACTIVE_SQL = "status <> 'REJECTED'"
+
+# Full-text search request (FTS5). rowid = requests.id; kolom "activities" berisi
+# gabungan deskripsi 'aktivitas' per hari dari activities_json. Index dijaga
+# oleh trigger sehingga selalu sinkron dengan tabel requests.
+SEARCH_COLUMNS = ("location", "pic", "job_execution", "reason", "activity", "activities")
+SEARCH_WEIGHTS = (4.0, 3.0, 2.0, 2.0, 1.0, 1.0)  # bobot bm25 per kolom, urutan = SEARCH_COLUMNS
+SEARCH_PAGE_SIZE = 20
+_SEARCH_SCHEMA_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5(
+    {", ".join(SEARCH_COLUMNS)},
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+"""
+
+def _search_doc_sql(alias: str) -> str:
+    """Ekspresi kolom requests_fts (urutan SEARCH_COLUMNS) dari baris requests {alias}."""
+    activities = (f"CASE WHEN json_valid({alias}.activities_json) AND json_type({alias}.activities_json) = 'array' "
+                  f"THEN (SELECT group_concat(json_extract(value, '$.aktivitas'), ' ') "
+                  f"FROM json_each({alias}.activities_json) WHERE type = 'object') END")
+    return (f"{alias}.location, {alias}.pic, {alias}.job_execution, {alias}.reason, "
+            f"{alias}.activity, {activities}")
+
+_SEARCH_TRIGGERS_SQL = f"""
+CREATE TRIGGER IF NOT EXISTS requests_fts_ai AFTER INSERT ON requests BEGIN
+    INSERT INTO requests_fts(rowid, {", ".join(SEARCH_COLUMNS)}) VALUES (new.id, {_search_doc_sql("new")});
+END;
+CREATE TRIGGER IF NOT EXISTS requests_fts_ad AFTER DELETE ON requests BEGIN
+    DELETE FROM requests_fts WHERE rowid = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS requests_fts_au
+AFTER UPDATE OF location, pic, job_execution, reason, activity, activities_json ON requests BEGIN
+    DELETE FROM requests_fts WHERE rowid = old.id;
+    INSERT INTO requests_fts(rowid, {", ".join(SEARCH_COLUMNS)}) VALUES (new.id, {_search_doc_sql("new")});
+END;
+"""
+
+# None = FTS5 siap; selain itu alasan search tidak tersedia (mis. SQLite tanpa FTS5)
+_search_unavailable_reason: Optional[str] = None
+
+# Alasan fallback ke in-memory database (None = memakai file DB_PATH)
+_memory_fallback_reason: Optional[str] = None
+
+# Koneksi "jangkar" yang dipegang proses: database in-memory shared-cache
+# hanya hidup selama masih ada minimal satu koneksi terbuka ke URI-nya.
+_memory_lock = threading.Lock()
+_memory_anchor: Optional[sqlite3.Connection] = None
+
+def memory_fallback_reason() -> Optional[str]:
+    return _memory_fallback_reason
+
+def is_memory_db() -> bool:
+    return DB_MODE == "memory" or _memory_fallback_reason is not None
+
+def _connect(target: str, **kwargs) -> sqlite3.Connection:
+    conn = sqlite3.connect(target, check_same_thread=False, factory=dbtrace.connection_factory(), **kwargs)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA foreign_keys = ON;")
+    except Exception:
+        pass
+    return conn
+
+def _memory_uri() -> str:
+    return f"file:{MEMORY_DB_NAME}?mode=memory&cache=shared"
+
+def _memory_conn() -> sqlite3.Connection:
+    """Koneksi ke database in-memory shared-cache; jangkar dibuat sekali per proses."""
+    global _memory_anchor
+    with _memory_lock:
+        if _memory_anchor is None:
+            anchor = _connect(_memory_uri(), uri=True)
+            if MEMORY_SNAPSHOT_PATH and os.path.exists(MEMORY_SNAPSHOT_PATH):
+                src = sqlite3.connect(MEMORY_SNAPSHOT_PATH)
+                try:
+                    src.backup(anchor)
+                finally:
+                    src.close()
+            init_schema(anchor)
+            _memory_anchor = anchor
+            if MEMORY_SNAPSHOT_PATH:
+                atexit.register(_snapshot_at_exit)
+    return _connect(_memory_uri(), uri=True)
+
+def use_memory_db(name: Optional[str] = None) -> sqlite3.Connection:
+    """Aktifkan mode in-memory saat runtime (mis. untuk test/benchmark).
+
+    Nama berbeda = database terpisah (tanpa restore/snapshot HRMS_MEMORY_SNAPSHOT);
+    kembalikan koneksi baru ke database tersebut.
+    """
+    global DB_MODE, MEMORY_DB_NAME, MEMORY_SNAPSHOT_PATH, _memory_anchor
+    with _memory_lock:
+        if name and name != MEMORY_DB_NAME:
+            MEMORY_DB_NAME = name
+            MEMORY_SNAPSHOT_PATH = ""
+            if _memory_anchor is not None:
+                # Jangkar terakhir yang ditutup membebaskan database in-memory lama
+                _memory_anchor.close()
+            _memory_anchor = None
+        DB_MODE = "memory"
+    return _memory_conn()
+
+def snapshot_memory_db(path: Optional[str] = None) -> str:
+    """Salin database in-memory ke file lewat sqlite3 backup API (tulis atomik)."""
+    path = path or MEMORY_SNAPSHOT_PATH
+    if not path:
+        raise ValidationError("Path snapshot belum diatur (HRMS_MEMORY_SNAPSHOT).")
+    if _memory_anchor is None:
+        raise InvalidState("Database in-memory belum aktif.")
+    snap_dir = os.path.dirname(path)
+    if snap_dir:
+        os.makedirs(snap_dir, exist_ok=True)
+    tmp = f"{path}.tmp"
+    dest = sqlite3.connect(tmp)
+    try:
+        _memory_anchor.backup(dest)
+    finally:
+        dest.close()
+    os.replace(tmp, path)
+    return path
+
+def _snapshot_at_exit():
+    if MEMORY_SNAPSHOT_PATH and _memory_anchor is not None:
+        snapshot_memory_db()
+
+def get_conn() -> sqlite3.Connection:
+    global _memory_fallback_reason
+    if DB_MODE == "memory":
+        return _memory_conn()
+    try:
+        # Pastikan directory untuk database exists
+        db_dir = os.path.dirname(DB_PATH)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        conn = _connect(DB_PATH)
+        _memory_fallback_reason = None
+        return conn
+    except (sqlite3.OperationalError, OSError) as e:
+        # Fallback ke in-memory database untuk emergency; memakai database
+        # shared-cache yang sama sehingga data bertahan antar pemanggilan
+        _memory_fallback_reason = str(e)
+        return _memory_conn()
+
+@contextmanager
+def transaction():
+    """Satu koneksi + satu transaksi: commit jika sukses, rollback jika error."""
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        yield cur
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, col_def: str):
+    cur = conn.cursor()
+    cur.execute(f"PRAGMA table_info({table})")
+    cols = [r["name"] for r in cur.fetchall()]
+    if column not in cols:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_def};")
+        conn.commit()
+
+def _seed_defaults(cur: sqlite3.Cursor):
+    cur.execute("SELECT COUNT(1) AS c FROM users;")
+    if cur.fetchone()["c"] != 0:
+        return
+    now = datetime.utcnow().isoformat()
+    pw = hash_pw("password")
+    cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
+                   VALUES(?,?,?,?,?,?,?,?)""",
+                ("manager@example.com", "Manager One", "MANAGER", None, pw, now, now, "Engineering"))
+    manager_id = cur.lastrowid
+    _closure_insert(cur, manager_id, None)
+    cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
+                   VALUES(?,?,?,?,?,?,?,?)""",
+                ("employee@example.com", "Employee One", "EMPLOYEE", manager_id, pw, now, now, "Engineering"))
+    emp_id = cur.lastrowid
+    _closure_insert(cur, emp_id, manager_id)
+    cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
+                   VALUES(?,?,?,?,?,?,?,?)""",
+                ("hr@example.com", "HR Admin", "HR_ADMIN", None, pw, now, now, "Human Resources"))
+    _closure_insert(cur, cur.lastrowid, None)
+    cur.execute("""INSERT OR IGNORE INTO quotas(user_id,year,leave_total,leave_used,changeoff_earned,changeoff_used,created_at,updated_at,
+                                                rollover_at)
+                   VALUES(?,?,?,?,?,?,?,?,?)""",
+                (emp_id, datetime.utcnow().year, DEFAULT_LEAVE_TOTAL, 0, 0, 0, now, now, now))
+
+def init_schema(conn: sqlite3.Connection):
+    """Buat tabel, jalankan migrasi kolom, dan seed user default jika kosong."""
+    global _request_columns_cache, _archive_schema_synced
+    existing_tables = {r["name"] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    if not existing_tables:
+        # Database baru: halaman kosong bisa diklaim ulang tanpa VACUUM penuh (lihat maintenance.py).
+        # Database lama dikonversi sekali oleh maintenance karena butuh VACUUM.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL (persisten di file database): pembaca, termasuk snapshot backup.py yang menahan
+    # read transaction, tidak memblokir penulis. Database in-memory tetap "memory".
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA_SQL)
+    add_column_if_missing(conn, "users", "division", "TEXT")
+    add_column_if_missing(conn, "requests", "activities_json", "TEXT")
+    add_column_if_missing(conn, "requests", "file_uploaded", "BOOLEAN DEFAULT 0")
+    add_column_if_missing(conn, "requests", "activity_start_time", "TEXT")
+    add_column_if_missing(conn, "requests", "activity_end_time", "TEXT")
+    add_column_if_missing(conn, "requests", "departure_date", "TEXT")
+    add_column_if_missing(conn, "requests", "return_date", "TEXT")
+    # Carry-over saldo tahun sebelumnya (lihat rollover.py); sudah termasuk di leave_total/changeoff_earned
+    add_column_if_missing(conn, "quotas", "leave_carried", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "quotas", "co_carried", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "quotas", "carry_expires_on", "TEXT")
+    add_column_if_missing(conn, "quotas", "carry_expired_at", "TEXT")
+    add_column_if_missing(conn, "quotas", "rollover_at", "TEXT")
+    # Index rentang tanggal request aktif (LEAVE: start/end, CHANGEOFF: departure/return);
+    # dibuat setelah migrasi karena memakai kolom departure_date/return_date
+    conn.execute(f"""CREATE INDEX IF NOT EXISTS idx_requests_user_span
+                     ON requests(user_id, {SPAN_START_SQL}, {SPAN_END_SQL}) WHERE {ACTIVE_SQL}""")
+    _init_search(conn)
+    # Kolom requests bisa berubah karena migrasi di atas: hitung ulang daftar kolom untuk arsip
+    _request_columns_cache, _archive_schema_synced = None, False
+    cur = conn.cursor()
+    _seed_defaults(cur)
+    _run_backfills(cur)
+    conn.commit()
+
+def _run_backfills(cur: sqlite3.Cursor):
+    """Isi tabel turunan dari data yang sudah ada (database lama), sekali per tabel.
+
+    Penanda di schema_backfills ditulis di transaksi yang sama dengan backfill-nya:
+    backfill yang gagal di tengah ikut di-rollback dan diulang di init berikutnya.
+    Semua backfill idempotent, jadi database dari sebelum tabel penanda ada cukup diisi ulang.
+    """
+    if not cur.connection.in_transaction:
+        cur.execute("BEGIN")
+    done = {r["name"] for r in cur.execute("SELECT name FROM schema_backfills")}
+    backfills = [("usage_summary", _rebuild_usage_summary), ("org_closure", _rebuild_org_closure),
+                 ("request_events", _backfill_request_events)]
+    if _search_unavailable_reason is None:
+        backfills.append(("requests_fts", _rebuild_search_index))
+    for name, backfill in backfills:
+        if name in done:
+            continue
+        backfill(cur)
+        cur.execute("INSERT INTO schema_backfills(name, done_at) VALUES(?,?)", (name, datetime.utcnow().isoformat()))
+
+def init_db():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    conn = get_conn()
+    try:
+        init_schema(conn)
+    except sqlite3.Error as e:
+        raise DatabaseUnavailable(f"Gagal inisialisasi database: {e}") from e
+    finally:
+        conn.close()
+
+# -------------------- Auth --------------------
+def hash_pw(pw: str) -> str:
+    """Hash password ber-salt untuk disimpan di users.password_hash (lihat passwords.py)."""
+    return passwords.hash_password(pw)
+
+_dummy_hash: Optional[str] = None
+
+def _rehash_password(user_id: int, old_hash: str, password: str):
+    """Ganti hash lama/parameter usang dengan hash baru; gagal tidak membatalkan login."""
+    try:
+        with transaction() as cur:
+            # Kondisi password_hash lama: jangan timpa password yang baru saja diganti di sesi lain
+            cur.execute("UPDATE users SET password_hash=? WHERE id=? AND password_hash=?",
+                        (hash_pw(password), user_id, old_hash))
+        metrics.PASSWORD_REHASHES.inc(scheme=passwords.scheme_of(old_hash))
+    except (sqlite3.Error, ServiceError):
+        pass
+
+def login(email: str, password: str) -> Optional[User]:
+    global _dummy_hash
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM users WHERE email=?", (email,))
+        row = cur.fetchone()
+    except sqlite3.OperationalError as e:
+        raise DatabaseUnavailable(f"Login error: {e}") from e
+    finally:
+        conn.close()
+    if not row:
+        # Tetap hitung satu hash agar waktu respons tidak membocorkan email mana yang terdaftar
+        _dummy_hash = _dummy_hash or hash_pw(uuid.uuid4().hex)
+        passwords.verify_password(password, _dummy_hash)
+        metrics.LOGINS.inc(role="UNKNOWN", outcome="failure")
+        return None
+    if not passwords.verify_password(password, row["password_hash"]):
+        metrics.LOGINS.inc(role=row["role"], outcome="failure")
+        return None
+    if passwords.needs_rehash(row["password_hash"]):
+        _rehash_password(row["id"], row["password_hash"], password)
+    metrics.LOGINS.inc(role=row["role"], outcome="success")
+    return User.from_row(row)
+
+def password_hash_summary() -> pd.DataFrame:
+    """Jumlah user per skema hash password dan berapa yang akan di-rehash saat login berikutnya."""
+    conn = get_conn()
+    try:
+        hashes = [r["password_hash"] for r in conn.execute("SELECT password_hash FROM users")]
+    finally:
+        conn.close()
+    df = pd.DataFrame({"scheme": [passwords.scheme_of(h) for h in hashes],
+                       "needs_rehash": [passwords.needs_rehash(h) for h in hashes]})
+    if df.empty:
+        return pd.DataFrame(columns=["scheme", "users", "needs_rehash"])
+    return (df.groupby("scheme").agg(users=("needs_rehash", "size"), needs_rehash=("needs_rehash", "sum"))
+              .reset_index().sort_values("users", ascending=False))
+
+def current_year() -> int:
+    return date.today().year
+
+# -------------------- Users --------------------
+def get_user(user_id: int) -> Optional[User]:
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM users WHERE id=?", (user_id,))
+    row = cur.fetchone()
+    conn.close()
+    return User.from_row(row) if row else None
+
+def get_manager_for_user(user_id: int) -> Optional[User]:
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT m.*
+        FROM users u
+        JOIN users m ON m.id = u.manager_id
+        WHERE u.id = ?
+    """, (user_id,))
+    row = cur.fetchone()
+    conn.close()
+    return User.from_row(row) if row else None
+
+def check_manager_assigned(user_id: int) -> User:
+    """Pastikan user punya manager dengan role MANAGER; lempar ManagerNotAssigned jika tidak."""
+    mgr = get_manager_for_user(user_id)
+    if not mgr:
+        raise ManagerNotAssigned("Akun Anda belum memiliki Manager yang ditetapkan. Hubungi HR untuk mengatur Manager terlebih dahlu.")
+    if mgr.role != "MANAGER":
+        raise ManagerNotAssigned(f"Manager yang ditetapkan adalah {mgr.name} ({mgr.email}) tetapi rolenya {mgr.role}. HR perlu memperbaiki.")
+    return mgr
+
+def list_users() -> pd.DataFrame:
+    conn = get_conn()
+    df = pd.read_sql_query("""
+        SELECT u.id, u.email, u.name, u.role, u.manager_id, u.division, m.name as manager_name, u.created_at
+        FROM users u LEFT JOIN users m ON m.id = u.manager_id
+        ORDER BY u.created_at DESC
+    """, conn)
+    conn.close()
+    return df
+
+def list_managers() -> pd.DataFrame:
+    conn = get_conn()
+    df = pd.read_sql_query("SELECT id, name, email FROM users WHERE role='MANAGER' ORDER by name", conn)
+    conn.close()
+    return df
+
+def _validate_user(email: str, name: str, role: str):
+    if not email or not name:
+        raise ValidationError("Email dan Nama wajib diisi.")
+    if role not in ROLES:
+        raise ValidationError(f"Role tidak valid: {role}")
+
+def create_user(email: str, name: str, role: str, password: str, manager_id: Optional[int], division: Optional[str]) -> int:
+    _validate_user(email, name, role)
+    if not password:
+        raise ValidationError("Password wajib diisi.")
+    now = datetime.utcnow().isoformat()
+    try:
+        with transaction() as cur:
+            cur.execute("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
+                           VALUES(?,?,?,?,?,?,?,?)""",
+                        (email, name, role, manager_id, hash_pw(password), now, now, division))
+            user_id = cur.lastrowid
+            _closure_insert(cur, user_id, manager_id)
+            return user_id
+    except sqlite3.IntegrityError as e:
+        raise DuplicateEmail("Email sudah digunakan.") from e
+
+def update_user(user_id: int, email: str, name: str, role: str, manager_id: Optional[int], new_password: Optional[str], division: Optional[str]):
+    _validate_user(email, name, role)
+    if manager_id is not None and int(manager_id) == int(user_id):
+        raise ValidationError("User tidak bisa menjadi manager untuk dirinya sendiri.")
+    now = datetime.utcnow().isoformat()
+    try:
+        with transaction() as cur:
+            cur.execute("SELECT division, manager_id FROM users WHERE id=?", (user_id,))
+            row = cur.fetchone()
+            division_changed = row is not None and (row["division"] or None) != (division or None)
+            if row is not None and row["manager_id"] != manager_id:
+                _closure_move(cur, user_id, manager_id)
+            if division_changed:
+                _summary_apply_user(cur, user_id, -1)
+            if new_password:
+                cur.execute("""UPDATE users SET email=?, name=?, role=?, manager_id=?, password_hash=?, division=?, updated_at=?
+                               WHERE id=?""",
+                            (email, name, role, manager_id, hash_pw(new_password), division, now, user_id))
+            else:
+                cur.execute("""UPDATE users SET email=?, name=?, role=?, manager_id=?, division=?, updated_at=?
+                               WHERE id=?""",
+                            (email, name, role, manager_id, division, now, user_id))
+            if division_changed:
+                _summary_apply_user(cur, user_id, +1)
+    except sqlite3.IntegrityError as e:
+        raise DuplicateEmail("Email sudah digunakan user lain.") from e
+
+def delete_user(user_id: int):
+    with transaction() as cur:
+        cur.execute("SELECT 1 FROM requests WHERE user_id=? LIMIT 1", (user_id,))
+        if cur.fetchone():
+            raise InvalidState("Tidak bisa hapus user: masih ada request sebagai pemilik. Hapus/arsipkan dulu request-nya.")
+        cur.execute("SELECT 1 FROM quotas WHERE user_id=? LIMIT 1", (user_id,))
+        if cur.fetchone():
+            raise InvalidState("Tidak bisa hapus user: masih ada kuota terkait. Hapus kuotanya dulu.")
+        cur.execute("SELECT id FROM users WHERE manager_id=?", (user_id,))
+        for report_id in [r["id"] for r in cur.fetchall()]:
+            _closure_move(cur, report_id, None)
+        cur.execute("DELETE FROM org_closure WHERE ancestor=? OR descendant=?", (user_id, user_id))
+        cur.execute("UPDATE users SET manager_id=NULL WHERE manager_id=?", (user_id,))
+        cur.execute("UPDATE requests SET manager_by=NULL WHERE manager_by=?", (user_id,))
+        cur.execute("UPDATE requests SET hr_by=NULL WHERE hr_by=?", (user_id,))
+        cur.execute("DELETE FROM users WHERE id=?", (user_id,))
+
+# -------------------- Org hierarchy (closure table) --------------------
+# org_closure berisi satu baris per pasangan (atasan, bawahan) di semua level,
+# termasuk baris diri sendiri (depth 0). Subtree seorang manager cukup dibaca
+# dengan join ke org_closure WHERE ancestor = ? (PK), tanpa rekursi di Python.
+def _closure_insert(cur: sqlite3.Cursor, user_id: int, manager_id: Optional[int]):
+    cur.execute("INSERT OR IGNORE INTO org_closure(ancestor, descendant, depth) VALUES(?,?,0)", (user_id, user_id))
+    if manager_id is not None:
+        cur.execute("""INSERT OR IGNORE INTO org_closure(ancestor, descendant, depth)
+                       SELECT ancestor, ?, depth + 1 FROM org_closure WHERE descendant = ?""", (user_id, manager_id))
+
+def _closure_move(cur: sqlite3.Cursor, user_id: int, new_manager_id: Optional[int]):
+    """Pindahkan subtree user_id ke bawah new_manager_id (None = jadi root)."""
+    if new_manager_id is not None:
+        cur.execute("SELECT 1 FROM org_closure WHERE ancestor=? AND descendant=?", (user_id, new_manager_id))
+        if cur.fetchone():
+            raise ValidationError("Manager tidak boleh berasal dari bawahan user ini sendiri (hierarki melingkar).")
+    # Putus hubungan subtree dengan semua atasan lama di luar subtree
+    cur.execute("""DELETE FROM org_closure
+                   WHERE descendant IN (SELECT descendant FROM org_closure WHERE ancestor = :u)
+                     AND ancestor NOT IN (SELECT descendant FROM org_closure WHERE ancestor = :u)""",
+                {"u": user_id})
+    if new_manager_id is not None:
+        cur.execute("""INSERT INTO org_closure(ancestor, descendant, depth)
+                       SELECT sup.ancestor, sub.descendant, sup.depth + sub.depth + 1
+                       FROM org_closure sup CROSS JOIN org_closure sub
+                       WHERE sup.descendant = ? AND sub.ancestor = ?""", (new_manager_id, user_id))
+
+def _rebuild_org_closure(cur: sqlite3.Cursor) -> int:
+    cur.execute("DELETE FROM org_closure")
+    # UNION (bukan UNION ALL) supaya data manager_id yang melingkar tidak membuat rekursi tanpa akhir
+    cur.execute("""
+        WITH RECURSIVE tree(ancestor, descendant, depth) AS (
+            SELECT id, id, 0 FROM users
+            UNION
+            SELECT t.ancestor, u.id, t.depth + 1
+            FROM tree t JOIN users u ON u.manager_id = t.descendant
+            WHERE t.depth < 64
+        )
+        INSERT OR IGNORE INTO org_closure(ancestor, descendant, depth)
+        SELECT ancestor, descendant, MIN(depth) FROM tree GROUP BY ancestor, descendant
+    """)
+    cur.execute("SELECT COUNT(1) AS c FROM org_closure")
+    return cur.fetchone()["c"]
+
+def rebuild_org_closure() -> int:
+    """Hitung ulang org_closure dari users.manager_id; kembalikan jumlah baris."""
+    with transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        return _rebuild_org_closure(cur)
+
+def team_scope_sql(include_subtree: bool, user_alias: str = "u") -> Tuple[str, str]:
+    """(JOIN, WHERE) untuk membatasi user ke tim seorang manager; parameter WHERE = manager_id.
+
+    include_subtree=False: bawahan langsung (users.manager_id).
+    include_subtree=True: semua level di bawahnya lewat org_closure.
+    """
+    if include_subtree:
+        return (f"JOIN org_closure oc ON oc.descendant = {user_alias}.id",
+                "oc.ancestor = ? AND oc.depth >= 1")
+    return "", f"{user_alias}.manager_id = ?"
+
+def has_indirect_reports(manager_id: int) -> bool:
+    conn = get_conn()
+    try:
+        return conn.execute("SELECT 1 FROM org_closure WHERE ancestor=? AND depth >= 2 LIMIT 1",
+                            (manager_id,)).fetchone() is not None
+    finally:
+        conn.close()
+
+# -------------------- Quota --------------------
+# rollover_at untuk kuota yang dibuat lazy: tanpa kuota tahun sebelumnya (user baru) tidak ada
+# saldo yang bisa dibawa, jadi baris langsung ditandai sudah di-rollover dan dilewati rollover.py
+_NEW_QUOTA_ROLLOVER_SQL = "CASE WHEN EXISTS(SELECT 1 FROM quotas p WHERE p.user_id = ? AND p.year = ?) THEN NULL ELSE ? END"
+
+def _get_or_create_quota(cur: sqlite3.Cursor, user_id: int, year: int) -> Quota:
+    cur.execute("SELECT * FROM quotas WHERE user_id=? AND year=?", (user_id, year))
+    q = cur.fetchone()
+    if not q:
+        now = datetime.utcnow().isoformat()
+        cur.execute(f"""INSERT INTO quotas(user_id,year,leave_total,leave_used,changeoff_earned,changeoff_used,created_at,updated_at,
+                                           rollover_at)
+                        VALUES(?,?,?,?,?,?,?,?,{_NEW_QUOTA_ROLLOVER_SQL})""",
+                    (user_id, year, DEFAULT_LEAVE_TOTAL, 0, 0, 0, now, now, user_id, year - 1, now))
+        cur.execute("SELECT * FROM quotas WHERE user_id=? AND year=?", (user_id, year))
+        q = cur.fetchone()
+    return Quota.from_row(q)
+
+def get_or_create_quota(user_id: int, year: int) -> Quota:
+    with transaction() as cur:
+        return _get_or_create_quota(cur, user_id, year)
+
+def user_quota(user_id: int, year: int) -> Quota:
+    return get_or_create_quota(user_id, year)
+
+def _adjust_quota(cur: sqlite3.Cursor, column: str, user_id: int, year: int, days: int):
+    now = datetime.utcnow().isoformat()
+    cur.execute(f"""INSERT OR IGNORE INTO quotas(user_id,year,leave_total,created_at,updated_at,rollover_at)
+                    VALUES(?,?,?,?,?,{_NEW_QUOTA_ROLLOVER_SQL})""",
+                (user_id, year, DEFAULT_LEAVE_TOTAL, now, now, user_id, year - 1, now))
+    cur.execute(f"UPDATE quotas SET {column} = {column} + ?, updated_at=? WHERE user_id=? AND year=?",
+                (days, now, user_id, year))
+
+def adjust_quota_leave(user_id: int, year: int, days: int):
+    with transaction() as cur:
+        _adjust_quota(cur, "leave_used", user_id, year, days)
+
+def adjust_quota_changeoff_earned(user_id: int, year: int, days: int):
+    with transaction() as cur:
+        _adjust_quota(cur, "changeoff_earned", user_id, year, days)
+
+def adjust_quota_changeoff_used(user_id: int, year: int, days: int):
+    with transaction() as cur:
+        _adjust_quota(cur, "changeoff_used", user_id, year, days)
+
+def upsert_quota(user_id: int, year: int, leave_total: int, changeoff_earned: int, changeoff_used: int, leave_used: int):
+    now = datetime.utcnow().isoformat()
+    with transaction() as cur:
+        cur.execute("""INSERT INTO quotas(user_id,year,leave_total,leave_used,changeoff_earned,changeoff_used,created_at,updated_at)
+                       VALUES(?,?,?,?,?,?,?,?)
+                       ON CONFLICT(user_id, year) DO UPDATE SET
+                           leave_total=excluded.leave_total, leave_used=excluded.leave_used,
+                           changeoff_earned=excluded.changeoff_earned, changeoff_used=excluded.changeoff_used,
+                           updated_at=excluded.updated_at""",
+                    (user_id, year, leave_total, leave_used, changeoff_earned, changeoff_used, now, now))
+
+def delete_quota(user_id: int, year: int):
+    with transaction() as cur:
+        cur.execute("DELETE FROM quotas WHERE user_id=? AND year=?", (user_id, year))
+
+# -------------------- Files --------------------
+def save_file(filename: str, data) -> str:
+    """Simpan bytes upload ke UPLOAD_DIR dengan nama unik; kembalikan path-nya."""
+    ext = os.path.splitext(filename)[1]
+    fname = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex}{ext}"
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, fname)
+    with open(path, "wb") as f:
+        f.write(data)
+    metrics.UPLOAD_BYTES.inc(len(data))
+    return path
+
+def upload_files() -> List[str]:
+    """Semua file di UPLOAD_DIR (path lengkap)."""
+    if not os.path.isdir(UPLOAD_DIR):
+        return []
+    return [e.path for e in os.scandir(UPLOAD_DIR) if e.is_file() and not e.name.endswith(".tmp")]
+
+def referenced_uploads() -> set:
+    """Path lampiran (dinormalisasi) yang masih dirujuk request, termasuk yang sudah diarsip."""
+    conn = get_conn()
+    try:
+        sql = "SELECT timesheet_path FROM requests WHERE timesheet_path IS NOT NULL"
+        if attach_archive(conn):
+            sql += f" UNION SELECT timesheet_path FROM {ARCHIVE_SCHEMA}.requests_archive WHERE timesheet_path IS NOT NULL"
+        paths = [r["timesheet_path"] for r in conn.execute(sql)]
+    finally:
+        conn.close()
+    return {os.path.normcase(os.path.abspath(p)) for p in paths if p}
+
+def remove_orphan_uploads(grace_hours: float, dry_run: bool = False) -> List[str]:
+    """Hapus file di UPLOAD_DIR yang tidak dirujuk request dan lebih tua dari grace_hours."""
+    cutoff = datetime.utcnow().timestamp() - grace_hours * 3600
+    referenced = referenced_uploads()
+    removed = []
+    for path in upload_files():
+        try:
+            if os.path.normcase(os.path.abspath(path)) in referenced or os.path.getmtime(path) >= cutoff:
+                continue
+            if not dry_run:
+                os.remove(path)
+            removed.append(path)
+        except OSError:
+            continue  # file sudah hilang/terkunci: coba lagi di GC berikutnya
+    return removed
+
+# -------------------- Request lifecycle --------------------
+def inclusive_days(d1: date, d2: date) -> int:
+    return (d2 - d1).days + 1
+
+def activity_hours(start: str, end: str) -> float:
+    """Durasi HH:MM → HH:MM dalam jam; jika selesai < mulai dianggap lewat tengah malam."""
+    try:
+        start_dt = datetime.strptime(start, '%H:%M')
+        end_dt = datetime.strptime(end, '%H:%M')
+    except (TypeError, ValueError) as e:
+        raise ValidationError("Format waktu tidak valid. Harus HH:MM") from e
+    if end_dt < start_dt:
+        end_dt += timedelta(days=1)
+    return (end_dt - start_dt).total_seconds() / 3600
+
+def _submit_leave(cur: sqlite3.Cursor, user_id: int, start: date, end: date, reason: str) -> int:
+    if reason not in LEAVE_REASONS:
+        raise ValidationError(f"Alasan cuti tidak valid: {reason} (pilih {', '.join(LEAVE_REASONS)})")
+    if end < start:
+        raise ValidationError("Tanggal akhir harus >= tanggal mulai")
+    _check_overlap(cur, 'LEAVE', user_id, start, end)
+    days = inclusive_days(start, end)
+    q = _get_or_create_quota(cur, user_id, start.year)
+    if reason == 'CHANGEOFF' and q.co_balance < days:
+        metrics.SUBMISSIONS.inc(type="LEAVE", outcome="insufficient_balance")
+        raise InsufficientBalance(f"Saldo Change Off tidak cukup. Tersedia {q.co_balance} hari, diminta {days}.")
+    if reason == 'PERSONAL' and q.leave_balance < days:
+        metrics.SUBMISSIONS.inc(type="LEAVE", outcome="insufficient_balance")
+        raise InsufficientBalance(f"Saldo cuti tidak cukup. Tersedia {q.leave_balance} hari, diminta {days}.")
+    now = datetime.utcnow().isoformat()
+    cur.execute("""
+        INSERT INTO requests(user_id,type,start_date,end_date,reason,status,created_at,updated_at,file_uploaded)
+        VALUES(?,?,?,?,?,?,?,?,?)
+    """, (user_id, 'LEAVE', start.isoformat(), end.isoformat(), reason, 'PENDING_MANAGER', now, now, 0))
+    request_id = cur.lastrowid
+    _summary_apply(cur, request_id, +1)
+    _log_event(cur, request_id, user_id, None, 'PENDING_MANAGER', user_id, now)
+    _notify_transition(cur, request_id, None, 'PENDING_MANAGER', now)
+    metrics.SUBMISSIONS.inc(type="LEAVE", outcome="submitted")
+    return request_id
+
+def submit_leave(user_id: int, start: date, end: date, reason: str) -> SubmitResult:
+    with transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        request_id = _submit_leave(cur, user_id, start, end, reason)
+        warnings = _submit_warnings(cur, user_id, request_id, start, end)
+    return SubmitResult(request_id, "Leave request terkirim dan menunggu persetujuan Manager.", warnings)
+
+def _submit_changeoff(cur: sqlite3.Cursor, user_id: int, departure_date: date, return_date: date, activities: List[dict],
+                      location: str, pic: str, job_exec: Optional[str], timesheet_path: str) -> int:
+    if departure_date > return_date:
+        raise ValidationError("Tanggal kepulangan harus setelah tanggal keberangkatan.")
+    if not timesheet_path:
+        raise ValidationError("Timesheet wajib diupload.")
+    if not location or not pic:
+        raise ValidationError("Harap isi Lokasi dan PIC.")
+    _check_overlap(cur, 'CHANGEOFF', user_id, departure_date, return_date)
+    total_hours = 0
+    for activity in activities:
+        try:
+            total_hours += activity_hours(activity['waktu_mulai'], activity['waktu_selesai'])
+        except (KeyError, ValidationError) as e:
+            raise ValidationError(f"Format waktu tidak valid untuk Hari {activity.get('hari')}. Harus HH:MM") from e
+    activities_json = json.dumps(activities, ensure_ascii=False)
+    now = datetime.utcnow().isoformat()
+    cur.execute("""
+        INSERT INTO requests(user_id,type,departure_date,return_date,
+                    hours,reason,status,timesheet_path,location,pic,job_execution,
+                    activities_json,created_at,updated_at,file_uploaded)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """, (user_id, 'CHANGEOFF', departure_date.isoformat(), return_date.isoformat(),
+          total_hours, 'CHANGEOFF', 'PENDING_MANAGER', timesheet_path, location, pic,
+          job_exec if job_exec else None, activities_json, now, now, 1))
+    request_id = cur.lastrowid
+    _summary_apply(cur, request_id, +1)
+    _log_event(cur, request_id, user_id, None, 'PENDING_MANAGER', user_id, now)
+    _notify_transition(cur, request_id, None, 'PENDING_MANAGER', now)
+    metrics.SUBMISSIONS.inc(type="CHANGEOFF", outcome="submitted")
+    return request_id
+
+def submit_changeoff(user_id: int, departure_date: date, return_date: date, activities: List[dict],
+                     location: str, pic: str, job_exec: Optional[str], timesheet_path: str) -> SubmitResult:
+    """Ajukan Change Off; activities = list dict per hari (hari, tanggal, waktu_mulai, waktu_selesai, aktivitas)."""
+    with transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        request_id = _submit_changeoff(cur, user_id, departure_date, return_date, activities,
+                                       location, pic, job_exec, timesheet_path)
+        warnings = _submit_warnings(cur, user_id, request_id, departure_date, return_date)
+    return SubmitResult(request_id, "Change Off request terkirim. Menunggu persetujuan Manager.", warnings)
+
+# -------------------- Overlap & team coverage --------------------
+TEAM_ABSENCE_MAX_DAYS = 366
+
+def _overlapping_requests(cur: sqlite3.Cursor, user_id: int, start: date, end: date,
+                          exclude_id: Optional[int] = None) -> list:
+    """Request aktif (bukan REJECTED) milik user yang rentangnya beririsan dengan [start, end]."""
+    cur.execute(f"""
+        SELECT id, type, status, {SPAN_START_SQL} AS span_start, {SPAN_END_SQL} AS span_end
+        FROM requests
+        WHERE user_id = ? AND {ACTIVE_SQL}
+          AND {SPAN_START_SQL} <= ? AND {SPAN_END_SQL} >= ? AND id IS NOT ?
+        ORDER BY span_start
+    """, (user_id, end.isoformat(), start.isoformat(), exclude_id))
+    return [dict(r) for r in cur.fetchall()]
+
+def _overlap_message(rows: list) -> str:
+    parts = [f"#{r['id']} {r['type']} {r['span_start']} s/d {r['span_end']} ({r['status']})" for r in rows]
+    return "Tanggal bentrok dengan request lain: " + "; ".join(parts)
+
+def _check_overlap(cur: sqlite3.Cursor, req_type: str, user_id: int, start: date, end: date):
+    """Tolak request yang beririsan (HRMS_OVERLAP_POLICY=reject).
+
+    Pemanggil harus sudah memegang BEGIN IMMEDIATE: modul sqlite3 baru membuka transaksi
+    di DML pertama, jadi tanpa itu dua submit bersamaan bisa lolos cek yang sama.
+    """
+    if OVERLAP_POLICY != "reject":
+        return
+    rows = _overlapping_requests(cur, user_id, start, end)
+    if rows:
+        metrics.SUBMISSIONS.inc(type=req_type, outcome="overlap")
+        raise OverlapConflict(_overlap_message(rows))
+
+def overlapping_requests(user_id: int, start: date, end: date, exclude_id: Optional[int] = None) -> list:
+    conn = get_conn()
+    try:
+        return _overlapping_requests(conn.cursor(), user_id, start, end, exclude_id)
+    finally:
+        conn.close()
+
+def _merge_spans(spans: list) -> list:
+    merged = []
+    for s, e in sorted(spans):
+        if merged and s <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+def _team_absence(cur: sqlite3.Cursor, manager_id: int, start: date, end: date,
+                  exclude_user_id: Optional[int] = None, include_subtree: bool = False) -> dict:
+    """Jumlah anggota tim yang off per hari di [start, end].
+
+    Tim = bawahan langsung manager, atau seluruh subtree jika include_subtree.
+    Request diambil lewat idx_users_manager/org_closure + idx_requests_user_span, lalu dihitung
+    dengan sweep difference-array (rentang per user digabung dulu supaya satu
+    orang hanya dihitung sekali per hari).
+    """
+    if end < start:
+        raise ValidationError("Tanggal akhir harus >= tanggal mulai")
+    end = min(end, start + timedelta(days=TEAM_ABSENCE_MAX_DAYS - 1))
+    n_days = inclusive_days(start, end)
+    scope_join, scope_where = team_scope_sql(include_subtree)
+    cur.execute(f"SELECT COUNT(1) AS c FROM users u {scope_join} WHERE {scope_where} AND u.id IS NOT ?",
+                (manager_id, exclude_user_id))
+    team_size = cur.fetchone()["c"]
+    cur.execute(f"""
+        SELECT r.user_id, r.status, COALESCE(r.start_date, r.departure_date) AS span_start,
+               COALESCE(r.end_date, r.return_date) AS span_end
+        FROM users u
+        {scope_join}
+        JOIN requests r ON r.user_id = u.id
+        WHERE {scope_where} AND u.id IS NOT ? AND r.status <> 'REJECTED'
+          AND COALESCE(r.start_date, r.departure_date) <= ? AND COALESCE(r.end_date, r.return_date) >= ?
+    """, (manager_id, exclude_user_id, end.isoformat(), start.isoformat()))
+    all_spans, approved_spans = {}, {}
+    for r in cur.fetchall():
+        s = max(0, (date.fromisoformat(r["span_start"]) - start).days)
+        e = min(n_days - 1, (date.fromisoformat(r["span_end"]) - start).days)
+        all_spans.setdefault(r["user_id"], []).append((s, e))
+        if r["status"] == 'APPROVED':
+            approved_spans.setdefault(r["user_id"], []).append((s, e))
+
+    def sweep(spans_by_user: dict) -> list:
+        diff = [0] * (n_days + 1)
+        for spans in spans_by_user.values():
+            for s, e in _merge_spans(spans):
+                diff[s] += 1
+                diff[e + 1] -= 1
+        out, running = [], 0
+        for i in range(n_days):
+            running += diff[i]
+            out.append(running)
+        return out
+
+    total, approved = sweep(all_spans), sweep(approved_spans)
+    days = [{"date": (start + timedelta(days=i)).isoformat(), "approved": approved[i],
+             "pending": total[i] - approved[i], "total": total[i]} for i in range(n_days)]
+    peak = max(days, key=lambda d: d["total"]) if days else None
+    return {"team_size": team_size, "days": days, "peak": peak}
+
+def team_absence(manager_id: int, start: date, end: date, exclude_user_id: Optional[int] = None,
+                 include_subtree: bool = False) -> dict:
+    conn = get_conn()
+    try:
+        return _team_absence(conn.cursor(), manager_id, start, end, exclude_user_id, include_subtree)
+    finally:
+        conn.close()
+
+def team_members(manager_id: int, include_subtree: bool = False) -> pd.DataFrame:
+    scope_join, scope_where = team_scope_sql(include_subtree)
+    conn = get_conn()
+    try:
+        return pd.read_sql_query(f"""SELECT u.id, u.name, u.email, u.division FROM users u {scope_join}
+                                     WHERE {scope_where} ORDER BY u.name""",
+                                 conn, params=(manager_id,))
+    finally:
+        conn.close()
+
+def team_spans(manager_id: int, start: date, end: date, include_subtree: bool = False) -> pd.DataFrame:
+    """Rentang request aktif (pending + approved) anggota tim yang beririsan dengan [start, end]."""
+    scope_join, scope_where = team_scope_sql(include_subtree)
+    conn = get_conn()
+    try:
+        return pd.read_sql_query(f"""
+            SELECT r.id, r.user_id, r.type, r.status,
+                   COALESCE(r.start_date, r.departure_date) AS span_start,
+                   COALESCE(r.end_date, r.return_date) AS span_end
+            FROM users u
+            {scope_join}
+            JOIN requests r ON r.user_id = u.id
+            WHERE {scope_where} AND r.status <> 'REJECTED'
+              AND COALESCE(r.start_date, r.departure_date) <= ? AND COALESCE(r.end_date, r.return_date) >= ?
+        """, conn, params=(manager_id, end.isoformat(), start.isoformat()))
+    finally:
+        conn.close()
+
+def team_version(manager_id: int, include_subtree: bool = False) -> tuple:
+    """Token murah yang berubah setiap kali anggota tim atau request mereka berubah (untuk cache key)."""
+    scope_join, scope_where = team_scope_sql(include_subtree)
+    conn = get_conn()
+    try:
+        row = conn.execute(f"""
+            SELECT COUNT(DISTINCT u.id), MAX(u.updated_at), COUNT(r.id), MAX(r.updated_at)
+            FROM users u {scope_join} LEFT JOIN requests r ON r.user_id = u.id
+            WHERE {scope_where}
+        """, (manager_id,)).fetchone()
+    finally:
+        conn.close()
+    return tuple(row)
+
+def _submit_warnings(cur: sqlite3.Cursor, user_id: int, request_id: int, start: date, end: date) -> tuple:
+    warnings = []
+    if OVERLAP_POLICY != "reject":
+        rows = _overlapping_requests(cur, user_id, start, end, exclude_id=request_id)
+        if rows:
+            warnings.append(_overlap_message(rows))
+    cur.execute("SELECT manager_id FROM users WHERE id=?", (user_id,))
+    row = cur.fetchone()
+    if row and row["manager_id"] is not None:
+        coverage = _team_absence(cur, row["manager_id"], start, end, exclude_user_id=user_id)
+        peak = coverage["peak"]
+        if peak and coverage["team_size"] and peak["total"] / coverage["team_size"] >= TEAM_ABSENCE_WARN_RATIO:
+            warnings.append(f"{peak['total']} dari {coverage['team_size']} rekan tim sudah mengajukan off "
+                            f"pada {peak['date']}.")
+    return tuple(warnings)
+
+# -------------------- Usage summary --------------------
+# Ringkasan per (divisi, tahun, bulan, tipe, alasan, status). Request yang
+# melewati batas bulan dipecah per bulan: hari dihitung dari irisan tanggal,
+# jam Change Off mengikuti tanggal tiap aktivitas. Diupdate di transaksi yang
+# sama dengan setiap insert/perubahan status, jadi dashboard cukup membaca
+# baris ringkasan tanpa memindai tabel requests.
+_SUMMARY_UPSERT = """
+    INSERT INTO usage_summary(division, year, month, type, reason, status, requests, days, hours)
+    VALUES(?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(division, year, month, type, reason, status) DO UPDATE SET
+        requests = requests + excluded.requests,
+        days = days + excluded.days,
+        hours = ROUND(hours + excluded.hours, 2)
+"""
+
+def _load_activities(raw) -> List[dict]:
+    """activities_json → list aktivitas; 'null', JSON rusak, atau bukan list dianggap kosong."""
+    if not raw:
+        return []
+    try:
+        activities = json.loads(raw)
+    except ValueError:
+        return []
+    if not isinstance(activities, list):
+        return []
+    return [a for a in activities if isinstance(a, dict)]
+
+def _month_slices(req) -> dict:
+    """{(tahun, bulan): [hari, jam]} untuk satu baris request."""
+    start = req["start_date"] or req["departure_date"]
+    end = req["end_date"] or req["return_date"]
+    if not start or not end:
+        return {}
+    start, end = date.fromisoformat(start), date.fromisoformat(end)
+    slices = {}
+    cursor = start
+    while cursor <= end:
+        next_month = (cursor.replace(day=28) + timedelta(days=4)).replace(day=1)
+        slices[(cursor.year, cursor.month)] = [inclusive_days(cursor, min(end, next_month - timedelta(days=1))), 0.0]
+        cursor = next_month
+    if req["type"] == 'CHANGEOFF':
+        first_key = (start.year, start.month)
+        activities = _load_activities(req["activities_json"])
+        if not activities:
+            slices[first_key][1] += float(req["hours"] or 0)
+        for activity in activities:
+            try:
+                hours = activity_hours(activity.get('waktu_mulai'), activity.get('waktu_selesai'))
+            except ValidationError:
+                continue
+            try:
+                d = date.fromisoformat(str(activity.get('tanggal'))[:10])
+                key = (d.year, d.month)
+            except ValueError:
+                key = first_key
+            slices.setdefault(key, [0, 0.0])[1] += hours
+    return slices
+
+def _summary_rows(req, division: Optional[str], sign: int) -> list:
+    return [(division or '-', year, month, req["type"], req["reason"] or '', req["status"],
+             sign, sign * days, round(sign * hours, 2))
+            for (year, month), (days, hours) in _month_slices(req).items()]
+
+def _summary_apply(cur: sqlite3.Cursor, request_id: int, sign: int):
+    """Tambah (+1) atau kurangi (-1) kontribusi satu request ke usage_summary."""
+    cur.execute("""SELECT r.*, u.division FROM requests r JOIN users u ON u.id = r.user_id
+                   WHERE r.id=?""", (request_id,))
+    req = cur.fetchone()
+    if not req:
+        return
+    rows = _summary_rows(req, req["division"], sign)
+    cur.executemany(_SUMMARY_UPSERT, rows)
+    if sign < 0:
+        cur.executemany("""DELETE FROM usage_summary WHERE division=? AND year=? AND month=? AND type=?
+                           AND reason=? AND status=? AND requests <= 0""", [r[:6] for r in rows])
+
+def _summary_apply_user(cur: sqlite3.Cursor, user_id: int, sign: int):
+    cur.execute("SELECT id FROM requests WHERE user_id=?", (user_id,))
+    for request_id in [r["id"] for r in cur.fetchall()]:
+        _summary_apply(cur, request_id, sign)
+
+def _rebuild_usage_summary(cur: sqlite3.Cursor) -> int:
+    totals = {}
+    sql = "SELECT r.*, u.division FROM requests r JOIN users u ON u.id = r.user_id"
+    if _archive_attached(cur.connection):
+        # Request yang diarsipkan tetap dihitung, dengan divisi saat diarsipkan
+        sql += f"""
+            UNION ALL
+            SELECT {_archive_select_sql(cur.connection)}, a.employee_division FROM {ARCHIVE_SCHEMA}.requests_archive a
+            WHERE {_ARCHIVE_NOT_HOT_SQL}"""
+    cur.execute(sql)
+    while True:
+        batch = cur.fetchmany(2000)
+        if not batch:
+            break
+        for req in batch:
+            for row in _summary_rows(req, req["division"], +1):
+                acc = totals.setdefault(row[:6], [0, 0, 0.0])
+                acc[0] += row[6]
+                acc[1] += row[7]
+                acc[2] += row[8]
+    cur.execute("DELETE FROM usage_summary")
+    cur.executemany("INSERT INTO usage_summary VALUES(?,?,?,?,?,?,?,?,?)",
+                    [key + (n, days, round(hours, 2)) for key, (n, days, hours) in totals.items()])
+    return len(totals)
+
+def rebuild_usage_summary() -> int:
+    """Hitung ulang usage_summary dari nol (termasuk arsip); kembalikan jumlah baris ringkasan."""
+    with transaction() as cur:
+        attach_archive(cur.connection)
+        cur.execute("BEGIN IMMEDIATE")
+        return _rebuild_usage_summary(cur)
+
+def usage_summary(year: int, month: Optional[int] = None) -> pd.DataFrame:
+    """Baris ringkasan untuk satu tahun (opsional satu bulan)."""
+    sql = "SELECT * FROM usage_summary WHERE year=?"
+    params = [int(year)]
+    if month:
+        sql += " AND month=?"
+        params.append(int(month))
+    conn = get_conn()
+    try:
+        return pd.read_sql_query(sql + " ORDER BY month, division, type, reason, status", conn, params=params)
+    finally:
+        conn.close()
+
+def my_requests(user_id: int) -> pd.DataFrame:
+    """Riwayat request user, termasuk yang sudah diarsipkan (kolom archived_at terisi)."""
+    conn = get_conn()
+    try:
+        cols = ", ".join(name for name, _ in request_columns(conn))
+        sql, params = f"SELECT {cols}, NULL AS archived_at FROM requests WHERE user_id=?", [user_id]
+        if attach_archive(conn):
+            sql += f"""
+                UNION ALL
+                SELECT {_archive_select_sql(conn)}, a.archived_at FROM {ARCHIVE_SCHEMA}.requests_archive a
+                WHERE a.user_id=? AND {_ARCHIVE_NOT_HOT_SQL}"""
+            params.append(user_id)
+        return pd.read_sql_query(sql + " ORDER BY created_at DESC", conn, params=params)
+    finally:
+        conn.close()
+
+# -------------------- Archive (cold storage) --------------------
+# Request APPROVED/REJECTED yang sudah lama dipindah archive.py ke tabel
+# archive.requests_archive (kolom sama dengan requests + snapshot identitas
+# karyawan + archived_at). View riwayat membaca UNION ALL keduanya; baris arsip
+# yang masih ada di tabel utama (pemindahan terputus di tengah) dilewati.
+ARCHIVE_SCHEMA = "archive"
+ARCHIVE_EXTRA_COLUMNS = (("employee_name", "TEXT"), ("employee_email", "TEXT"), ("employee_division", "TEXT"),
+                         ("archived_at", "TEXT"))
+_request_columns_cache: Optional[List[Tuple[str, str]]] = None
+_archive_schema_synced = False  # kolom arsip sudah disamakan dengan tabel utama di proses ini
+
+def request_columns(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """(nama, tipe) kolom tabel requests utama, sesuai urutan di database."""
+    global _request_columns_cache
+    if _request_columns_cache is None:
+        _request_columns_cache = [(r["name"], r["type"]) for r in conn.execute("PRAGMA main.table_info(requests)")]
+    return _request_columns_cache
+
+def _archive_attached(conn: sqlite3.Connection) -> bool:
+    return any(r["name"] == ARCHIVE_SCHEMA for r in conn.execute("PRAGMA database_list"))
+
+def _ensure_archive_schema(conn: sqlite3.Connection):
+    cols = [(name, ctype) for name, ctype in request_columns(conn) if name != "id"]
+    extra = list(ARCHIVE_EXTRA_COLUMNS)
+    col_defs = ", ".join(f"{name} {ctype}" for name, ctype in cols + extra)
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.requests_archive(id INTEGER PRIMARY KEY, {col_defs});
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_requests_archive_user
+            ON requests_archive(user_id, created_at);
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_requests_archive_status
+            ON requests_archive(status, updated_at);
+    """)
+    # Kolom baru di tabel utama (migrasi) ikut ditambahkan ke arsip
+    existing = {r["name"] for r in conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.table_info(requests_archive)")}
+    for name, ctype in cols + extra:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {ARCHIVE_SCHEMA}.requests_archive ADD COLUMN {name} {ctype}")
+
+def attach_archive(conn: sqlite3.Connection, create: bool = False) -> bool:
+    """ATTACH file arsip ke koneksi sebagai schema 'archive'. False jika arsip belum ada.
+
+    Harus dipanggil di luar transaksi. create=True membuat file + tabel jika belum ada.
+    """
+    if _archive_attached(conn):
+        return True
+    if not create and not os.path.exists(ARCHIVE_PATH):
+        return False
+    archive_dir = os.path.dirname(ARCHIVE_PATH)
+    if create and archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+    global _archive_schema_synced
+    conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (ARCHIVE_PATH,))
+    if create:
+        conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.journal_mode=WAL")
+    elif conn.execute(f"SELECT 1 FROM {ARCHIVE_SCHEMA}.sqlite_master WHERE name='requests_archive'").fetchone() is None:
+        conn.execute(f"DETACH DATABASE {ARCHIVE_SCHEMA}")
+        return False
+    if create or not _archive_schema_synced:
+        _ensure_archive_schema(conn)
+        _archive_schema_synced = True
+    return True
+
+def _archive_select_sql(conn: sqlite3.Connection, alias: str = "a") -> str:
+    """Kolom arsip dengan urutan yang sama seperti requests utama (untuk UNION ALL)."""
+    return ", ".join(f"{alias}.{name}" for name, _ in request_columns(conn))
+
+_ARCHIVE_NOT_HOT_SQL = "NOT EXISTS (SELECT 1 FROM main.requests h WHERE h.id = a.id)"
+
+def manager_pending(manager_id: int, include_subtree: bool = False) -> pd.DataFrame:
+    """Request PENDING_MANAGER tim. Dengan include_subtree, request dari level bawah ikut
+    tampil (read-only): approval tetap hanya oleh manager langsung (kolom direct_manager_id)."""
+    scope_join, scope_where = team_scope_sql(include_subtree)
+    conn = get_conn()
+    df = pd.read_sql_query(f"""
+        SELECT r.*, u.name as employee_name, u.email as employee_email, u.division as employee_division,
+               u.manager_id as direct_manager_id, m.name as direct_manager_name
+        FROM requests r
+        JOIN users u ON u.id = r.user_id
+        {scope_join}
+        LEFT JOIN users m ON m.id = u.manager_id
+        WHERE r.status='PENDING_MANAGER' AND {scope_where}
+        ORDER BY r.created_at DESC
+    """, conn, params=(manager_id,))
+    conn.close()
+    return df
+
+def team_requests(manager_id: int, include_subtree: bool = False) -> pd.DataFrame:
+    """Riwayat request tim (termasuk arsip)."""
+    scope_join, scope_where = team_scope_sql(include_subtree)
+    conn = get_conn()
+    try:
+        cols = ", ".join(f"r.{name}" for name, _ in request_columns(conn))
+        sql = f"""
+            SELECT {cols}, u.name as employee_name, u.division as employee_division, NULL AS archived_at
+            FROM requests r JOIN users u ON u.id=r.user_id
+            {scope_join}
+            WHERE {scope_where}"""
+        params = [manager_id]
+        if attach_archive(conn):
+            sql += f"""
+                UNION ALL
+                SELECT {_archive_select_sql(conn)}, u.name, u.division, a.archived_at
+                FROM {ARCHIVE_SCHEMA}.requests_archive a JOIN users u ON u.id=a.user_id
+                {scope_join}
+                WHERE {scope_where} AND {_ARCHIVE_NOT_HOT_SQL}"""
+            params.append(manager_id)
+        return pd.read_sql_query(f"SELECT * FROM ({sql}) ORDER BY created_at DESC", conn, params=params)
+    finally:
+        conn.close()
+
+def hr_pending() -> pd.DataFrame:
+    conn = get_conn()
+    df = pd.read_sql_query("""
+        SELECT r.*, u.name as employee_name, u.email as employee_email, u.division as employee_division
+        FROM requests r
+        JOIN users u ON u.id = r.user_id
+        WHERE r.status='PENDING_HR'
+        ORDER BY r.created_at DESC
+    """, conn)
+    conn.close()
+    return df
+
+def _set_manager_decision(cur: sqlite3.Cursor, manager_id: int, request_id: int, approve: bool):
+    cur.execute("""SELECT r.*, u.manager_id
+                   FROM requests r JOIN users u ON u.id=r.user_id
+                   WHERE r.id=?""", (request_id,))
+    row = cur.fetchone()
+    if not row:
+        raise NotFound("Request tidak ditemukan")
+    if row["user_id"] == manager_id:
+        raise NotAuthorized("Tidak boleh menyetujui request sendiri.")
+    if row["manager_id"] != manager_id:
+        raise NotAuthorized("Anda bukan manager dari karyawan ini.")
+    if row["status"] != 'PENDING_MANAGER':
+        raise InvalidState("Request tidak menunggu Manager")
+    new_status = 'PENDING_HR' if approve else 'REJECTED'
+    now = datetime.utcnow().isoformat()
+    _summary_apply(cur, request_id, -1)
+    cur.execute("UPDATE requests SET status=?, manager_by=?, manager_at=?, updated_at=? WHERE id=?",
+                (new_status, manager_id, now, now, request_id))
+    _summary_apply(cur, request_id, +1)
+    _log_event(cur, request_id, row["user_id"], row["status"], new_status, manager_id, now)
+    _notify_transition(cur, request_id, row["status"], new_status, now)
+    metrics.DECISIONS.inc(role="MANAGER", outcome="approved" if approve else "rejected")
+
+def set_manager_decision(manager_id: int, request_id: int, approve: bool):
+    with transaction() as cur:
+        _set_manager_decision(cur, manager_id, request_id, approve)
+
+def _apply_approved_quota(cur: sqlite3.Cursor, req):
+    """Efek kuota saat request disetujui final oleh HR."""
+    if req["type"] == 'LEAVE':
+        s = date.fromisoformat(req["start_date"])
+        e = date.fromisoformat(req["end_date"])
+        days = inclusive_days(s, e)
+        if req["reason"] == 'CHANGEOFF':
+            _adjust_quota(cur, "changeoff_used", req["user_id"], s.year, days)
+        elif req["reason"] == 'PERSONAL':
+            _adjust_quota(cur, "leave_used", req["user_id"], s.year, days)
+    elif req["type"] == 'CHANGEOFF':
+        d = date.fromisoformat(req["departure_date"])
+        hours = req["hours"] or 0
+        credit = max(0, int(hours) // 8)
+        if credit > 0:
+            _adjust_quota(cur, "changeoff_earned", req["user_id"], d.year, credit)
+
+def _set_hr_decision(cur: sqlite3.Cursor, hr_id: int, request_id: int, approve: bool):
+    cur.execute("SELECT * FROM requests WHERE id=?", (request_id,))
+    req = cur.fetchone()
+    if not req:
+        raise NotFound("Request tidak ditemukan")
+    cur.execute("SELECT role FROM users WHERE id=?", (hr_id,))
+    actor = cur.fetchone()
+    if actor is None or actor["role"] != 'HR_ADMIN':
+        raise NotAuthorized("Hanya HR Admin yang bisa memberi keputusan HR.")
+    if req["user_id"] == hr_id:
+        raise NotAuthorized("Tidak boleh menyetujui request sendiri.")
+    if req["status"] != 'PENDING_HR':
+        raise InvalidState("Request tidak menunggu HR")
+    new_status = 'APPROVED' if approve else 'REJECTED'
+    now = datetime.utcnow().isoformat()
+    _summary_apply(cur, request_id, -1)
+    cur.execute("UPDATE requests SET status=?, hr_by=?, hr_at=?, updated_at=? WHERE id=?",
+                (new_status, hr_id, now, now, request_id))
+    _summary_apply(cur, request_id, +1)
+    _log_event(cur, request_id, req["user_id"], req["status"], new_status, hr_id, now)
+    _notify_transition(cur, request_id, req["status"], new_status, now)
+    if approve:
+        _apply_approved_quota(cur, req)
+        # Surat persetujuan dirender di background supaya generate batch HR tinggal memakai cache
+        _enqueue_job(cur, "letters.prewarm", {"request_ids": [request_id]})
+    metrics.DECISIONS.inc(role="HR_ADMIN", outcome="approved" if approve else "rejected")
+
+def set_hr_decision(hr_id: int, request_id: int, approve: bool):
+    # Status dan kuota diupdate dalam satu transaksi
+    with transaction() as cur:
+        _set_hr_decision(cur, hr_id, request_id, approve)
+
+# -------------------- Background jobs --------------------
+def _enqueue_job(cur: sqlite3.Cursor, kind: str, payload: Optional[dict] = None, run_after: Optional[datetime] = None,
+                 dedupe_key: Optional[str] = None, max_attempts: int = 3, created_by: Optional[int] = None) -> int:
+    """Tambah job ke tabel jobs di transaksi pemanggil (worker dan handler ada di jobs.py).
+
+    Dengan dedupe_key, job QUEUED yang key-nya sama dipakai ulang (run_after diambil yang paling awal).
+    """
+    now = datetime.utcnow().isoformat()
+    run_after = run_after.isoformat() if run_after else now
+    if dedupe_key:
+        cur.execute("SELECT id FROM jobs WHERE dedupe_key=? AND status='QUEUED' ORDER BY id LIMIT 1", (dedupe_key,))
+        row = cur.fetchone()
+        if row:
+            cur.execute("UPDATE jobs SET run_after=MIN(run_after, ?) WHERE id=?", (run_after, row["id"]))
+            return row["id"]
+    cur.execute("""INSERT INTO jobs(kind, payload_json, status, max_attempts, run_after, dedupe_key, created_by, created_at)
+                   VALUES(?,?,'QUEUED',?,?,?,?,?)""",
+                (kind, json.dumps(payload or {}, default=str), max_attempts, run_after, dedupe_key, created_by, now))
+    return cur.lastrowid
+
+# -------------------- Notification outbox --------------------
+TYPE_LABELS = {"LEAVE": "Cuti", "CHANGEOFF": "Change Off"}
+_NOTIFY_DECISIONS = {
+    ("PENDING_MANAGER", "PENDING_HR"): ("MANAGER_DECISION", "disetujui Manager, menunggu persetujuan HR"),
+    ("PENDING_MANAGER", "REJECTED"): ("MANAGER_DECISION", "ditolak Manager"),
+    ("PENDING_HR", "APPROVED"): ("HR_DECISION", "disetujui HR (final)"),
+    ("PENDING_HR", "REJECTED"): ("HR_DECISION", "ditolak HR"),
+}
+
+def _notify_transition(cur: sqlite3.Cursor, request_id: int, from_status: Optional[str], to_status: str, at: str):
+    """Tulis notifikasi perubahan status ke outbox di transaksi pemanggil dan jadwalkan pengirimnya.
+
+    Request baru (PENDING_MANAGER) diberitahukan ke manager pemohon; keputusan Manager/HR ke pemohon.
+    """
+    cur.execute("""SELECT r.id, r.type, r.reason, r.user_id, u.name, u.manager_id,
+                          COALESCE(r.start_date, r.departure_date) AS span_start,
+                          COALESCE(r.end_date, r.return_date) AS span_end
+                   FROM requests r JOIN users u ON u.id = r.user_id WHERE r.id=?""", (request_id,))
+    req = cur.fetchone()
+    if req is None:
+        return
+    label = f"{TYPE_LABELS.get(req['type'], req['type'])} #{req['id']} ({req['span_start']} s/d {req['span_end']})"
+    if from_status is None and to_status == "PENDING_MANAGER":
+        if req["manager_id"] is None:
+            return
+        recipient, kind = req["manager_id"], "REQUEST_SUBMITTED"
+        subject = f"Request baru menunggu persetujuan Anda: {label} dari {req['name']}"
+        body = f"{req['name']} mengajukan {label}" + (f", alasan {req['reason']}" if req["reason"] else "") + "."
+    elif (from_status, to_status) in _NOTIFY_DECISIONS:
+        kind, outcome = _NOTIFY_DECISIONS[(from_status, to_status)]
+        recipient = req["user_id"]
+        subject = f"{label} {outcome}"
+        body = f"Status request Anda sekarang {to_status}."
+    else:
+        return
+    cur.execute("""INSERT INTO notification_outbox(recipient_id, kind, request_id, subject, body, created_at)
+                   VALUES(?,?,?,?,?,?)""", (recipient, kind, request_id, subject, body, at))
+    _enqueue_job(cur, "notifications.flush",
+                 run_after=datetime.fromisoformat(at) + timedelta(seconds=NOTIFY_COALESCE_SECONDS),
+                 dedupe_key="notifications.flush")
+
+# -------------------- Request events & approval latency --------------------
+QUEUE_STATUSES = ("PENDING_MANAGER", "PENDING_HR")
+LATENCY_DIMENSIONS = ("approver", "division", "month")
+
+def _log_event(cur: sqlite3.Cursor, request_id: int, user_id: int, from_status: Optional[str],
+               to_status: str, actor_id: Optional[int], at: str):
+    """Catat satu transisi status; dipanggil di transaksi yang sama dengan perubahan requests."""
+    cur.execute("""INSERT INTO request_events(request_id, user_id, from_status, to_status, actor_id, at)
+                   VALUES(?,?,?,?,?,?)""", (request_id, user_id, from_status, to_status, actor_id, at))
+
+def _backfill_request_events(cur: sqlite3.Cursor) -> int:
+    """Rekonstruksi event dari created_at/manager_at/hr_at untuk request yang sudah ada sebelum tabel event.
+
+    Request yang sudah punya event dilewati, jadi aman dijalankan ulang.
+    """
+    cur.execute("""
+        WITH todo AS (SELECT * FROM requests r
+                      WHERE NOT EXISTS (SELECT 1 FROM request_events e WHERE e.request_id = r.id))
+        INSERT INTO request_events(request_id, user_id, from_status, to_status, actor_id, at, backfilled)
+        SELECT id, user_id, NULL, 'PENDING_MANAGER', user_id, created_at, 1 FROM todo
+        UNION ALL
+        SELECT id, user_id, 'PENDING_MANAGER',
+               CASE WHEN hr_at IS NOT NULL OR status IN ('PENDING_HR', 'APPROVED') THEN 'PENDING_HR' ELSE 'REJECTED' END,
+               manager_by, manager_at, 1
+        FROM todo WHERE manager_at IS NOT NULL
+        UNION ALL
+        SELECT id, user_id, 'PENDING_HR', status, hr_by, hr_at, 1 FROM todo WHERE hr_at IS NOT NULL
+        ORDER BY 6, 1
+    """)
+    return cur.rowcount
+
+def request_events(request_id: int) -> pd.DataFrame:
+    """Riwayat transisi status satu request (lama dulu) beserta nama aktor."""
+    conn = get_conn()
+    try:
+        df = pd.read_sql_query("""
+            SELECT e.at, e.from_status, e.to_status, a.name AS actor_name, e.backfilled
+            FROM request_events e LEFT JOIN users a ON a.id = e.actor_id
+            WHERE e.request_id = ? ORDER BY e.at, e.id
+        """, conn, params=(request_id,))
+    finally:
+        conn.close()
+    return df
+
+def request_events_version() -> tuple:
+    """Token cache untuk analytics latency: berubah setiap ada event baru."""
+    conn = get_conn()
+    try:
+        return tuple(conn.execute("SELECT COUNT(1), MAX(id) FROM request_events").fetchone())
+    finally:
+        conn.close()
+
+_LATENCY_GROUP_SQL = {
+    # Waktu tunggu yang sudah selesai milik pemutusnya; yang masih menunggu di antrian manager milik manager saat ini
+    "approver": "COALESCE(a.name || ' (' || a.email || ')', '(belum diputuskan)')",
+    "division": "COALESCE(u.division, '(tanpa divisi)')",
+    "month": "substr(w.entered_at, 1, 7)",
+}
+
+def queue_times(queue: str = "PENDING_MANAGER", dimension: str = "approver",
+                date_from: Optional[date] = None, date_to: Optional[date] = None) -> pd.DataFrame:
+    """Persentil waktu tunggu (jam) di satu antrian approval per approver/divisi/bulan masuk antrian.
+
+    Waktu tunggu = jarak event masuk antrian ke event berikutnya request yang sama (LEAD).
+    Persentil nearest-rank dihitung dari ROW_NUMBER per grup, hanya dari tunggu yang
+    sudah selesai; yang masih menunggu dilaporkan terpisah (waiting, oldest_waiting_h).
+    """
+    if queue not in QUEUE_STATUSES:
+        raise ValidationError(f"Antrian tidak valid: {queue}")
+    if dimension not in LATENCY_DIMENSIONS:
+        raise ValidationError(f"Dimensi tidak valid: {dimension}")
+    where, params = ["ev.queue = :queue"], {"queue": queue, "now": datetime.utcnow().isoformat()}
+    if date_from:
+        where.append("ev.entered_at >= :date_from")
+        params["date_from"] = date_from.isoformat()
+    if date_to:
+        where.append("ev.entered_at < :date_to")
+        params["date_to"] = (date_to + timedelta(days=1)).isoformat()
+    pct = ", ".join(f"MIN(CASE WHEN rn * 100 >= {p} * n THEN hours END) AS p{p}_h" for p in (50, 90, 95))
+    conn = get_conn()
+    try:
+        df = pd.read_sql_query(f"""
+            WITH ev AS (
+                SELECT e.request_id, e.user_id, e.to_status AS queue, e.at AS entered_at,
+                       LEAD(e.at) OVER w AS left_at, LEAD(e.actor_id) OVER w AS decided_by
+                FROM request_events e
+                WINDOW w AS (PARTITION BY e.request_id ORDER BY e.at, e.id)
+            ), w AS (
+                SELECT ev.*, ev.left_at IS NULL AS open,
+                       (julianday(COALESCE(ev.left_at, :now)) - julianday(ev.entered_at)) * 24 AS hours
+                FROM ev WHERE {" AND ".join(where)}
+            ), g AS (
+                SELECT {_LATENCY_GROUP_SQL[dimension]} AS grp, w.open, w.hours
+                FROM w
+                LEFT JOIN users u ON u.id = w.user_id
+                LEFT JOIN users a ON a.id = CASE WHEN w.open AND w.queue = 'PENDING_MANAGER'
+                                                 THEN u.manager_id ELSE w.decided_by END
+            ), ranked AS (
+                SELECT grp, hours,
+                       ROW_NUMBER() OVER (PARTITION BY grp ORDER BY hours) AS rn,
+                       COUNT(1) OVER (PARTITION BY grp) AS n
+                FROM g WHERE NOT open
+            ), decided AS (
+                SELECT grp, MAX(n) AS decided, AVG(hours) AS avg_h, {pct}, MAX(hours) AS max_h
+                FROM ranked GROUP BY grp
+            ), waiting AS (
+                SELECT grp, COUNT(1) AS waiting, MAX(hours) AS oldest_waiting_h FROM g WHERE open GROUP BY grp
+            )
+            SELECT k.grp AS "{dimension}", COALESCE(d.decided, 0) AS decided, d.p50_h, d.p90_h, d.p95_h,
+                   d.avg_h, d.max_h, COALESCE(q.waiting, 0) AS waiting, q.oldest_waiting_h
+            FROM (SELECT DISTINCT grp FROM g) k
+            LEFT JOIN decided d ON d.grp = k.grp
+            LEFT JOIN waiting q ON q.grp = k.grp
+            ORDER BY {'k.grp' if dimension == 'month' else 'd.p90_h DESC NULLS LAST, q.oldest_waiting_h DESC'}
+        """, conn, params=params)
+    finally:
+        conn.close()
+    return df
+
+# -------------------- Batch operations --------------------
+@dataclass(frozen=True)
+class BatchItemResult:
+    index: int
+    ok: bool
+    request_id: Optional[int] = None
+    error: Optional[str] = None
+
+def _run_batch(items: list, fn) -> List[BatchItemResult]:
+    """Jalankan fn(cur, item) per item dalam SATU transaksi.
+
+    Tiap item dibungkus SAVEPOINT: item yang gagal validasi di-rollback sendiri
+    dan dilaporkan, item lain tetap tersimpan dengan satu commit di akhir.
+    """
+    results = []
+    with transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        for i, item in enumerate(items):
+            cur.execute("SAVEPOINT batch_item")
+            try:
+                request_id = fn(cur, item)
+            except (ServiceError, KeyError, TypeError, ValueError) as e:
+                cur.execute("ROLLBACK TO batch_item")
+                cur.execute("RELEASE batch_item")
+                msg = str(e) if isinstance(e, ServiceError) else f"Input tidak valid: {e!r}"
+                results.append(BatchItemResult(i, False, error=msg))
+                continue
+            cur.execute("RELEASE batch_item")
+            results.append(BatchItemResult(i, True, request_id=request_id))
+    return results
+
+def resolve_user_ids(emails: List[str]) -> dict:
+    """Map email → user id dengan satu query."""
+    emails = sorted({e for e in emails if e})
+    if not emails:
+        return {}
+    conn = get_conn()
+    try:
+        placeholders = ",".join("?" * len(emails))
+        rows = conn.execute(f"SELECT id, email FROM users WHERE email IN ({placeholders})", emails).fetchall()
+    finally:
+        conn.close()
+    return {r["email"]: int(r["id"]) for r in rows}
+
+def submit_leave_batch(items: List[dict]) -> List[BatchItemResult]:
+    """items: dict user_id, start (date), end (date), reason."""
+    return _run_batch(items, lambda cur, it: _submit_leave(cur, int(it["user_id"]), it["start"], it["end"], it["reason"]))
+
+def submit_changeoff_batch(items: List[dict]) -> List[BatchItemResult]:
+    """items: dict dengan argumen yang sama seperti submit_changeoff."""
+    return _run_batch(items, lambda cur, it: _submit_changeoff(
+        cur, int(it["user_id"]), it["departure_date"], it["return_date"], it.get("activities") or [],
+        it.get("location"), it.get("pic"), it.get("job_exec"), it.get("timesheet_path")))
+
+def _decide(cur: sqlite3.Cursor, item: dict) -> int:
+    request_id = int(item["request_id"])
+    stage = item["stage"]
+    if stage == "MANAGER":
+        _set_manager_decision(cur, int(item["actor_id"]), request_id, bool(item["approve"]))
+    elif stage == "HR":
+        _set_hr_decision(cur, int(item["actor_id"]), request_id, bool(item["approve"]))
+    else:
+        raise ValidationError(f"Stage tidak valid: {stage}")
+    return request_id
+
+def decide_batch(items: List[dict]) -> List[BatchItemResult]:
+    """items: dict stage ('MANAGER'|'HR'), actor_id, request_id, approve."""
+    return _run_batch(items, _decide)
+
+def balances(user_ids: List[int], year: int) -> List[dict]:
+    """Saldo kuota banyak user sekaligus (read-only; kuota yang belum ada dianggap default)."""
+    user_ids = sorted({int(u) for u in user_ids})
+    if not user_ids:
+        return []
+    conn = get_conn()
+    try:
+        placeholders = ",".join("?" * len(user_ids))
+        rows = conn.execute(f"""
+            SELECT u.id AS user_id, u.email, u.name, u.division,
+                   COALESCE(q.leave_total, ?) AS leave_total, COALESCE(q.leave_used, 0) AS leave_used,
+                   COALESCE(q.changeoff_earned, 0) AS changeoff_earned, COALESCE(q.changeoff_used, 0) AS changeoff_used
+            FROM users u
+            LEFT JOIN quotas q ON q.user_id = u.id AND q.year = ?
+            WHERE u.id IN ({placeholders})
+            ORDER BY u.id
+        """, [DEFAULT_LEAVE_TOTAL, year] + user_ids).fetchall()
+    finally:
+        conn.close()
+    out = []
+    for r in rows:
+        d = dict(r)
+        d["year"] = year
+        d["leave_balance"] = d["leave_total"] - d["leave_used"]
+        d["co_balance"] = d["changeoff_earned"] - d["changeoff_used"]
+        out.append(d)
+    return out
+
+def request_filter_sql(status: Optional[str] = None, date_from: Optional[date] = None,
+                       date_to: Optional[date] = None, alias: str = "r"):
+    """Klausa WHERE (list) + params untuk filter status dan periode request.
+
+    Filter tanggal memakai overlap rentang request (leave: start/end,
+    change off: departure/return) dengan [date_from, date_to].
+    """
+    where, params = [], []
+    if status:
+        if status not in STATUSES:
+            raise ValidationError(f"Status tidak valid: {status}")
+        where.append(f"{alias}.status = ?")
+        params.append(status)
+    if date_from:
+        where.append(f"COALESCE({alias}.end_date, {alias}.return_date) >= ?")
+        params.append(date_from.isoformat())
+    if date_to:
+        where.append(f"COALESCE({alias}.start_date, {alias}.departure_date) <= ?")
+        params.append(date_to.isoformat())
+    return where, params
+
+def list_requests_page(status: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                       after_id: int = 0, limit: int = 500) -> List[dict]:
+    """Daftar request dengan keyset pagination (id > after_id, urut id)."""
+    where, params = request_filter_sql(status, date_from, date_to)
+    where.insert(0, "r.id > ?")
+    params.insert(0, int(after_id))
+    params.append(int(limit))
+    conn = get_conn()
+    try:
+        rows = conn.execute(f"""
+            SELECT r.*, u.email AS employee_email, u.name AS employee_name, u.division AS employee_division
+            FROM requests r JOIN users u ON u.id = r.user_id
+            WHERE {' AND '.join(where)}
+            ORDER BY r.id
+            LIMIT ?
+        """, params).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+# -------------------- Full-text search --------------------
+def _init_search(conn: sqlite3.Connection):
+    global _search_unavailable_reason
+    try:
+        conn.executescript(_SEARCH_SCHEMA_SQL)
+    except sqlite3.OperationalError as e:
+        # Build SQLite tanpa FTS5: aplikasi tetap jalan, hanya halaman search yang nonaktif
+        _search_unavailable_reason = str(e)
+        return
+    _search_unavailable_reason = None
+    conn.executescript(_SEARCH_TRIGGERS_SQL)
+
+def _rebuild_search_index(cur: sqlite3.Cursor) -> int:
+    cur.execute("DELETE FROM requests_fts")
+    cur.execute(f"""INSERT INTO requests_fts(rowid, {", ".join(SEARCH_COLUMNS)})
+                    SELECT r.id, {_search_doc_sql("r")} FROM requests r""")
+    cur.execute("INSERT INTO requests_fts(requests_fts) VALUES('optimize')")
+    cur.execute("SELECT COUNT(1) AS c FROM requests_fts")
+    return cur.fetchone()["c"]
+
+def rebuild_search_index() -> int:
+    """Isi ulang requests_fts dari tabel requests; kembalikan jumlah dokumen."""
+    if _search_unavailable_reason:
+        raise ValidationError(f"Full-text search tidak tersedia: {_search_unavailable_reason}")
+    with transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        return _rebuild_search_index(cur)
+
+def list_divisions() -> List[str]:
+    conn = get_conn()
+    try:
+        return [r[0] for r in conn.execute(
+            "SELECT DISTINCT COALESCE(division, '-') FROM users ORDER BY 1")]
+    finally:
+        conn.close()
+
+def search_available() -> bool:
+    return _search_unavailable_reason is None
+
+def fts_query(text: str) -> str:
+    """Ubah input bebas menjadi query FTS5 yang aman: setiap kata wajib ada, dicocokkan sebagai prefix.
+
+    Kata diapit tanda kutip sehingga karakter khusus FTS5 (", *, :, -, OR, NEAR) tidak ditafsirkan.
+    """
+    terms = [t for t in (text or "").replace('"', " ").split() if t]
+    return " ".join(f'"{t}"*' for t in terms)
+
+def search_requests(text: str, status: Optional[str] = None, division: Optional[str] = None,
+                    date_from: Optional[date] = None, date_to: Optional[date] = None,
+                    page: int = 1, page_size: int = SEARCH_PAGE_SIZE) -> Tuple[List[dict], int]:
+    """Cari request lewat requests_fts, urut relevansi bm25; kembalikan (baris halaman ini, total hasil).
+
+    Setiap baris berisi kolom request + employee_name/employee_division + snippet (kata yang cocok diapit [ ]).
+    """
+    if _search_unavailable_reason:
+        raise ValidationError(f"Full-text search tidak tersedia: {_search_unavailable_reason}")
+    match = fts_query(text)
+    if not match:
+        return [], 0
+    where, params = request_filter_sql(status, date_from, date_to)
+    if division:
+        where.append("COALESCE(u.division, '-') = ?")
+        params.append(division)
+    where_sql = "".join(f" AND {w}" for w in where)
+    page, page_size = max(1, int(page)), max(1, int(page_size))
+    weights = ", ".join(str(w) for w in SEARCH_WEIGHTS)
+    conn = get_conn()
+    try:
+        total = conn.execute(f"""
+            SELECT COUNT(1) FROM requests_fts f
+            JOIN requests r ON r.id = f.rowid
+            JOIN users u ON u.id = r.user_id
+            WHERE requests_fts MATCH ?{where_sql}
+        """, [match] + params).fetchone()[0]
+        rows = conn.execute(f"""
+            SELECT r.id, r.type, r.status, r.reason, r.location, r.pic, r.job_execution,
+                   COALESCE(r.start_date, r.departure_date) AS span_start,
+                   COALESCE(r.end_date, r.return_date) AS span_end,
+                   r.created_at, u.name AS employee_name, COALESCE(u.division, '-') AS employee_division,
+                   snippet(requests_fts, -1, '[', ']', '…', 12) AS snippet,
+                   bm25(requests_fts, {weights}) AS rank
+            FROM requests_fts f
+            JOIN requests r ON r.id = f.rowid
+            JOIN users u ON u.id = r.user_id
+            WHERE requests_fts MATCH ?{where_sql}
+            ORDER BY rank, r.id DESC
+            LIMIT ? OFFSET ?
+        """, [match] + params + [page_size, (page - 1) * page_size]).fetchall()
+    except sqlite3.OperationalError as e:
+        raise ValidationError(f"Query pencarian tidak valid: {e}") from e
+    finally:
+        conn.close()
+    return [dict(r) for r in rows], total
+
+# -------------------- Metrics collector --------------------
+def collect_queue_depth():
+    """Collector metrics: jumlah request per status, dibaca lewat koneksi read-only."""
+    if is_memory_db():
+        conn = get_conn()
+    else:
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        rows = conn.execute("SELECT status, COUNT(1) FROM requests GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    depth = {(s,): 0 for s in STATUSES}
+    depth.update({(status,): n for status, n in rows})
+    metrics.QUEUE_DEPTH.replace(depth)
+
+# -------------------- CLI --------------------
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="HRMS service maintenance commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild-usage-summary", help="Hitung ulang tabel usage_summary dari tabel requests")
+    sub.add_parser("rebuild-org-closure", help="Hitung ulang tabel org_closure dari users.manager_id")
+    sub.add_parser("rebuild-search-index", help="Hitung ulang index full-text requests_fts")
+    args = parser.parse_args(argv)
+    init_db()
+    if args.command == "rebuild-usage-summary":
+        print(f"usage_summary: {rebuild_usage_summary()} baris")
+    elif args.command == "rebuild-org-closure":
+        print(f"org_closure: {rebuild_org_closure()} baris")
+    elif args.command == "rebuild-search-index":
+        print(f"requests_fts: {rebuild_search_index()} dokumen")
+
+if __name__ == "__main__":
+    main()
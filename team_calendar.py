@@ -0,0 +1,94 @@
+"""Kalender ketersediaan tim: matriks user x hari untuk satu bulan.
+
+Rentang request diekspansi ke sel (user, hari) secara vektor dengan numpy
+(np.repeat + offset kumulatif), tanpa loop Python per hari. Jika satu sel
+terkena beberapa request, status dengan prioritas tertinggi yang dipakai.
+"""
+import calendar
+from datetime import date
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Kode sel; angka lebih besar menang jika beberapa request jatuh di hari yang sama
+EMPTY, WEEKEND, HOLIDAY, CO_PENDING, LEAVE_PENDING, CO_APPROVED, LEAVE_APPROVED = range(7)
+LABELS = {
+    EMPTY: "", WEEKEND: "·", HOLIDAY: "Libur",
+    CO_PENDING: "CO?", LEAVE_PENDING: "Cuti?", CO_APPROVED: "CO", LEAVE_APPROVED: "Cuti",
+}
+COLORS = {
+    "Libur": "background-color: #fde2e2", "·": "background-color: #f0f0f0",
+    "CO?": "background-color: #e3ecfb", "CO": "background-color: #9dbcf0",
+    "Cuti?": "background-color: #fff3cd", "Cuti": "background-color: #f6c244",
+}
+LEGEND = "Cuti = cuti approved • Cuti? = cuti pending • CO = Change Off approved • CO? = Change Off pending • Libur = libur nasional • · = akhir pekan"
+
+def month_range(year: int, month: int):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+def _span_codes(spans: pd.DataFrame) -> np.ndarray:
+    approved = spans["status"].to_numpy() == "APPROVED"
+    leave = spans["type"].to_numpy() == "LEAVE"
+    return np.select([leave & approved, ~leave & approved, leave], [LEAVE_APPROVED, CO_APPROVED, LEAVE_PENDING],
+                     default=CO_PENDING)
+
+def build_matrix(members: pd.DataFrame, spans: pd.DataFrame, year: int, month: int,
+                 holidays: Optional[dict] = None) -> np.ndarray:
+    """Matriks kode (len(members) x hari dalam bulan).
+
+    members: kolom id (urutan baris matriks). spans: kolom user_id, type, status,
+    span_start, span_end (ISO date). holidays: {date: nama}.
+    """
+    first, last = month_range(year, month)
+    n_days = last.day
+    grid = np.zeros((len(members), n_days), dtype=np.int8)
+
+    # Kolom akhir pekan & libur nasional berlaku untuk semua baris
+    days = pd.date_range(first, last, freq="D")
+    base = np.where(days.dayofweek.to_numpy() >= 5, WEEKEND, EMPTY).astype(np.int8)
+    if holidays:
+        holiday_days = [d.day - 1 for d in holidays if first <= d <= last]
+        base[holiday_days] = HOLIDAY
+    grid[:] = base
+
+    if spans is None or spans.empty or members.empty:
+        return grid
+    row_of = pd.Series(np.arange(len(members)), index=members["id"].to_numpy())
+    spans = spans[spans["user_id"].isin(row_of.index)]
+    if spans.empty:
+        return grid
+    # Potong rentang ke batas bulan lalu jadikan offset hari (0-based)
+    start = (pd.to_datetime(spans["span_start"]).clip(lower=pd.Timestamp(first)) - pd.Timestamp(first)).dt.days.to_numpy()
+    end = (pd.to_datetime(spans["span_end"]).clip(upper=pd.Timestamp(last)) - pd.Timestamp(first)).dt.days.to_numpy()
+    valid = end >= start
+    start, end = start[valid], end[valid]
+    rows = row_of.loc[spans["user_id"].to_numpy()[valid]].to_numpy()
+    codes = _span_codes(spans[valid])
+
+    # Ekspansi interval: setiap rentang menjadi (end-start+1) sel
+    lengths = end - start + 1
+    total = int(lengths.sum())
+    run_start = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    cols = np.repeat(start, lengths) + (np.arange(total) - run_start)
+    cell_rows = np.repeat(rows, lengths)
+    np.maximum.at(grid, (cell_rows, cols), np.repeat(codes, lengths).astype(np.int8))
+    return grid
+
+def build_calendar(members: pd.DataFrame, spans: pd.DataFrame, year: int, month: int,
+                   holidays: Optional[dict] = None) -> pd.DataFrame:
+    """DataFrame label (baris = nama anggota + baris total 'Off', kolom = tanggal)."""
+    grid = build_matrix(members, spans, year, month, holidays)
+    labels = np.array([LABELS[c] for c in sorted(LABELS)], dtype=object)[grid]
+    first, last = month_range(year, month)
+    columns = [f"{d.day:02d} {d.strftime('%a')[:2]}" for d in pd.date_range(first, last, freq="D")]
+    names = members["name"] if not members.empty else pd.Series([], dtype=object)
+    if names.duplicated(keep=False).any():
+        names = names.where(~names.duplicated(keep=False), names + " (" + members["email"] + ")")
+    df = pd.DataFrame(labels, index=names.tolist(), columns=columns)
+    off = (grid >= CO_PENDING).sum(axis=0)
+    df.loc["Off (total)"] = [str(n) if n else "" for n in off]
+    return df
+
+def style_calendar(df: pd.DataFrame):
+    return df.style.map(lambda v: COLORS.get(v, ""))
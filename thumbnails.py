@@ -0,0 +1,176 @@
+"""Thumbnail halaman pertama lampiran PDF untuk antrian approval.
+
+Tidak ada renderer PDF di dependency kita (Pillow tidak bisa me-raster PDF),
+jadi thumbnail dibuat dari gambar JPEG (DCTDecode) pertama yang tertanam di
+file. Timesheet hasil scan/foto hampir selalu berbentuk satu gambar JPEG per
+halaman, dan gambar pertama di file adalah halaman pertama. Pencarian hanya
+membaca HRMS_THUMB_SCAN_BYTES pertama lewat mmap; gambar lebih kecil dari
+HRMS_THUMB_MIN_IMAGE_PX (logo, tanda tangan) dilewati. PDF tanpa gambar (hasil
+export dokumen) mendapat kartu placeholder berisi nama file dan jumlah halaman.
+
+Thumbnail disimpan sebagai JPEG di HRMS_THUMB_DIR dengan key sha256 isi file
+(preview.file_sha256), dibuat di thread pool (HRMS_THUMB_WORKERS) saat upload
+atau saat pertama kali diminta antrian.
+"""
+import io
+import os
+import re
+import mmap
+import hashlib
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Set
+
+import preview
+
+THUMB_DIR = os.environ.get("HRMS_THUMB_DIR", os.path.join("cache", "thumbnails"))
+THUMB_WIDTH = int(os.environ.get("HRMS_THUMB_WIDTH", 180))
+THUMB_SCAN_BYTES = int(os.environ.get("HRMS_THUMB_SCAN_BYTES", 16 * 1024 * 1024))
+THUMB_MIN_IMAGE_PX = int(os.environ.get("HRMS_THUMB_MIN_IMAGE_PX", 200))
+THUMB_WORKERS = int(os.environ.get("HRMS_THUMB_WORKERS", 2))
+THUMB_QUALITY = int(os.environ.get("HRMS_THUMB_QUALITY", 80))
+
+PAGE_RATIO = 1.414  # A4 potret
+_FORMAT_VERSION = 1
+
+_OBJ_RE = re.compile(rb"\d+\s+\d+\s+obj\b")
+_PAGE_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+_LENGTH_RE = re.compile(rb"/Length\s+(\d+)(?!\s+\d+\s+R)")
+
+_pool_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pending: Set[str] = set()
+
+def is_pdf(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() == ".pdf"
+
+def thumbnail_path(digest: str) -> str:
+    variant = hashlib.sha1(f"{_FORMAT_VERSION}:{THUMB_WIDTH}:{THUMB_QUALITY}".encode()).hexdigest()[:8]
+    return os.path.join(THUMB_DIR, digest[:2], f"{digest}-{variant}.jpg")
+
+def prune_cache(keep_digests: set) -> int:
+    """Hapus thumbnail yang sha256 PDF-nya tidak ada di keep_digests."""
+    return preview._prune_digest_dir(THUMB_DIR, keep_digests)
+
+# -------------------- PDF scan --------------------
+def _int_key(header: bytes, key: bytes) -> int:
+    m = re.search(rb"/" + key + rb"\s+(\d+)", header)
+    return int(m.group(1)) if m else 0
+
+def first_jpeg(data: bytes) -> Optional[bytes]:
+    """Stream JPEG (DCTDecode) pertama yang cukup besar di data PDF, atau None."""
+    for m in _OBJ_RE.finditer(data):
+        stream_at = data.find(b"stream", m.end())
+        end_obj = data.find(b"endobj", m.end())
+        if stream_at < 0:
+            break
+        if 0 <= end_obj < stream_at:
+            continue  # objek tanpa stream
+        header = data[m.end():stream_at]
+        if b"/DCTDecode" not in header or not re.search(rb"/Subtype\s*/Image", header):
+            continue
+        if min(_int_key(header, b"Width"), _int_key(header, b"Height")) < THUMB_MIN_IMAGE_PX:
+            continue
+        start = stream_at + len(b"stream")
+        start += 2 if data[start:start + 2] == b"\r\n" else 1
+        length = _LENGTH_RE.search(header)
+        end = start + int(length.group(1)) if length else data.find(b"endstream", start)
+        jpeg = data[start:end]
+        if jpeg[:2] == b"\xff\xd8":
+            return jpeg
+    return None
+
+def page_count(data: bytes) -> Optional[int]:
+    """Jumlah objek /Type /Page; None jika tidak terlihat (mis. di object stream terkompresi)."""
+    return len(_PAGE_RE.findall(data)) or None
+
+# -------------------- Render --------------------
+def _from_jpeg(jpeg: bytes):
+    from PIL import Image
+    img = Image.open(io.BytesIO(jpeg))
+    # draft: decoder JPEG langsung menurunkan skala (1/2, 1/4, 1/8) tanpa decode resolusi penuh
+    img.draft("RGB", (THUMB_WIDTH * 2, int(THUMB_WIDTH * PAGE_RATIO * 2)))
+    img = img.convert("RGB")
+    img.thumbnail((THUMB_WIDTH, int(THUMB_WIDTH * PAGE_RATIO * 1.5)))
+    return img
+
+def _placeholder(name: str, pages: Optional[int]):
+    from PIL import Image, ImageDraw
+    w, h = THUMB_WIDTH, int(THUMB_WIDTH * PAGE_RATIO)
+    img = Image.new("RGB", (w, h), "white")
+    draw = ImageDraw.Draw(img)
+    fold = w // 6
+    draw.polygon([(0, 0), (w - fold - 1, 0), (w - 1, fold), (w - 1, h - 1), (0, h - 1)], outline="#9aa4b2")
+    draw.line([(w - fold - 1, 0), (w - fold - 1, fold), (w - 1, fold)], fill="#9aa4b2")
+    draw.rectangle([10, h // 3, w - 10, h // 3 + 28], fill="#c0392b")
+    draw.text((18, h // 3 + 8), "PDF", fill="white")
+    lines = [name[i:i + 22] for i in range(0, min(len(name), 66), 22)]
+    if pages:
+        lines.append(f"{pages} halaman")
+    for i, line in enumerate(lines):
+        draw.text((12, h // 3 + 40 + i * 14), line, fill="#333333")
+    return img
+
+def render(path: str) -> str:
+    """Buat (atau ambil dari cache) thumbnail JPEG untuk satu PDF; kembalikan path thumbnail."""
+    target = thumbnail_path(preview.file_sha256(path))
+    if os.path.exists(target):
+        return target
+    size = os.path.getsize(path)
+    data = b""
+    if size:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[:THUMB_SCAN_BYTES]
+    img = None
+    jpeg = first_jpeg(data)
+    if jpeg:
+        try:
+            img = _from_jpeg(jpeg)
+        except Exception:  # JPEG rusak/format warna tidak didukung: jatuh ke placeholder
+            img = None
+    if img is None:
+        img = _placeholder(os.path.basename(path), page_count(data))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f"{target}.{threading.get_ident()}.tmp"
+    img.save(tmp, "JPEG", quality=THUMB_QUALITY, optimize=True)
+    os.replace(tmp, target)
+    return target
+
+# -------------------- Worker pool --------------------
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, THUMB_WORKERS), thread_name_prefix="hrms-thumb")
+        return _pool
+
+def _run(path: str):
+    try:
+        render(path)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        with _pool_lock:
+            _pending.discard(path)
+
+def schedule(path: str) -> bool:
+    """Antrekan pembuatan thumbnail di background; False jika bukan PDF atau sudah diantrekan."""
+    if not path or not is_pdf(path) or not os.path.exists(path):
+        return False
+    with _pool_lock:
+        if path in _pending:
+            return False
+        _pending.add(path)
+    _executor().submit(_run, path)
+    return True
+
+def cached(path: str) -> Optional[str]:
+    """Path thumbnail jika sudah ada; jika belum, antrekan pembuatannya dan kembalikan None."""
+    if not path or not is_pdf(path) or not os.path.exists(path):
+        return None
+    target = thumbnail_path(preview.file_sha256(path))
+    if os.path.exists(target):
+        return target
+    schedule(path)
+    return None
@@ -0,0 +1,266 @@
+"""Baca timesheet XLSX untuk mengisi otomatis jadwal Change Off.
+
+Workbook dibaca openpyxl read-only (streaming, maksimal HRMS_TIMESHEET_MAX_ROWS
+baris per sheet). Baris header dicari di HRMS_TIMESHEET_HEADER_SCAN baris pertama
+setiap sheet dan dicocokkan ke layout kolom: setiap layout memetakan field
+(tanggal, waktu_mulai, waktu_selesai, aktivitas, atau rentang "08:00-17:00")
+ke daftar alias header. Layout bawaan bisa ditambah/ditimpa lewat file JSON di
+HRMS_TIMESHEET_LAYOUTS:
+
+    {"vendor_a": {"tanggal": ["work date"], "waktu_mulai": ["in"], "waktu_selesai": ["out"],
+                  "aktivitas": ["task"]}}
+
+Beberapa baris di tanggal yang sama digabung (mulai paling awal, selesai paling
+akhir, aktivitas disambung). compare() menandai selisih antara jam yang diisi
+di form dan jam di file.
+"""
+import os
+import re
+import json
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+import service
+
+TIMESHEET_MAX_ROWS = int(os.environ.get("HRMS_TIMESHEET_MAX_ROWS", 500))
+TIMESHEET_HEADER_SCAN = int(os.environ.get("HRMS_TIMESHEET_HEADER_SCAN", 10))
+TIMESHEET_HOURS_TOLERANCE = float(os.environ.get("HRMS_TIMESHEET_HOURS_TOLERANCE", 0.25))  # jam
+TIMESHEET_LAYOUTS_PATH = os.environ.get("HRMS_TIMESHEET_LAYOUTS", "")
+
+FIELDS = ("tanggal", "waktu_mulai", "waktu_selesai", "aktivitas", "rentang")
+DEFAULT_LAYOUTS: Dict[str, Dict[str, List[str]]] = {
+    "standar": {
+        "tanggal": ["tanggal", "tgl", "date", "hari/tanggal"],
+        "waktu_mulai": ["waktu mulai", "jam mulai", "mulai", "start", "start time", "jam masuk", "masuk", "time in"],
+        "waktu_selesai": ["waktu selesai", "jam selesai", "selesai", "end", "end time", "jam keluar", "keluar",
+                          "pulang", "time out"],
+        "aktivitas": ["aktivitas", "detail aktivitas", "kegiatan", "uraian", "keterangan", "activity",
+                      "activities", "description", "task"],
+    },
+    "rentang": {
+        "tanggal": ["tanggal", "tgl", "date"],
+        "rentang": ["jam", "jam kerja", "waktu", "working hours", "time"],
+        "aktivitas": ["aktivitas", "kegiatan", "uraian", "keterangan", "activity", "description"],
+    },
+}
+
+_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d %b %Y", "%d %B %Y")
+_TIME_RE = re.compile(r"^\s*(\d{1,2})[:.](\d{2})(?::\d{2})?\s*$")
+_RANGE_RE = re.compile(r"^\s*(\d{1,2}[:.]\d{2})\s*(?:-|–|s/?d|to|sampai)\s*(\d{1,2}[:.]\d{2})\s*$", re.IGNORECASE)
+
+@dataclass
+class TimesheetDay:
+    tanggal: str
+    waktu_mulai: Optional[str]
+    waktu_selesai: Optional[str]
+    aktivitas: str
+    rows: List[int] = field(default_factory=list)
+
+    @property
+    def hours(self) -> Optional[float]:
+        if not self.waktu_mulai or not self.waktu_selesai:
+            return None
+        return service.activity_hours(self.waktu_mulai, self.waktu_selesai)
+
+@dataclass
+class TimesheetParse:
+    layout: Optional[str] = None
+    sheet: Optional[str] = None
+    header_row: Optional[int] = None
+    days: List[TimesheetDay] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.days)
+
+    def day(self, d: date) -> Optional[TimesheetDay]:
+        key = d.isoformat()
+        return next((x for x in self.days if x.tanggal == key), None)
+
+    @property
+    def first_date(self) -> Optional[date]:
+        return date.fromisoformat(self.days[0].tanggal) if self.days else None
+
+    @property
+    def last_date(self) -> Optional[date]:
+        return date.fromisoformat(self.days[-1].tanggal) if self.days else None
+
+# -------------------- Layout --------------------
+def _norm(value) -> str:
+    return re.sub(r"\s+", " ", str(value or "").strip().lower().replace("_", " "))
+
+def load_layouts(path: Optional[str] = None) -> Dict[str, Dict[str, List[str]]]:
+    """Layout bawaan + layout dari file JSON (nama sama menimpa bawaan)."""
+    layouts = {name: dict(spec) for name, spec in DEFAULT_LAYOUTS.items()}
+    path = TIMESHEET_LAYOUTS_PATH if path is None else path
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                custom = json.load(f)
+        except (OSError, ValueError) as e:
+            raise service.ValidationError(f"HRMS_TIMESHEET_LAYOUTS tidak bisa dibaca: {e}") from e
+        for name, spec in custom.items():
+            unknown = set(spec) - set(FIELDS)
+            if unknown:
+                raise service.ValidationError(f"Layout {name}: field tidak dikenal {sorted(unknown)}")
+            layouts[name] = {k: [v] if isinstance(v, str) else list(v) for k, v in spec.items()}
+    return layouts
+
+def _match_layout(header: list, layouts: dict):
+    """(nama layout, {field: index kolom}) terbaik untuk satu baris header, atau (None, {})."""
+    cells = [_norm(c) for c in header]
+    best = (None, {})
+    for name, spec in layouts.items():
+        columns = {}
+        for fld, aliases in spec.items():
+            wanted = {_norm(a) for a in aliases}
+            idx = next((i for i, c in enumerate(cells) if c in wanted and i not in columns.values()), None)
+            if idx is not None:
+                columns[fld] = idx
+        has_time = ("waktu_mulai" in columns and "waktu_selesai" in columns) or "rentang" in columns
+        if "tanggal" in columns and has_time and len(columns) > len(best[1]):
+            best = (name, columns)
+    return best
+
+# -------------------- Parsing sel --------------------
+def parse_date(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value or "").strip()
+    if not text:
+        return None
+    text = text.split(",")[-1].strip()  # "Senin, 02/11/2026"
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_time(value) -> Optional[str]:
+    """Nilai sel (time, datetime, pecahan hari Excel, atau teks 8:00/08.00) → HH:MM."""
+    if isinstance(value, datetime):
+        value = value.time()
+    if isinstance(value, time):
+        return value.strftime("%H:%M")
+    if isinstance(value, timedelta):
+        minutes = round(value.total_seconds() / 60)
+        return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value < 1:
+        minutes = round(value * 24 * 60)
+        return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+    m = _TIME_RE.match(str(value or ""))
+    if m and int(m.group(1)) < 24 and int(m.group(2)) < 60:
+        return f"{int(m.group(1)):02d}:{m.group(2)}"
+    return None
+
+def _parse_range(value):
+    m = _RANGE_RE.match(str(value or ""))
+    return (parse_time(m.group(1)), parse_time(m.group(2))) if m else (None, None)
+
+# -------------------- Workbook --------------------
+def parse_xlsx(fileobj, layouts: Optional[dict] = None) -> TimesheetParse:
+    """Cari sheet + header pertama yang cocok dengan salah satu layout lalu baca baris per tanggal."""
+    from openpyxl import load_workbook
+    layouts = layouts or load_layouts()
+    result = TimesheetParse()
+    try:
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception as e:  # bukan XLSX valid
+        result.warnings.append(f"File tidak bisa dibaca sebagai XLSX: {e}")
+        return result
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(max_row=TIMESHEET_MAX_ROWS, values_only=True)
+            columns = None
+            for number, values in enumerate(rows, start=1):
+                if columns is None:
+                    if number > TIMESHEET_HEADER_SCAN:
+                        break
+                    result.layout, columns = _match_layout(list(values), layouts)
+                    if result.layout:
+                        result.sheet, result.header_row = ws.title, number
+                    else:
+                        columns = None
+                    continue
+                _read_row(result, number, values, columns)
+            if columns is not None:
+                if ws.max_row and ws.max_row > TIMESHEET_MAX_ROWS:
+                    result.warnings.append(f"Hanya {TIMESHEET_MAX_ROWS} baris pertama yang dibaca.")
+                break
+    finally:
+        wb.close()
+    if result.layout is None:
+        result.warnings.append("Header timesheet tidak dikenali (butuh kolom tanggal dan jam mulai/selesai).")
+    result.days.sort(key=lambda d: d.tanggal)
+    return result
+
+def _read_row(result: TimesheetParse, number: int, values: tuple, columns: dict):
+    def cell(fld):
+        idx = columns.get(fld)
+        return values[idx] if idx is not None and idx < len(values) else None
+
+    if all(v in (None, "") for v in values):
+        return
+    tanggal = parse_date(cell("tanggal"))
+    if tanggal is None:
+        if cell("tanggal") not in (None, ""):
+            result.warnings.append(f"Baris {number}: tanggal tidak dikenali ({cell('tanggal')!r}).")
+        return
+    if "rentang" in columns:
+        start, end = _parse_range(cell("rentang"))
+    else:
+        start, end = parse_time(cell("waktu_mulai")), parse_time(cell("waktu_selesai"))
+    if not start or not end:
+        result.warnings.append(f"Baris {number}: jam mulai/selesai tidak dikenali.")
+    activity = str(cell("aktivitas") or "").strip()
+    day = result.day(tanggal)
+    if day is None:
+        result.days.append(TimesheetDay(tanggal.isoformat(), start, end, activity, [number]))
+        return
+    # Tanggal yang sama di beberapa baris: gabungkan
+    day.rows.append(number)
+    if start and (not day.waktu_mulai or start < day.waktu_mulai):
+        day.waktu_mulai = start
+    if end and (not day.waktu_selesai or end > day.waktu_selesai):
+        day.waktu_selesai = end
+    if activity:
+        day.aktivitas = f"{day.aktivitas}; {activity}" if day.aktivitas else activity
+
+# -------------------- Perbandingan --------------------
+def compare(activities: List[dict], parsed: TimesheetParse, tolerance: float = None) -> List[str]:
+    """Selisih antara aktivitas di form (format submit_changeoff) dan timesheet."""
+    tolerance = TIMESHEET_HOURS_TOLERANCE if tolerance is None else tolerance
+    if not parsed.ok:
+        return []
+    issues = []
+    declared_total = file_total = 0.0
+    declared_dates = set()
+    for act in activities:
+        declared_dates.add(act["tanggal"])
+        try:
+            declared = service.activity_hours(act["waktu_mulai"], act["waktu_selesai"])
+        except service.ValidationError:
+            continue  # format jam salah sudah ditolak saat submit
+        declared_total += declared
+        day = parsed.day(date.fromisoformat(act["tanggal"]))
+        if day is None:
+            issues.append(f"Hari {act['hari']} ({act['tanggal']}): tidak ada di timesheet.")
+            continue
+        if day.hours is None:
+            continue
+        file_total += day.hours
+        if abs(declared - day.hours) > tolerance:
+            issues.append(f"Hari {act['hari']} ({act['tanggal']}): form {declared:.2f} jam, "
+                          f"timesheet {day.hours:.2f} jam ({day.waktu_mulai}-{day.waktu_selesai}).")
+    outside = [d.tanggal for d in parsed.days if d.tanggal not in declared_dates]
+    if outside:
+        issues.append("Tanggal di timesheet di luar periode form: " + ", ".join(outside[:10])
+                      + (" …" if len(outside) > 10 else ""))
+    if abs(declared_total - file_total) > tolerance:
+        issues.append(f"Total: form {declared_total:.2f} jam, timesheet {file_total:.2f} jam.")
+    return issues
@@ -0,0 +1,282 @@
+"""Import massal user + kuota awal dari CSV/XLSX.
+
+File dibaca streaming (csv.reader / openpyxl read-only), setiap baris
+divalidasi dan error dilaporkan per nomor baris. Email manager di-resolve
+dengan satu query, password di-hash paralel di thread pool per potongan
+HRMS_IMPORT_HASH_CHUNK baris (scrypt/PBKDF2 melepas GIL, jadi biaya hash yang
+sengaja mahal terbagi ke semua core; progress dilaporkan per potongan), lalu
+user dan kuota awal di-insert dengan executemany dalam satu transaksi.
+
+Dry run cukup cepat untuk dijalankan langsung di request Streamlit; import
+sebenarnya dijalankan job "users.import" (jobs.py) dari file yang disimpan
+stage_upload() di HRMS_IMPORT_DIR.
+
+Kolom: email, name, role, division, manager_email, password, leave_total, changeoff_earned
+(role default EMPLOYEE; leave_total default DEFAULT_LEAVE_TOTAL; changeoff_earned default 0).
+"""
+import io
+import os
+import re
+import csv
+import uuid
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import service
+
+IMPORT_MAX_ROWS = int(os.environ.get("HRMS_IMPORT_MAX_ROWS", 20000))
+IMPORT_HASH_WORKERS = int(os.environ.get("HRMS_IMPORT_HASH_WORKERS", min(8, os.cpu_count() or 1)))
+IMPORT_HASH_CHUNK = int(os.environ.get("HRMS_IMPORT_HASH_CHUNK", 64))
+IMPORT_DIR = os.environ.get("HRMS_IMPORT_DIR", "imports")
+IMPORT_MAX_RESULT_ERRORS = 500  # error per baris yang disimpan di hasil job
+
+COLUMNS = ["email", "name", "role", "division", "manager_email", "password", "leave_total", "changeoff_earned"]
+REQUIRED_COLUMNS = ("email", "name", "password")
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+@dataclass
+class ImportRowError:
+    row: int
+    email: str
+    error: str
+
+@dataclass
+class ImportReport:
+    total_rows: int = 0
+    valid_rows: int = 0
+    inserted: int = 0
+    dry_run: bool = True
+    errors: List[ImportRowError] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def as_result(self) -> dict:
+        """Ringkasan JSON untuk hasil job (error dipotong IMPORT_MAX_RESULT_ERRORS)."""
+        return {"total_rows": self.total_rows, "valid_rows": self.valid_rows, "inserted": self.inserted,
+                "error_count": len(self.errors), "errors": [e.__dict__ for e in self.errors[:IMPORT_MAX_RESULT_ERRORS]]}
+
+    @classmethod
+    def from_result(cls, result: dict) -> "ImportReport":
+        return cls(total_rows=result.get("total_rows", 0), valid_rows=result.get("valid_rows", 0),
+                   inserted=result.get("inserted", 0), dry_run=False,
+                   errors=[ImportRowError(**e) for e in result.get("errors") or []])
+
+    def error_csv(self) -> bytes:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["row", "email", "error"])
+        writer.writerows((e.row, e.email, e.error) for e in self.errors)
+        return buf.getvalue().encode("utf-8-sig")
+
+# -------------------- Reader --------------------
+def _normalize_header(header) -> List[str]:
+    return [str(h or "").strip().lower().replace(" ", "_") for h in header]
+
+def _iter_csv(fileobj) -> Iterator[Tuple[int, dict]]:
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.reader(text)
+        header = _normalize_header(next(reader, []))
+        for number, values in enumerate(reader, start=2):
+            if any(v.strip() for v in values):
+                yield number, dict(zip(header, values))
+    finally:
+        text.detach()  # jangan ikut menutup file milik pemanggil
+
+def _iter_xlsx(fileobj) -> Iterator[Tuple[int, dict]]:
+    from openpyxl import load_workbook
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = _normalize_header(next(rows, ()))
+        for number, values in enumerate(rows, start=2):
+            if any(v not in (None, "") for v in values):
+                yield number, dict(zip(header, values))
+    finally:
+        wb.close()
+
+def iter_rows(fileobj, filename: str) -> Iterator[Tuple[int, dict]]:
+    """(nomor baris di file, dict kolom) — nomor baris 1 adalah header."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".csv":
+        return _iter_csv(fileobj)
+    if ext in (".xlsx", ".xlsm"):
+        return _iter_xlsx(fileobj)
+    raise service.ValidationError("Format file harus .csv atau .xlsx")
+
+# -------------------- Validasi --------------------
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+def _non_negative_int(value, column: str, default: int) -> int:
+    if _text(value) == "":
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise service.ValidationError(f"{column} harus berupa angka")
+    if number < 0 or number != int(number):
+        raise service.ValidationError(f"{column} harus bilangan bulat >= 0")
+    return int(number)
+
+def _parse_row(raw: dict) -> dict:
+    row = {
+        "email": _text(raw.get("email")),
+        "name": _text(raw.get("name")),
+        "role": _text(raw.get("role")).upper() or "EMPLOYEE",
+        "division": _text(raw.get("division")) or None,
+        "manager_email": _text(raw.get("manager_email")) or None,
+        "password": _text(raw.get("password")),
+    }
+    service._validate_user(row["email"], row["name"], row["role"])
+    if not _EMAIL_RE.match(row["email"]):
+        raise service.ValidationError("Format email tidak valid")
+    if not row["password"]:
+        raise service.ValidationError("Password wajib diisi.")
+    if row["manager_email"] == row["email"]:
+        raise service.ValidationError("User tidak bisa menjadi manager untuk dirinya sendiri.")
+    row["leave_total"] = _non_negative_int(raw.get("leave_total"), "leave_total", service.DEFAULT_LEAVE_TOTAL)
+    row["changeoff_earned"] = _non_negative_int(raw.get("changeoff_earned"), "changeoff_earned", 0)
+    return row
+
+def _hierarchy_levels(rows: List[dict]) -> dict:
+    """email → jumlah atasan yang juga ada di file; None jika rantai manager di file melingkar."""
+    managers = {r["email"]: r["manager_email"] for r in rows}
+    levels = {}
+    for email in managers:
+        chain, current = [], email
+        while current in managers and current not in levels and current not in chain:
+            chain.append(current)
+            current = managers[current]
+        if current in chain:
+            base = None
+        else:
+            base = levels[current] if current in levels else -1  # -1: atasan sudah ada di database / root
+        for node in reversed(chain):
+            base = None if base is None else base + 1
+            levels[node] = base
+    return levels
+
+# -------------------- Import --------------------
+def _hash_passwords(passwords: List[str], progress: Optional[Callable[[int, int], None]] = None) -> List[str]:
+    """Hash paralel per potongan IMPORT_HASH_CHUNK; progress(selesai, total) setelah tiap potongan."""
+    chunk = max(1, IMPORT_HASH_CHUNK)
+    hashes = []
+    with ThreadPoolExecutor(max_workers=max(1, IMPORT_HASH_WORKERS)) as pool:
+        for start in range(0, len(passwords), chunk):
+            hashes.extend(pool.map(service.hash_pw, passwords[start:start + chunk]))
+            if progress:
+                progress(len(hashes), len(passwords))
+    return hashes
+
+def _insert(valid: List[Tuple[int, dict]], existing: dict, year: int,
+            progress: Optional[Callable[[int, int], None]] = None) -> int:
+    hashes = _hash_passwords([r["password"] for _, r in valid], progress)
+    now = datetime.utcnow().isoformat()
+    with service.transaction() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany("""INSERT INTO users(email,name,role,manager_id,password_hash,created_at,updated_at,division)
+                           VALUES(?,?,?,?,?,?,?,?)""",
+                        [(r["email"], r["name"], r["role"], existing.get(r["manager_email"]), pw, now, now, r["division"])
+                         for (_, r), pw in zip(valid, hashes)])
+        # Manager yang baru dibuat di file yang sama: isi manager_id setelah semua user ada
+        cur.executemany("UPDATE users SET manager_id=(SELECT id FROM users WHERE email=?) WHERE email=?",
+                        [(r["manager_email"], r["email"]) for _, r in valid
+                         if r["manager_email"] and r["manager_email"] not in existing])
+        # Tambah closure hanya untuk user baru; atasan diproses lebih dulu supaya rantai
+        # di dalam file (A -> B -> C) bisa menyalin closure atasannya (lihat service._closure_insert)
+        levels = _hierarchy_levels([r for _, r in valid])
+        ordered = sorted((r for _, r in valid), key=lambda r: levels[r["email"]])
+        cur.executemany("INSERT INTO org_closure(ancestor, descendant, depth) SELECT id, id, 0 FROM users WHERE email=?",
+                        [(r["email"],) for r in ordered])
+        cur.executemany("""INSERT OR IGNORE INTO org_closure(ancestor, descendant, depth)
+                           SELECT oc.ancestor, u.id, oc.depth + 1
+                           FROM users u JOIN org_closure oc ON oc.descendant = u.manager_id
+                           WHERE u.email=?""",
+                        [(r["email"],) for r in ordered if r["manager_email"]])
+        # User baru tidak punya saldo tahun lalu: tandai sudah di-rollover supaya cron rollover melewatinya
+        cur.executemany("""INSERT INTO quotas(user_id,year,leave_total,leave_used,changeoff_earned,changeoff_used,created_at,updated_at,
+                                              rollover_at)
+                           SELECT id, ?, ?, 0, ?, 0, ?, ?, ? FROM users WHERE email=?""",
+                        [(year, r["leave_total"], r["changeoff_earned"], now, now, now, r["email"]) for _, r in valid])
+    return len(valid)
+
+def import_users(fileobj, filename: str, year: Optional[int] = None, dry_run: bool = True,
+                 progress: Optional[Callable[[int, int], None]] = None) -> ImportReport:
+    """Validasi (dan jika dry_run=False, simpan) user dari file.
+
+    Import bersifat all-or-nothing: jika ada baris yang error, tidak ada yang disimpan
+    dan laporan berisi error per baris. progress(selesai, total) dipanggil selama hashing password.
+    """
+    year = int(year or service.current_year())
+    report = ImportReport(dry_run=dry_run)
+    parsed, seen = [], {}
+    for number, raw in iter_rows(fileobj, filename):
+        report.total_rows += 1
+        if report.total_rows > IMPORT_MAX_ROWS:
+            raise service.ValidationError(f"Maksimal {IMPORT_MAX_ROWS} baris per import")
+        if report.total_rows == 1:
+            missing = [c for c in REQUIRED_COLUMNS if c not in raw]
+            if missing:
+                raise service.ValidationError(f"Kolom wajib tidak ada: {', '.join(missing)}")
+        try:
+            row = _parse_row(raw)
+        except service.ServiceError as e:
+            report.errors.append(ImportRowError(number, _text(raw.get("email")), str(e)))
+            continue
+        if row["email"] in seen:
+            report.errors.append(ImportRowError(number, row["email"], f"Email duplikat dengan baris {seen[row['email']]}"))
+            continue
+        seen[row["email"]] = number
+        parsed.append((number, row))
+
+    # Satu query untuk email user + manager yang sudah ada di database
+    existing = service.resolve_user_ids(list(seen) + [r["manager_email"] for _, r in parsed if r["manager_email"]])
+    valid = []
+    for number, row in parsed:
+        if row["email"] in existing:
+            report.errors.append(ImportRowError(number, row["email"], "Email sudah digunakan."))
+        elif row["manager_email"] and row["manager_email"] not in existing and row["manager_email"] not in seen:
+            report.errors.append(ImportRowError(number, row["email"], f"Manager tidak ditemukan: {row['manager_email']}"))
+        else:
+            valid.append((number, row))
+    levels = _hierarchy_levels([r for _, r in valid])
+    for number, row in valid:
+        if levels[row["email"]] is None:
+            report.errors.append(ImportRowError(number, row["email"], "Hierarki manager di file melingkar."))
+    valid = [(number, row) for number, row in valid if levels[row["email"]] is not None]
+    report.valid_rows = len(valid)
+    report.errors.sort(key=lambda e: e.row)
+    if dry_run or report.errors or not valid:
+        return report
+    try:
+        report.inserted = _insert(valid, existing, year, progress)
+    except sqlite3.IntegrityError as e:
+        raise service.DuplicateEmail("Import dibatalkan: email sudah digunakan (dibuat bersamaan oleh proses lain).") from e
+    return report
+
+# -------------------- Job --------------------
+def stage_upload(data: bytes, filename: str) -> str:
+    """Simpan file upload untuk diproses job users.import; kembalikan path-nya."""
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_DIR, f"{uuid.uuid4().hex}{os.path.splitext(filename)[1].lower()}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def import_staged(path: str, filename: str, year: int,
+                  progress: Optional[Callable[[int, int], None]] = None) -> ImportReport:
+    """Import file hasil stage_upload() lalu hapus file-nya."""
+    try:
+        with open(path, "rb") as f:
+            return import_users(f, filename, year, dry_run=False, progress=progress)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass